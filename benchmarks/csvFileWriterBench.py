@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+import argparse
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import lsst.daf.base as dafBase
+from lsst.datarel.csvFileWriter import CsvFileWriter
+
+
+class BaselineCsvFileWriter(object):
+    """The CsvFileWriter this package started out with, which quotes each
+    field with a method call and prints each row to a (gzip) file object.
+    Only close() has been added, so that it can be timed like the current
+    writer.
+    """
+
+    def __init__(self, path, overwrite=True, compress=True):
+        if compress:
+            self.f = gzip.open(path + ".gz", "w" if overwrite else "a")
+        else:
+            self.f = open(path, "w" if overwrite else "a")
+
+    def __del__(self):
+        self.f.close()
+
+    def close(self):
+        self.f.close()
+
+    def flush(self):
+        self.f.flush()
+
+    def quote(self, value):
+        if value is None:
+            return '\N'
+        if isinstance(value, float):
+            return "%.17g" % (value,)
+        if isinstance(value, str):
+            value = re.sub(r'"', r'\"', value)
+            return '"' + value.strip() + '"'
+        if isinstance(value, dafBase.DateTime):
+            value = value.toString(dafBase.DateTime.UTC)
+            return '"' + value[0:10] + ' ' + value[11:19] + '"'
+        return str(value)
+
+    def write(self, *fields):
+        print(",".join([self.quote(field) for field in fields]), file=self.f)
+
+
+def metadataRows(n):
+    """Generate n rows resembling *_Exposure_Metadata FITS header records.
+    """
+    for i in xrange(n):
+        expId = 1234567890L + i // 100
+        key = 'KEY%d' % (i % 100)
+        if i % 3 == 0:
+            yield expId, key, 1, i, None, None
+        elif i % 3 == 1:
+            yield expId, key, 1, None, i * 0.25, None
+        else:
+            yield expId, key, 1, None, None, 'value "%d"' % i
+
+
+def bench(label, writerClass, path, rows, **kwargs):
+    w = writerClass(path, **kwargs)
+    t = time.time()
+    for r in rows:
+        w.write(*r)
+    w.close()
+    t = time.time() - t
+    print('{:<32} {:>12.0f} rows/sec'.format(label, len(rows) / t))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures CsvFileWriter throughput for "
+                                     "metadata-like rows, with and without a column schema, "
+                                     "against the original quote()/print() based writer.")
+    parser.add_argument("-n", "--rows", dest="rows", type=int, default=1000000,
+                        help="Number of rows to write (defaults to %(default)d)")
+    parser.add_argument("-z", "--compress", dest="compress", action="store_true",
+                        help="Gzip compress output")
+    ns = parser.parse_args()
+    rows = list(metadataRows(ns.rows))
+    columns = [long, str, int, int, float, str]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'bench.csv')
+        bench('baseline', BaselineCsvFileWriter, path, rows, compress=ns.compress)
+        bench('untyped, unbuffered', CsvFileWriter, path, rows, compress=ns.compress, bufferRows=1)
+        bench('untyped, buffered', CsvFileWriter, path, rows, compress=ns.compress)
+        bench('typed, buffered', CsvFileWriter, path, rows, compress=ns.compress, columns=columns)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+import argparse
+import random
+import time
+
+from lsst.datarel.datasetScanner import parseDataIdRules, _RuleMatcher
+
+rafts = ['0,1', '0,2', '0,3', '1,0', '1,1', '1,2', '1,3', '1,4', '2,0', '2,1', '2,2',
+         '2,3', '2,4', '3,0', '3,1', '3,2', '3,3', '3,4', '4,1', '4,2', '4,3']
+sensors = ['0,0', '0,1', '0,2', '1,0', '1,1', '1,2', '2,0', '2,1', '2,2']
+
+
+def makeRules(n):
+    """Return n random lsstSim rules, each selecting a short visit range
+    and a few rafts, like the --id specifications of a reprocessing run.
+    """
+    rules = []
+    for i in xrange(n):
+        visit = random.randint(0, 100000)
+        rules.append(parseDataIdRules([
+            'visit={}..{}'.format(visit, visit + random.randint(0, 20)),
+            'raft=' + '^'.join(random.sample(rafts, random.randint(1, 4))),
+        ], 'lsstSim'))
+    return rules
+
+
+def makeDataIds(n):
+    return [dict(visit=random.randint(0, 100000), raft=random.choice(rafts),
+                 sensor=random.choice(sensors)) for i in xrange(n)]
+
+
+def filterRules(rules, dataId):
+    """Rule filtering as previously done by HfsScanner.walk."""
+    for k in dataId:
+        newRules = []
+        for r in rules:
+            if k not in r or dataId[k] in r[k]:
+                newRules.append(r)
+        rules = newRules
+    return rules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the cost of narrowing a list of "
+                                     "dataId rules by rebuilding rule lists against the "
+                                     "compiled rule matcher used by HfsScanner.")
+    parser.add_argument("-r", "--rules", dest="rules", type=int, default=1000,
+                        help="Number of rules (defaults to %(default)d)")
+    parser.add_argument("-n", "--dataids", dest="dataIds", type=int, default=10000,
+                        help="Number of dataIds to match (defaults to %(default)d)")
+    ns = parser.parse_args()
+    random.seed(12345)
+    rules = makeRules(ns.rules)
+    dataIds = makeDataIds(ns.dataIds)
+
+    t = time.time()
+    expected = [len(filterRules(rules, d)) for d in dataIds]
+    tList = time.time() - t
+
+    t = time.time()
+    matcher = _RuleMatcher(rules)
+    tCompile = time.time() - t
+    t = time.time()
+    got = [bin(matcher.match(matcher.all, d)).count('1') for d in dataIds]
+    tMatcher = time.time() - t
+    if got != expected:
+        raise RuntimeError('Rule matcher results differ from list filtering')
+
+    print('{} rules, {} dataIds, {} matches'.format(
+        len(rules), len(dataIds), sum(1 for n in got if n)))
+    print('list filtering {:10.0f} dataIds/sec'.format(len(dataIds) / tList))
+    print('rule matcher   {:10.0f} dataIds/sec (compiled in {:.3f} sec)'.format(
+        len(dataIds) / tMatcher, tCompile))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+import argparse
+import collections
+import os
+import shutil
+import tempfile
+import time
+
+import lsst.datarel.datasetScanner as datasetScanner
+
+template = 'calexp/v%(visit)d-f%(filter)s/R%(raft)s/S%(sensor)s.fits'
+rafts = ['01', '02', '03', '10', '11', '12', '13', '14', '20', '21', '22',
+         '23', '24', '30', '31', '32', '33', '34', '41', '42', '43']
+sensors = ['00', '01', '02', '10', '11', '12', '20', '21', '22']
+
+
+def makeTree(root, n):
+    """Create a synthetic calexp repository with (about) n empty files.
+    """
+    perVisit = len(rafts) * len(sensors)
+    for visit in xrange((n + perVisit - 1) // perVisit):
+        for raft in rafts:
+            d = os.path.join(root, 'calexp', 'v%d-fr' % visit, 'R' + raft)
+            os.makedirs(d)
+            for sensor in sensors:
+                open(os.path.join(d, 'S%s.fits' % sensor), 'w').close()
+
+
+class CallCounter(object):
+    """Counts calls to the file system functions used by the scanner,
+    by wrapping them in the modules they are looked up from.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.saved = []
+
+    def wrap(self, module, name, label):
+        fn = getattr(module, name)
+        if fn is None:
+            return
+
+        def counted(*args, **kwargs):
+            self.counts[label] += 1
+            return fn(*args, **kwargs)
+        self.saved.append((module, name, fn))
+        setattr(module, name, counted)
+
+    def __enter__(self):
+        self.wrap(os, 'stat', 'stat')
+        self.wrap(os, 'lstat', 'lstat')
+        self.wrap(os, 'listdir', 'listdir')
+        self.wrap(datasetScanner, '_scandir', 'scandir')
+        return self
+
+    def __exit__(self, *args):
+        for module, name, fn in reversed(self.saved):
+            setattr(module, name, fn)
+
+
+class AllocationCounter(object):
+    """Counts dataId munger calls, and the dicts allocated to hold dataIds
+    along with the number of entries stored in them, by wrapping the
+    mungers of a scanner and the scanner functions that return dataIds.
+    A dict returned by a wrapped function is counted once, as allocated by
+    the innermost wrapped function returning it, unless it is one of that
+    function's arguments. Its entries are counted when the outermost
+    wrapped call returns.
+    """
+
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.counts = collections.Counter()
+        self.saved = []
+        self.depth = 0
+        self.allocated = []
+
+    def wrap(self, obj, name, label):
+        fn = getattr(obj, name, None)
+        if fn is None:
+            return
+
+        def counted(*args):
+            self.depth += 1
+            try:
+                result = fn(*args)
+            finally:
+                self.depth -= 1
+            self.counts[label] += 1
+            if isinstance(result, dict) and not any(result is a for a in args) and \
+                    not any(result is d for d in self.allocated):
+                self.allocated.append(result)
+            if self.depth == 0:
+                self.counts['dicts'] += len(self.allocated)
+                self.counts['entries'] += sum(len(d) for d in self.allocated)
+                del self.allocated[:]
+            return result
+        self.saved.append((obj, name, fn, name in vars(obj)))
+        setattr(obj, name, counted)
+
+    def __enter__(self):
+        for fk in self.scanner._formatKeys.itervalues():
+            self.wrap(fk, 'munge', 'munger')
+        self.wrap(self.scanner, '_matchName', 'match')
+        self.wrap(datasetScanner, '_materialize', 'materialize')
+        return self
+
+    def __exit__(self, *args):
+        for obj, name, fn, own in reversed(self.saved):
+            if own:
+                setattr(obj, name, fn)
+            else:
+                delattr(obj, name)
+
+
+def makeScanner(camera):
+    """Return a scanner for the synthetic repository, using the dataId
+    mungers of the given camera if it is not None.
+    """
+    scanner = datasetScanner.HfsScanner(template)
+    if camera is not None:
+        for fk in scanner._formatKeys.itervalues():
+            fk.munge = datasetScanner._mungeFunctions[camera]
+    return scanner
+
+
+def bench(label, root, threads, camera):
+    scanner = makeScanner(camera)
+    with CallCounter() as c:
+        t = time.time()
+        n = sum(1 for r in scanner.walk(root, threads=threads))
+        t = time.time() - t
+    calls = ', '.join('{} {}'.format(c.counts[k], k) for k in sorted(c.counts))
+    print('{:<24} {:>9} files {:>8.2f} sec   {}'.format(label, n, t, calls))
+
+
+def benchAllocations(root, threads, camera):
+    scanner = makeScanner(camera)
+    with AllocationCounter(scanner) as c:
+        n = sum(1 for r in scanner.walk(root, threads=threads))
+    n = float(max(n, 1))
+    print('{:<24} per file: {:.2f} munger calls, {:.2f} dataId dicts allocated '
+          'holding {:.2f} entries'.format('allocations', c.counts['munger'] / n,
+                                          c.counts['dicts'] / n, c.counts['entries'] / n))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures HfsScanner.walk wall time and file "
+                                     "system call counts on a synthetic repository, with and "
+                                     "without directory entry type information from scandir, "
+                                     "and the number of dataId munger calls and dict "
+                                     "allocations per file found.")
+    parser.add_argument("-n", "--files", dest="files", type=int, default=1000000,
+                        help="Number of files in the synthetic repository (defaults to %(default)d)")
+    parser.add_argument("-t", "--threads", dest="threads", type=int, default=1,
+                        help="Number of scanner threads (defaults to %(default)d)")
+    parser.add_argument("-r", "--root", dest="root", default=None,
+                        help="Existing synthetic repository to reuse; if omitted, a temporary "
+                             "repository is created and removed afterwards")
+    parser.add_argument("-c", "--camera", dest="camera", default=None,
+                        choices=sorted(datasetScanner._mungeFunctions),
+                        help="Use the dataId mungers of the given camera instead of the "
+                             "generic string/integer mungers")
+    ns = parser.parse_args()
+    root = ns.root
+    if root is None:
+        root = tempfile.mkdtemp()
+        print('Creating {} files in {}'.format(ns.files, root))
+        makeTree(root, ns.files)
+    try:
+        scandir = datasetScanner._scandir
+        if scandir is not None:
+            bench('scandir', root, ns.threads, ns.camera)
+        datasetScanner._scandir = None
+        try:
+            bench('listdir + stat', root, ns.threads, ns.camera)
+        finally:
+            datasetScanner._scandir = scandir
+        benchAllocations(root, ns.threads, ns.camera)
+    finally:
+        if ns.root is None:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+import argparse
+import random
+import time
+
+import numpy
+
+import lsst.daf.base as dafBase
+from lsst.datarel.skyCorners import exposureSkyCorners, _afwSkyCorners
+
+
+def makeHeaders(n):
+    """Return n random amplifier-sized FITS headers with a TAN WCS."""
+    mds = []
+    for i in xrange(n):
+        md = dafBase.PropertySet()
+        scale = 0.2 / 3600.0
+        theta = random.uniform(0.0, 2.0 * numpy.pi)
+        md.set('NAXIS1', 513)
+        md.set('NAXIS2', 2001)
+        md.set('CTYPE1', 'RA---TAN')
+        md.set('CTYPE2', 'DEC--TAN')
+        md.set('RADESYS', 'ICRS')
+        md.set('EQUINOX', 2000.0)
+        md.set('CRPIX1', random.uniform(-3000.0, 3000.0))
+        md.set('CRPIX2', random.uniform(-3000.0, 3000.0))
+        md.set('CRVAL1', random.uniform(0.0, 360.0))
+        md.set('CRVAL2', random.uniform(-89.0, 89.0))
+        md.set('CD1_1', -scale * numpy.cos(theta))
+        md.set('CD1_2', scale * numpy.sin(theta))
+        md.set('CD2_1', scale * numpy.sin(theta))
+        md.set('CD2_2', scale * numpy.cos(theta))
+        mds.append(md)
+    return mds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the cost of computing exposure "
+                                     "center and corner sky coordinates point by point with "
+                                     "afw against the vectorized TAN projection, called once "
+                                     "per exposure (as ingestProcessed.py does) and once for "
+                                     "all exposures (as ingestRaw_ImSim.py does per sensor).")
+    parser.add_argument("-n", "--exposures", dest="exposures", type=int, default=2000,
+                        help="Number of exposures (defaults to %(default)d)")
+    ns = parser.parse_args()
+    random.seed(12345)
+    mds = makeHeaders(ns.exposures)
+    # processed exposures are typically sub-images with a non-zero origin
+    origins = [(random.randint(0, 4000), random.randint(0, 4000)) for md in mds]
+    u = numpy.array([0.5, 0.0, 0.0, 1.0, 1.0])
+    v = numpy.array([0.5, 0.0, 1.0, 1.0, 0.0])
+
+    t = time.time()
+    expected = numpy.array([_afwSkyCorners(md, x0 + u * md.get('NAXIS1') - 0.5,
+                                           y0 + v * md.get('NAXIS2') - 0.5)
+                            for md, (x0, y0) in zip(mds, origins)])
+    tAfw = time.time() - t
+
+    t = time.time()
+    single = numpy.array([exposureSkyCorners([md], [origin])[0] for md, origin in zip(mds, origins)])
+    tSingle = time.time() - t
+
+    t = time.time()
+    batch = exposureSkyCorners(mds, origins)
+    tBatch = time.time() - t
+
+    print('{} exposures'.format(len(mds)))
+    for name, got, dt in (('afw', expected, tAfw),
+                          ('per exposure', single, tSingle),
+                          ('batched', batch, tBatch)):
+        diff = numpy.abs(got - expected)
+        diff[..., 0] = numpy.minimum(diff[..., 0], 360.0 - diff[..., 0])
+        print('{:<13} {:10.0f} exposures/sec, max difference {:.3g} arcsec'.format(
+            name, len(mds) / dt, diff.max() * 3600.0))
+
+if __name__ == '__main__':
+    main()
@@ -22,12 +22,17 @@
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
 
+from __future__ import with_statement
 from __future__ import print_function
+from contextlib import closing
 import argparse
+import Queue
 import string
 import sys
+import threading
+import time
 
-from lsst.datarel.mysqlExecutor import MysqlExecutor, addDbOptions
+from lsst.datarel.mysqlExecutor import MysqlExecutor, addDbOptions, sortBufferSize
 from prepareDb import loadTables
 import transposeMetadata
 
@@ -141,6 +146,80 @@ def findInconsistentMetadataTypes(sql, camera):
     return needsFix
 
 
+def _enableKeysWorker(sql, tasks, done, bufferSize):
+    while True:
+        try:
+            table = tasks.get_nowait()
+        except Queue.Empty:
+            return
+        stmt = str.format("SET SESSION myisam_sort_buffer_size={}; ALTER TABLE {} ENABLE KEYS;",
+                          bufferSize, table)
+        t = time.time()
+        try:
+            if sql.useClient:
+                sql.execStmt(stmt)
+            else:
+                with sql.connection() as conn:
+                    with closing(conn.cursor()) as cursor:
+                        cursor.execute(stmt)
+                        while cursor.nextset() is not None:
+                            pass
+            error = None
+        except Exception as e:
+            error = e
+        done.put((table, time.time() - t, error))
+
+
+def enableKeys(sql, tables, threads=4, sortMemory=None):
+    """Enable the indexes of the given tables, rebuilding up to threads of
+    them concurrently, each over its own connection. The sort buffer memory
+    (see sortBufferSize) is divided among the rebuilds actually run at the
+    same time, which may be fewer than threads. Tables that do not exist
+    and views are skipped, and larger tables are started first. The time
+    taken for each table is printed as it finishes.
+
+    @raise RuntimeError if enabling the indexes of any table failed,
+           after all tables have been processed
+    """
+    with sql.connection() as conn:
+        with closing(conn.cursor()) as cursor:
+            cursor.execute("SELECT table_name, data_length FROM information_schema.tables "
+                           "WHERE table_schema=%s AND table_type='BASE TABLE'", (sql.database,))
+            sizes = dict(cursor.fetchall())
+    tables = sorted(set(t for t in tables if t in sizes), key=lambda t: sizes[t] or 0, reverse=True)
+    if not tables:
+        return
+    numWorkers = min(max(1, threads), len(tables))
+    bufferSize = sortBufferSize(sql.host, numWorkers, sortMemory)
+    print(str.format("Enabling keys on {} tables with {} threads, myisam_sort_buffer_size={}",
+                     len(tables), numWorkers, bufferSize))
+    sys.stdout.flush()
+    tasks = Queue.Queue()
+    for table in tables:
+        tasks.put(table)
+    done = Queue.Queue()
+    workers = [threading.Thread(target=_enableKeysWorker, args=(sql, tasks, done, bufferSize))
+               for i in xrange(numWorkers)]
+    for w in workers:
+        w.daemon = True
+        w.start()
+    errors = []
+    t = time.time()
+    for i in xrange(len(tables)):
+        table, seconds, error = done.get()
+        if error is not None:
+            print(str.format("*** Failed to enable keys on {}: {}", table, error), file=sys.stderr)
+            errors.append(table)
+        else:
+            print(str.format("Enabled keys on {} in {:.3f} sec", table, seconds))
+        sys.stdout.flush()
+    for w in workers:
+        w.join()
+    print(str.format("Enabled keys on {} tables in {:.3f} sec", len(tables) - len(errors), time.time() - t))
+    if errors:
+        raise RuntimeError("Failed to enable keys on " + ", ".join(errors))
+
+
 def main():
     parser = argparse.ArgumentParser(description="Program which runs post-processing steps on an LSST run "
                                      "database, including enabling the table indexes that prepareDb.py "
@@ -154,12 +233,20 @@ def main():
         "-t", "--transpose", action="store_true", dest="transpose",
         help="Flag that causes key-value metadata tables to be transposed to "
              "column-per-value metadata tables for easier metadata queries.")
+    parser.add_argument(
+        "--index-threads", default=4, type=int, dest="indexThreads",
+        help="Maximum number of tables whose indexes are rebuilt concurrently (%(default)d).")
+    parser.add_argument(
+        "--sort-memory", default=None, type=int, dest="sortMemory",
+        help="Total MiB of MyISAM sort buffer memory, divided among the index rebuild "
+             "threads. Defaults to half of the available memory if the database server "
+             "runs on this host, and to 4096 otherwise.")
     parser.add_argument("database", help="Name of database to post-process.")
 
     ns = parser.parse_args()
     if ns.user is None:
         parser.error("No database user name specified and $USER is undefined or empty")
-    sql = MysqlExecutor(ns.host, ns.database, ns.user, ns.port)
+    sql = MysqlExecutor(ns.host, ns.database, ns.user, ns.port, useClient=ns.useClient)
     camera = ns.camera.lower()
     if camera not in loadTables:
         parser.error("Unknown camera: {}. Choices (not case sensitive): {}".format(
@@ -167,11 +254,7 @@ def main():
     # Enable indexes on tables for faster queries
     tables = loadTables[camera] + ["Logs", "RunSource", "RunObject",
                                    "RunGoodSeeingSource", "RunGoodSeeingForcedSource"]
-    for table in tables:
-        if sql.isView(table) or not sql.exists(table):
-            continue
-        sql.execStmt(str.format("SET myisam_sort_buffer_size=1000000000; "
-                                "ALTER TABLE {} ENABLE KEYS;", table))
+    enableKeys(sql, tables, ns.indexThreads, ns.sortMemory)
     # fixup metadata tables if necessary
     fixTables = findInconsistentMetadataTypes(sql, camera)
     if len(fixTables) > 0:
@@ -23,20 +23,32 @@
 #
 
 from __future__ import print_function
+from contextlib import closing
 import math
+import multiprocessing
 import os
-import subprocess
+import Queue
+import shutil
 import sys
+import threading
 
 import lsst.daf.base as dafBase
 import lsst.daf.persistence as dafPersistence
 import lsst.afw.image as afwImage
 
-from lsst.datarel.csvFileWriter import CsvFileWriter
+from lsst.datarel.columnFileWriter import mergeColumnDirectories
+from lsst.datarel.csvFileWriter import getCsvOptions
 from lsst.datarel.mysqlExecutor import MysqlExecutor
 from lsst.datarel.ingest import makeArgumentParser, makeRules
 from lsst.datarel.datasetScanner import getMapperClass, DatasetScanner
-from lsst.datarel.utils import getPsf
+from lsst.datarel.fifoLoader import FifoLoader
+from lsst.datarel.htm import HtmIndexWriter
+from lsst.datarel.manifest import ChunkManifest
+from lsst.datarel.parallelLoader import ParallelLoader
+from lsst.datarel.scanIndex import ScanIndex
+from lsst.datarel.skyCorners import exposureSkyCorners
+import lsst.datarel.tableSpecs as tableSpecs
+from lsst.datarel.utils import getPsf, ExposureReader, SortedIdSet
 
 # Hack to be able to read multiShapelet configs
 try:
@@ -44,11 +56,6 @@ try:
 except:
     pass
 
-if 'SCISQL_DIR' not in os.environ:
-    print('Please setup the scisql package and try again', file=sys.stderr)
-    sys.exit(1)
-
-scisqlIndex = os.path.join(os.environ['SCISQL_DIR'], 'bin', 'scisql_index')
 sigmaToFwhm = 2.0*math.sqrt(2.0*math.log(2.0))
 # 4/2/4 bytes for intensity/mask/variance
 bytesPerPixel = 4 + 2 + 4
@@ -62,58 +69,57 @@ minExposureSize = {
     'cfht': bytesPerPixel*1*1,  # TODO: what dimensions are appropriate here?
 }
 
-
 class CsvGenerator(object):
 
-    def __init__(self, namespace, compress=True):
+    def __init__(self, namespace, csvOptions={}, shard=None, butlers=None):
         self.namespace = namespace
         self.camera = namespace.camera
-        self.expFile = CsvFileWriter(
-            os.path.join(namespace.outroot, 'Science_Ccd_Exposure.csv'),
-            compress=compress)
-        self.mdFile = CsvFileWriter(
-            os.path.join(namespace.outroot, 'Science_Ccd_Exposure_Metadata.csv'),
-            compress=compress)
-        self.polyFile = open(
-            os.path.join(namespace.outroot, 'Science_Ccd_Exposure_Poly.tsv'), 'wb')
-
-    def csvAll(self, sql=None):
+        self.butlers = butlers if butlers is not None else {}
+        self.expFile = tableSpecs.scienceCcdExposure(self.camera).openWriter(
+            _shardPath(namespace.outroot, 'Science_Ccd_Exposure.csv', shard), **csvOptions)
+        self.mdFile = tableSpecs.scienceCcdExposureMetadata.openWriter(
+            _shardPath(namespace.outroot, 'Science_Ccd_Exposure_Metadata.csv', shard), **csvOptions)
+        self.htmFile = HtmIndexWriter(
+            _shardPath(namespace.outroot, 'Science_Ccd_Exposure_To_Htm10.tsv', shard), 10)
+
+    def writeHeader(self):
+        """Write column name header line for calexp metadata CSV.
+        """
+        self.mdFile.writeHeader(*tableSpecs.scienceCcdExposureMetadata.names)
+
+    def getButler(self, root):
+        """Return a data butler for the given input root, creating it
+        on first use.
+        """
+        if root not in self.butlers:
+            cameraMapper = makeMapper(self.namespace, root)
+            butler = dafPersistence.ButlerFactory(mapper=cameraMapper).create()
+            self.butlers[root] = butler
+        return self.butlers[root]
+
+    def csvAll(self, loadedIds=None):
         """Extract/compute metadata for all single frame exposures matching
         at least one data ID specification, and store it in CSV files.
+        Exposures with IDs in loadedIds have already been loaded and are
+        skipped.
         """
-        # Writer column name header line for calexp metadata CSV
-        self.mdFile.write('scienceCcdExposureId', 'metadataKey', 'exposureType',
-                          'intValue', 'doubleValue', 'stringValue')
-        conn = sql.getConn() if sql else None
-        cursor = conn.cursor() if conn else None
-        # Loop over input roots
-        for root in self.namespace.inroot:
-            print('Ingesting from ' + root)
-            if hasattr(self.namespace, 'registry'):
-                registry = self.namespace.registry
-            else:
-                registry = os.path.join(root, 'registry.sqlite3')
-            cls = getMapperClass(self.camera)
-            cameraMapper = cls(root=root, registry=registry)
-            butler = dafPersistence.ButlerFactory(mapper=cameraMapper).create()
-            scanner = DatasetScanner(dataset='calexp',
-                                     camera=self.camera,
-                                     cameraMapper=cameraMapper)
-            # scan the root for matching calexps
-            for path, dataId in scanner.walk(root, self.namespace.rules):
-                self.toCsv(butler, root, path, dataId, cursor)
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
-        self.expFile.flush()
-        self.mdFile.flush()
-        self.polyFile.flush()
-        self.polyFile.close()
-
-    def toCsv(self, butler, root, path, dataId, cursor):
+        try:
+            self.writeHeader()
+            # Loop over input roots
+            for root, path, dataId in scanAll(self.namespace):
+                self.toCsv(self.getButler(root), root, path, dataId, loadedIds)
+        finally:
+            self.close()
+
+    def close(self):
+        self.expFile.close()
+        self.mdFile.close()
+        self.htmFile.close()
+
+    def toCsv(self, butler, root, path, dataId, loadedIds=None):
         """Extract/compute metadata for a single frame exposure, and
-        store it in CSV files.
+        store it in CSV files. Exposures with IDs in loadedIds have
+        already been loaded and are skipped.
         """
         filename = os.path.join(root, path)
         if os.stat(filename).st_size < minExposureSize[self.camera]:
@@ -125,31 +131,27 @@ class CsvGenerator(object):
                 raise RuntimeError(msg)
         scienceCcdExposureId = butler.get('ccdExposureId', dataId=dataId)
         # Check whether exposure has already been loaded
-        if cursor:
-            cursor.execute(str.format(
-                'SELECT COUNT(*) FROM Science_Ccd_Exposure WHERE scienceCcdExposureId = {}',
-                str(scienceCcdExposureId)))
-            if cursor.fetchall()[0][0] == 1:
+        if loadedIds is not None:
+            if scienceCcdExposureId in loadedIds:
                 msg = '{} : already loaded'.format(dataId)
                 if not self.namespace.strict:
                     print('*** Skipping ' + msg, file=sys.stderr)
                     return
                 else:
                     raise RuntimeError(msg)
-        # try to get PSF
-        psf = getPsf(butler, "calexp", dataId=dataId, strict=self.namespace.strict, warn=True)
-        # read image metadata and extract WCS/geometry metadata
-        md = afwImage.readMetadata(filename)
+        # read image metadata and try to get PSF, opening the file once
+        with ExposureReader(filename) as reader:
+            md = reader.readMetadata()
+            psf = getPsf(butler, "calexp", dataId=dataId, strict=self.namespace.strict, warn=True,
+                         reader=reader)
+        # extract WCS/geometry metadata
         x0 = -md.get('LTV1') if md.exists('LTV1') else 0
         y0 = -md.get('LTV2') if md.exists('LTV2') else 0
         width = md.get('NAXIS1')
         height = md.get('NAXIS2')
         wcs = afwImage.makeWcs(md.deepCopy())
-        cen = wcs.pixelToSky(x0 + 0.5*width - 0.5, y0 + 0.5*height - 0.5).toIcrs()
-        corner1 = wcs.pixelToSky(x0 - 0.5, y0 - 0.5).toIcrs()
-        corner2 = wcs.pixelToSky(x0 - 0.5, y0 + height - 0.5).toIcrs()
-        corner3 = wcs.pixelToSky(x0 + width - 0.5, y0 + height - 0.5).toIcrs()
-        corner4 = wcs.pixelToSky(x0 + width - 0.5, y0 - 0.5).toIcrs()
+        # ICRS (ra, dec) of center and corners, in degrees
+        cen, corner1, corner2, corner3, corner4 = exposureSkyCorners([md], [(x0, y0)])[0].tolist()
         # compute FWHM
         fwhm = psf.computeShape().getDeterminantRadius() * wcs.pixelScale().asArcseconds() * sigmaToFwhm
         # Build array of column values for one Science_Ccd_Exposure metadata row
@@ -183,17 +185,17 @@ class CsvGenerator(object):
             ])
         # WCS/geometry columns are the same across cameras
         record.extend([
-            cen.getRa().asDegrees(), cen.getDec().asDegrees(),
+            cen[0], cen[1],
             md.get('EQUINOX'), md.get('RADESYS'),
             md.get('CTYPE1'), md.get('CTYPE2'),
             md.get('CRPIX1'), md.get('CRPIX2'),
             md.get('CRVAL1'), md.get('CRVAL2'),
             md.get('CD1_1'), md.get('CD1_2'),
             md.get('CD2_1'), md.get('CD2_2'),
-            corner1.getRa().asDegrees(), corner1.getDec().asDegrees(),
-            corner2.getRa().asDegrees(), corner2.getDec().asDegrees(),
-            corner3.getRa().asDegrees(), corner3.getDec().asDegrees(),
-            corner4.getRa().asDegrees(), corner4.getDec().asDegrees(),
+            corner1[0], corner1[1],
+            corner2[0], corner2[1],
+            corner3[0], corner3[1],
+            corner4[0], corner4[1],
             obsStart.get(dafBase.DateTime.MJD, dafBase.DateTime.TAI),
             obsStart,
             md.get('TIME-MID'),
@@ -215,89 +217,390 @@ class CsvGenerator(object):
                 self.mdFile.write(scienceCcdExposureId, name, 1, None, md.getDouble(name), None)
             else:
                 self.mdFile.write(scienceCcdExposureId, name, 1, None, None, str(md.get(name)))
-        # Write out 4 corner TSV record.
-        self.polyFile.write('\t'.join([
-            str(scienceCcdExposureId),
-            repr(corner1.getRa().asDegrees()), repr(corner1.getDec().asDegrees()),
-            repr(corner2.getRa().asDegrees()), repr(corner2.getDec().asDegrees()),
-            repr(corner3.getRa().asDegrees()), repr(corner3.getDec().asDegrees()),
-            repr(corner4.getRa().asDegrees()), repr(corner4.getDec().asDegrees())]))
-        self.polyFile.write('\n')
+        # Write out level 10 HTM IDs of the 4 corner polygon
+        self.htmFile.write(scienceCcdExposureId,
+                           [corner1[0], corner2[0], corner3[0], corner4[0]],
+                           [corner1[1], corner2[1], corner3[1], corner4[1]])
         print('Processed {}'.format(dataId))
 
 
-def dbLoad(ns, sql):
-    """Load CSV files produced by CsvGenerator into database tables.
+def _shardPath(outroot, name, shard):
+    """Return the path of a (possibly sharded) output file.
+    """
+    if shard is not None:
+        base, ext = os.path.splitext(name)
+        name = '{}-{}{}'.format(base, shard, ext)
+    return os.path.join(outroot, name)
+
+
+def makeMapper(namespace, root):
+    """Return a camera mapper for the given input root.
+    """
+    if hasattr(namespace, 'registry'):
+        registry = namespace.registry
+    else:
+        registry = os.path.join(root, 'registry.sqlite3')
+    cls = getMapperClass(namespace.camera)
+    return cls(root=root, registry=registry)
+
+
+def makeScanner(namespace, root):
+    """Return a calexp scanner for the given input root.
+    """
+    print('Ingesting from ' + root)
+    return DatasetScanner(dataset='calexp',
+                          camera=namespace.camera,
+                          cameraMapper=makeMapper(namespace, root))
+
+
+def scanRoot(namespace, root, index=None):
+    """Generator over (path, dataId) tuples for all calexps in the given
+    input root matching at least one data ID specification. The order of
+    the results only depends on the input: a serial scan yields them in
+    walk order, and a scan with several threads, which finds them in a
+    scheduling dependent order, yields them sorted by path.
+    """
+    # scan in the background, overlapping directory reads with
+    # whatever the consumer does with the results
+    results = makeScanner(namespace, root).backgroundWalk(
+        root, namespace.rules, namespace.scanThreads, index)
+    try:
+        if namespace.scanThreads > 1:
+            for path, dataId in sorted(results):
+                yield path, dataId
+        else:
+            for path, dataId in results:
+                yield path, dataId
+    finally:
+        results.close()
+
+
+def scanAll(namespace):
+    """Generator over (root, path, dataId) tuples for all calexps in the
+    input roots matching at least one data ID specification, in input
+    root order (see scanRoot).
+    """
+    index = None
+    if namespace.scanIndex is not None:
+        index = ScanIndex(namespace.scanIndex)
+    try:
+        for root in namespace.inroot:
+            for path, dataId in scanRoot(namespace, root, index):
+                yield root, path, dataId
+    finally:
+        if index is not None:
+            index.close()
+
+
+def getLoadedIds(sql):
+    """Return the set of scienceCcdExposureIds already present in the
+    database, or None if there is no database to check.
+    """
+    if sql is None:
+        return None
+    return SortedIdSet(row[0] for row in sql.iterQuery(
+        'SELECT scienceCcdExposureId FROM Science_Ccd_Exposure '
+        'ORDER BY scienceCcdExposureId'))
+
+
+# Number of exposures handed to a CSV worker process at a time. Each batch
+# is written to its own shard.
+_batchSize = 256
+
+
+def _rootShard(rootIndex, batch):
+    """Return the shard holding the given batch of exposures from the given
+    input root."""
+    return '{}.{}'.format(rootIndex, batch)
+
+
+def _csvWorker(namespace, csvOptions, queue, loadedIds):
+    """Process pool worker: converts the batches of exposures read from
+    queue to CSV shard files until a None sentinel is received.
+    """
+    butlers = {}
+    for rootIndex, batch, root, items in iter(queue.get, None):
+        c = CsvGenerator(namespace, csvOptions, _rootShard(rootIndex, batch), butlers)
+        try:
+            for path, dataId in items:
+                c.toCsv(c.getButler(root), root, path, dataId, loadedIds)
+        finally:
+            c.close()
+
+
+def _putTask(queue, task, workers):
+    """Put task on the queue read by the given worker processes, waiting
+    for space as long as at least one of them is alive.
+    """
+    while True:
+        try:
+            queue.put(task, True, 1.0)
+            return
+        except Queue.Full:
+            if not any(w.is_alive() for w in workers):
+                raise RuntimeError('All CSV worker processes have exited')
+
+
+def _scanRoots(namespace, put):
+    """Scan the input roots concurrently, calling put with a (root index,
+    batch index, root, batch) tuple for each consecutive batch of up to
+    _batchSize (path, dataId) tuples found in a root (see scanRoot). At
+    most namespace.scanRoots roots are scanned at a time. Returns a list
+    containing the number of batches found in each root.
+    """
+    index = None
+    if namespace.scanIndex is not None:
+        index = ScanIndex(namespace.scanIndex)
+    slots = threading.BoundedSemaphore(namespace.scanRoots)
+    errors = []
+    numBatches = [0] * len(namespace.inroot)
+
+    def scan(rootIndex, root):
+        with slots:
+            try:
+                batch = []
+                for item in scanRoot(namespace, root, index):
+                    batch.append(item)
+                    if len(batch) == _batchSize:
+                        put((rootIndex, numBatches[rootIndex], root, batch))
+                        numBatches[rootIndex] += 1
+                        batch = []
+                if batch:
+                    put((rootIndex, numBatches[rootIndex], root, batch))
+                    numBatches[rootIndex] += 1
+            except Exception as e:
+                print('*** Failed to scan {}: {}'.format(root, e), file=sys.stderr)
+                errors.append(root)
+
+    threads = [threading.Thread(target=scan, args=(i, root))
+               for i, root in enumerate(namespace.inroot)]
+    try:
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        if index is not None:
+            index.close()
+    if errors:
+        raise RuntimeError('Failed to scan ' + ', '.join(errors))
+    return numBatches
+
+
+def csvAllParallel(namespace, csvOptions, loadedIds=None):
+    """Parallel version of CsvGenerator.csvAll. Input roots are scanned
+    concurrently (see _scanRoots), and batches of consecutive exposures
+    from a root are converted by namespace.jobs worker processes, each
+    batch to its own CSV shard. The shards are then concatenated in input
+    root order, then batch order (gzip members concatenate to a valid gzip
+    stream). Which worker converts a batch does not matter, so the output
+    rows are the same, in the same order, as those of a serial run.
+    Exposures with IDs in loadedIds have already been loaded and are
+    skipped.
+    """
+    jobs = namespace.jobs
+    # shard 0 holds the metadata CSV header line
+    c = CsvGenerator(namespace, csvOptions, 0)
+    c.writeHeader()
+    c.close()
+    # Workers are forked, so the loaded ID set is shared rather than copied.
+    # Bound the number of queued batches, so that scans do not run
+    # arbitrarily far ahead of conversion.
+    queue = multiprocessing.Queue(4 * jobs)
+    workers = [multiprocessing.Process(target=_csvWorker,
+                                       args=(namespace, csvOptions, queue, loadedIds))
+               for i in xrange(jobs)]
+    for w in workers:
+        w.start()
+    try:
+        numBatches = _scanRoots(namespace, lambda task: _putTask(queue, task, workers))
+    finally:
+        try:
+            for w in workers:
+                _putTask(queue, None, workers)
+        finally:
+            for w in workers:
+                w.join()
+    failed = [w for w in workers if w.exitcode != 0]
+    if failed:
+        raise RuntimeError('{} of {} CSV worker processes failed'.format(len(failed), jobs))
+    # merge shards in input root order, then batch order
+    shards = [0]
+    for rootIndex, n in enumerate(numBatches):
+        shards.extend(_rootShard(rootIndex, batch) for batch in xrange(n))
+    gz = '.gz' if csvOptions.get('compress', True) else ''
+    format = csvOptions.get('format', 'csv')
+    for name in ('Science_Ccd_Exposure.csv', 'Science_Ccd_Exposure_Metadata.csv'):
+        if format != 'columns':
+            _mergeShards(namespace.outroot, name, gz, shards)
+        if format != 'csv':
+            mergeColumnDirectories(os.path.join(namespace.outroot, name),
+                                   [_shardPath(namespace.outroot, name, shard) for shard in shards])
+    _mergeShards(namespace.outroot, 'Science_Ccd_Exposure_To_Htm10.tsv', '', shards)
+
+
+def _mergeShards(outroot, name, suffix, shards):
+    """Concatenate and remove the given shards of an output file.
+    """
+    with open(os.path.join(outroot, name) + suffix, 'wb') as dest:
+        for shard in shards:
+            path = _shardPath(outroot, name, shard) + suffix
+            with open(path, 'rb') as src:
+                shutil.copyfileobj(src, dest, 1 << 20)
+            os.remove(path)
+
+
+def csvLoads(ns, shard=None):
+    """Return a list of (CSV file path, LOAD statement) tuples for the CSV
+    files produced by CsvGenerator.
+    """
+    return [tableSpecs.scienceCcdExposure(ns.camera).load(
+                _shardPath(ns.outroot, 'Science_Ccd_Exposure.csv', shard)),
+            tableSpecs.scienceCcdExposureMetadata.load(
+                _shardPath(ns.outroot, 'Science_Ccd_Exposure_Metadata.csv', shard))]
+
+
+def htmLoad(ns, shard=None):
+    """Return a (TSV file path, LOAD statement) tuple for the HTM IDs
+    of exposure polygons written by CsvGenerator.
+    """
+    return tableSpecs.scienceCcdExposureToHtm10.load(
+        _shardPath(ns.outroot, 'Science_Ccd_Exposure_To_Htm10.tsv', shard))
+
+
+def dbLoad(ns, sql, streamed=False):
+    """Load CSV files produced by CsvGenerator into database tables. If
+    streamed is True, the CSV files have already been loaded (see FifoLoader)
+    and only the HTM index is loaded.
+    """
+    loads = [] if streamed else csvLoads(ns)
+    loads.append(htmLoad(ns))
+    ParallelLoader(sql, ns.loadThreads).run(loads)
+
+
+def _chunkShard(i):
+    return 'chunk{}'.format(i)
+
+
+def _csvChunk(i, items, namespace, csvOptions, loadedIds, butlers=None):
+    """Write the CSV files for chunk i, containing the given exposures.
+    Return a dict mapping output file names to row counts.
+    """
+    c = CsvGenerator(namespace, csvOptions, _chunkShard(i), butlers)
+    try:
+        c.writeHeader()
+        for root, path, dataId in items:
+            c.toCsv(c.getButler(root), root, path, dataId, loadedIds)
+    finally:
+        c.close()
+    return {'Science_Ccd_Exposure.csv': c.expFile.numRows,
+            'Science_Ccd_Exposure_Metadata.csv': c.mdFile.numRows,
+            'Science_Ccd_Exposure_To_Htm10.tsv': c.htmFile.numIds}
+
+
+# Per-process state of chunk pool workers
+_chunkWorker = {}
+
+
+def _initChunkWorker(namespace, csvOptions, loadedIds):
+    _chunkWorker.update(namespace=namespace, csvOptions=csvOptions,
+                        loadedIds=loadedIds, butlers={})
+
+
+def _csvChunkTask(task):
+    i, items = task
+    w = _chunkWorker
+    return i, _csvChunk(i, items, w['namespace'], w['csvOptions'], w['loadedIds'], w['butlers'])
+
+
+def _deleteRows(sql, spec, path):
+    """Delete the rows with the exposure IDs in the file at path from the
+    table it is loaded into.
+    """
+    ids = spec.readIds(path)
+    print('Deleting rows of {} exposures from {}'.format(len(ids), spec.table))
+    with sql.connection() as conn:
+        with closing(conn.cursor()) as cursor:
+            for stmt in spec.deleteStatements(ids):
+                cursor.execute(stmt)
+        conn.commit()
+
+
+def loadChunk(ns, sql, manifest, i):
+    """Load the CSV files of chunk i, skipping any that were loaded by a
+    previous (interrupted) run, and record progress in the manifest. Rows
+    from files whose load was interrupted are deleted before they are
+    loaded again, since not all of the tables have a unique key that
+    would make reloading them idempotent.
+    """
+    shard = _chunkShard(i)
+    specs = [(tableSpecs.scienceCcdExposure(ns.camera), 'Science_Ccd_Exposure.csv'),
+             (tableSpecs.scienceCcdExposureMetadata, 'Science_Ccd_Exposure_Metadata.csv'),
+             (tableSpecs.scienceCcdExposureToHtm10, 'Science_Ccd_Exposure_To_Htm10.tsv')]
+    interrupted = manifest.beginLoad(i)
+    loads = []
+    for spec, name in specs:
+        if name in manifest.chunks[i]['loaded']:
+            continue
+        path = _shardPath(ns.outroot, name, shard)
+        if interrupted:
+            _deleteRows(sql, spec, path)
+        loads.append(spec.load(path))
+
+    def loaded(result):
+        manifest.fileLoaded(i, os.path.basename(result.path))
+
+    ParallelLoader(sql, ns.loadThreads).run(loads, loaded)
+    manifest.endLoad(i)
+
+
+def csvAllChunked(namespace, csvOptions, sql=None):
+    """Resumable version of CsvGenerator.csvAll. Exposures are processed in
+    chunks of namespace.chunkSize, each written to its own set of CSV files
+    and, if sql is not None, loaded as soon as it is complete. Progress is
+    recorded in a manifest (see lsst.datarel.manifest.ChunkManifest) in the
+    output directory. When re-run after an interruption, the input roots
+    are not re-scanned, and only unfinished chunks are written and loaded.
+    If namespace.jobs > 1, chunks are written by a pool of worker processes.
+    With --format columns or both, column files are likewise written per
+    chunk, and are not merged.
     """
-    camera = ns.camera
-    # Generate HTM IDs for 4-corner polygons
-    subprocess.call([scisqlIndex, '-l', '10',
-                     os.path.join(ns.outroot, 'Science_Ccd_Exposure_To_Htm10.tsv'),
-                     os.path.join(ns.outroot, 'Science_Ccd_Exposure_Poly.tsv')])
-    # Build Science_Ccd_Exposure LOAD statement
-    loadStmt = str.format("""
-        LOAD DATA LOCAL INFILE '{}'
-        INTO TABLE Science_Ccd_Exposure
-        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' (
-            scienceCcdExposureId,
-            """,
-                          os.path.abspath(os.path.join(ns.outroot, 'Science_Ccd_Exposure.csv')))
-    # ... ID columns are camera specific
-    if camera == 'lsstsim':
-        loadStmt += 'visit, raft, raftName, ccd, ccdName, filterId, filterName,'
-    elif camera == 'cfht':
-        loadStmt += 'visit, ccd, ccdName, filterId, filterName,'
-    elif camera == 'sdss':
-        loadStmt += 'run, camcol, filterId, field, filterName,'
-    loadStmt += """
-            ra, decl,
-            equinox, raDeSys,
-            ctype1, ctype2,
-            crpix1, crpix2,
-            crval1, crval2,
-            cd1_1, cd1_2, cd2_1, cd2_2,
-            corner1Ra, corner1Decl,
-            corner2Ra, corner2Decl,
-            corner3Ra, corner3Decl,
-            corner4Ra, corner4Decl,
-            taiMjd, obsStart, expMidpt, expTime,
-            nCombine, binX, binY,"""
-    # ... and SDSS doesn't go through CCD assembly/ISR
-    if camera in ('lsstsim', 'cfht'):
-        loadStmt += """
-            readNoise, saturationLimit, gainEff,"""
-    loadStmt += """
-            fluxMag0, fluxMag0Sigma, fwhm, path
-        ) SET htmId20 = scisql_s2HtmId(ra, decl, 20),
-              poly = scisql_s2CPolyToBin(corner1Ra, corner1Decl,
-                                         corner2Ra, corner2Decl,
-                                         corner3Ra, corner3Decl,
-                                         corner4Ra, corner4Decl);
-        SHOW WARNINGS;"""
-    # Load Science_Ccd_Exposure table
-    sql.execStmt(loadStmt)
-    # Load Science_Ccd_Exposure_Metadata table with key,value pairs from FITS headers
-    sql.execStmt(str.format("""
-        LOAD DATA LOCAL INFILE '{}'
-        INTO TABLE Science_Ccd_Exposure_Metadata
-        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
-        IGNORE 1 LINES (
-            scienceCcdExposureId,
-            metadataKey,
-            exposureType,
-            intValue,
-            doubleValue,
-            stringValue);
-        SHOW WARNINGS;
-        """, os.path.abspath(os.path.join(ns.outroot, 'Science_Ccd_Exposure_Metadata.csv'))))
-    # Load HTM indexes for 4-corner polygons
-    sql.execStmt(str.format("""
-        LOAD DATA LOCAL INFILE '{}'
-        INTO TABLE Science_Ccd_Exposure_To_Htm10 (
-            scienceCcdExposureId,
-            htmId10);
-        SHOW WARNINGS;
-        """, os.path.abspath(os.path.join(ns.outroot, 'Science_Ccd_Exposure_To_Htm10.tsv'))))
+    manifest = ChunkManifest(
+        os.path.join(namespace.outroot, 'ingestProcessed_manifest.json'),
+        dict(camera=namespace.camera, inroot=namespace.inroot, id=namespace.id,
+             registry=namespace.registry, chunkSize=namespace.chunkSize))
+    if manifest.scanned:
+        print('Resuming ingest: {} of {} chunks written'.format(
+            len(manifest.chunks) - len(manifest.withStatus('pending')), len(manifest.chunks)))
+    else:
+        manifest.setItems([list(t) for t in scanAll(namespace)], namespace.chunkSize)
+    if sql is not None:
+        for i in manifest.withStatus('loading') + manifest.withStatus('written'):
+            loadChunk(namespace, sql, manifest, i)
+    loadedIds = getLoadedIds(sql)
+    tasks = [(i, manifest.chunkItems(i)) for i in manifest.withStatus('pending')]
+    pool = None
+    if namespace.jobs > 1:
+        pool = multiprocessing.Pool(namespace.jobs, _initChunkWorker,
+                                    (namespace, csvOptions, loadedIds))
+        results = pool.imap_unordered(_csvChunkTask, tasks)
+    else:
+        butlers = {}
+        results = ((i, _csvChunk(i, items, namespace, csvOptions, loadedIds, butlers))
+                   for i, items in tasks)
+    try:
+        for i, rows in results:
+            manifest.chunks[i]['rows'] = rows
+            manifest.chunks[i]['status'] = 'written'
+            manifest.save()
+            if sql is not None:
+                loadChunk(namespace, sql, manifest, i)
+    finally:
+        if pool is not None:
+            # all results have been consumed unless an error occurred
+            pool.terminate()
+            pool.join()
 
 
 _validKeys = {
@@ -316,7 +619,41 @@ def main():
                                 'schema in the target database.')
     parser.add_argument("--camera", dest="camera", default="lsstSim",
                         help="Name of desired camera (defaults to %(default)s)")
+    parser.add_argument("--stream", dest="stream", action="store_true",
+                        help="Load CSV files into the database while they are generated, "
+                             "through named pipes, instead of after generation. Requires "
+                             "--database, a single input root and --jobs 1.")
+    parser.add_argument("--chunk-size", dest="chunkSize", type=int, default=None,
+                        help="Write (and load) CSV files in chunks of this many exposures, "
+                             "recording progress in a manifest so that an interrupted "
+                             "ingest into the same output directory can be resumed. Column "
+                             "files (see --format) are left in per chunk directories.")
+    parser.add_argument("--scan-threads", dest="scanThreads", type=int, default=1,
+                        help="Number of threads used to list input directories concurrently "
+                             "(defaults to %(default)d)")
+    parser.add_argument("--scan-index", dest="scanIndex", default=None,
+                        help="SQLite file recording the results of input directory scans. "
+                             "Input directories that have not been modified since they were "
+                             "recorded are not listed again.")
+    parser.add_argument("--scan-roots", dest="scanRoots", type=int, default=4,
+                        help="Maximum number of input roots scanned concurrently when "
+                             "there are several (defaults to %(default)d)")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                        help="Number of worker processes used to extract exposure "
+                             "metadata (defaults to %(default)d)")
     ns = parser.parse_args()
+    if ns.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if ns.scanRoots < 1:
+        parser.error('--scan-roots must be at least 1')
+    if ns.chunkSize is not None and ns.chunkSize < 1:
+        parser.error('--chunk-size must be at least 1')
+    if ns.chunkSize is not None and ns.stream:
+        parser.error('--chunk-size and --stream are mutually exclusive')
+    if ns.stream and (ns.jobs > 1 or len(ns.inroot) > 1):
+        # parallel CSV output is written to shard files, which are only
+        # concatenated once every exposure has been processed
+        parser.error('--stream requires a single input root and --jobs 1')
     ns.camera = ns.camera.lower()
     if ns.camera not in _validKeys:
         parser.error('Unknown camera: {}. Choices (not case sensitive): {}'.format(
@@ -332,11 +669,39 @@ def main():
         if ns.user is None:
             parser.error('No database user name specified and $USER '
                          'is undefined or empty')
-        sql = MysqlExecutor(ns.host, ns.database, ns.user, ns.port)
-    c = CsvGenerator(ns, not doLoad)
-    c.csvAll(sql)
+        sql = MysqlExecutor(ns.host, ns.database, ns.user, ns.port, useClient=ns.useClient)
+    try:
+        csvOptions = getCsvOptions(ns, doLoad)
+    except RuntimeError as e:
+        parser.error(str(e))
+    if ns.chunkSize is not None:
+        csvAllChunked(ns, csvOptions, sql)
+        return
+    # Read the IDs of loaded exposures before streaming loads start, since
+    # these lock Science_Ccd_Exposure until all exposures have been written.
+    loadedIds = getLoadedIds(sql)
+    loader = None
+    if ns.stream:
+        if not doLoad:
+            parser.error('--stream requires a database to load into')
+        loader = FifoLoader(sql)
+        for path, stmt in csvLoads(ns):
+            loader.load(path, stmt)
+    try:
+        if ns.jobs > 1 or len(ns.inroot) > 1:
+            csvAllParallel(ns, csvOptions, loadedIds)
+        else:
+            c = CsvGenerator(ns, csvOptions)
+            c.csvAll(loadedIds)
+    except:
+        if loader:
+            print('*** CSV generation failed, tables may hold partial data: ' +
+                  ', '.join(loader.abort()), file=sys.stderr)
+        raise
+    if loader:
+        loader.wait()
     if doLoad:
-        dbLoad(ns, sql)
+        dbLoad(ns, sql, streamed=loader is not None)
 
 
 if __name__ == '__main__':
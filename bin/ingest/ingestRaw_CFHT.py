@@ -25,24 +25,20 @@
 from __future__ import print_function
 import argparse
 import os
-import subprocess
 import sys
-from textwrap import dedent
 
 import lsst.daf.base as dafBase
 import lsst.daf.persistence as dafPersist
 from lsst.obs.cfht import CfhtMapper
 import lsst.afw.image as afwImage
 
-from lsst.datarel.csvFileWriter import CsvFileWriter
+from lsst.datarel.csvFileWriter import addCsvOptions, getCsvOptions
+from lsst.datarel.fifoLoader import FifoLoader
+from lsst.datarel.htm import HtmIndexWriter
 from lsst.datarel.mysqlExecutor import MysqlExecutor, addDbOptions
-
-
-if 'SCISQL_DIR' not in os.environ:
-    print("Please setup the scisql package and try again", file=sys.stderr)
-    sys.exit(1)
-
-scisqlIndex = os.path.join(os.environ['SCISQL_DIR'], 'bin', 'scisql_index')
+from lsst.datarel.parallelLoader import ParallelLoader
+from lsst.datarel.skyCorners import exposureSkyCorners
+import lsst.datarel.tableSpecs as tableSpecs
 
 filterMap = ["u.MP9301", "g.MP9401", "r.MP9601", "i.MP9701", "z.MP9801",
              "i2.MP9702"]
@@ -50,31 +46,32 @@ filterMap = ["u.MP9301", "g.MP9401", "r.MP9601", "i.MP9701", "z.MP9801",
 
 class CsvGenerator(object):
 
-    def __init__(self, root, registry=None, compress=True):
+    def __init__(self, root, registry=None, csvOptions={}):
         if registry is None:
             registry = os.path.join(root, "registry.sqlite3")
         self.mapper = CfhtMapper(root=root, registry=registry)
         bf = dafPersist.ButlerFactory(mapper=self.mapper)
         self.butler = bf.create()
 
-        self.expFile = CsvFileWriter("Raw_Amp_Exposure.csv",
-                                     compress=compress)
-        self.mdFile = CsvFileWriter("Raw_Amp_Exposure_Metadata.csv",
-                                    compress=compress)
-        self.rToSFile = CsvFileWriter("Raw_Amp_To_Science_Ccd_Exposure.csv",
-                                      compress=compress)
-        self.polyFile = open("Raw_Amp_Exposure_Poly.tsv", "wb")
+        self.expFile = tableSpecs.rawAmpExposure("cfht").openWriter(
+            "Raw_Amp_Exposure.csv", **csvOptions)
+        self.mdFile = tableSpecs.rawAmpExposureMetadata.openWriter(
+            "Raw_Amp_Exposure_Metadata.csv", **csvOptions)
+        self.rToSFile = tableSpecs.rawAmpToScienceCcdExposure.openWriter(
+            "Raw_Amp_To_Science_Ccd_Exposure.csv", **csvOptions)
+        self.htmFile = HtmIndexWriter("Raw_Amp_Exposure_To_Htm11.tsv", 11)
 
     def csvAll(self):
-        for visit, ccd in self.butler.queryMetadata("raw", "ccd",
-                                                    ("visit", "ccd")):
-            if self.butler.datasetExists("raw", visit=visit, ccd=ccd, amp=0):
-                self.toCsv(visit, ccd)
-        self.expFile.flush()
-        self.mdFile.flush()
-        self.rToSFile.flush()
-        self.polyFile.flush()
-        self.polyFile.close()
+        try:
+            for visit, ccd in self.butler.queryMetadata("raw", "ccd",
+                                                        ("visit", "ccd")):
+                if self.butler.datasetExists("raw", visit=visit, ccd=ccd, amp=0):
+                    self.toCsv(visit, ccd)
+        finally:
+            self.expFile.close()
+            self.mdFile.close()
+            self.rToSFile.close()
+            self.htmFile.close()
 
     def getFullMetadata(self, datasetType, **keys):
         filename = self.mapper.map(datasetType, keys).getLocations()[0]
@@ -95,15 +92,7 @@ class CsvGenerator(object):
 
             self.rToSFile.write(rawAmpExposureId, sciCcdExposureId, 0, amp)
 
-            width = md.get('NAXIS1')
-            height = md.get('NAXIS2')
-            wcs = afwImage.makeWcs(md.deepCopy())
-
-            cen = wcs.pixelToSky(0.5*width - 0.5, 0.5*height - 0.5).toIcrs()
-            llc = wcs.pixelToSky(-0.5, -0.5).toIcrs()
-            ulc = wcs.pixelToSky(-0.5, height - 0.5).toIcrs()
-            urc = wcs.pixelToSky(width - 0.5, height - 0.5).toIcrs()
-            lrc = wcs.pixelToSky(width - 0.5, -0.5).toIcrs()
+            cen, llc, ulc, urc, lrc = exposureSkyCorners([md])[0].tolist()
             obsStart = dafBase.DateTime(md.get('MJD-OBS'),
                                         dafBase.DateTime.MJD, dafBase.DateTime.UTC)
             expTime = md.get('EXPTIME')
@@ -112,7 +101,7 @@ class CsvGenerator(object):
             self.expFile.write(rawAmpExposureId,
                                visit, 0, 0, ccd, amp,
                                filterMap.index(md.get('FILTER').strip()),
-                               cen.getRa().asDegrees(), cen.getDec().asDegrees(),
+                               cen[0], cen[1],
                                md.get('EQUINOX'),
                                md.get('RADECSYS'),  # note wrong name
                                md.get('CTYPE1'), md.get('CTYPE2'),
@@ -120,10 +109,10 @@ class CsvGenerator(object):
                                md.get('CRVAL1'), md.get('CRVAL2'),
                                md.get('CD1_1'), md.get('CD1_2'),
                                md.get('CD2_1'), md.get('CD2_2'),
-                               llc.getRa().asDegrees(), llc.getDec().asDegrees(),
-                               ulc.getRa().asDegrees(), ulc.getDec().asDegrees(),
-                               urc.getRa().asDegrees(), urc.getDec().asDegrees(),
-                               lrc.getRa().asDegrees(), lrc.getDec().asDegrees(),
+                               llc[0], llc[1],
+                               ulc[0], ulc[1],
+                               urc[0], urc[1],
+                               lrc[0], lrc[1],
                                obsStart.get(dafBase.DateTime.MJD, dafBase.DateTime.TAI),
                                obsStart, obsMidpoint.toString(dafBase.DateTime.UTC), expTime,
                                md.get('AIRMASS'), md.get('DARKTIME'),
@@ -138,69 +127,30 @@ class CsvGenerator(object):
                 else:
                     self.mdFile.write(rawAmpExposureId, name, 1,
                                       None, None, str(md.get(name)))
-            self.polyFile.write("\t".join([
-                str(rawAmpExposureId),
-                repr(llc.getRa().asDegrees()), repr(llc.getDec().asDegrees()),
-                repr(ulc.getRa().asDegrees()), repr(ulc.getDec().asDegrees()),
-                repr(urc.getRa().asDegrees()), repr(urc.getDec().asDegrees()),
-                repr(lrc.getRa().asDegrees()), repr(lrc.getDec().asDegrees())]))
-            self.polyFile.write("\n")
+            self.htmFile.write(rawAmpExposureId,
+                               [llc[0], ulc[0], urc[0], lrc[0]],
+                               [llc[1], ulc[1], urc[1], lrc[1]])
 
         print("Processed visit %d ccd %d" % (visit, ccd))
 
 
-def dbLoad(sql):
-    subprocess.call([scisqlIndex, "-l", "11",
-                     "Raw_Amp_Exposure_To_Htm11.tsv",
-                     "Raw_Amp_Exposure_Poly.tsv"])
-    sql.execStmt(dedent("""\
-        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_Exposure
-        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' (
-            rawAmpExposureId, visit, snap, raft, ccd, amp, filterId,
-            ra, decl,
-            equinox, raDeSys,
-            ctype1, ctype2,
-            crpix1, crpix2,
-            crval1, crval2,
-            cd1_1, cd1_2, cd2_1, cd2_2,
-            llcRa, llcDecl,
-            ulcRa, ulcDecl,
-            urcRa, urcDecl,
-            lrcRa, lrcDecl,
-            taiMjd, obsStart, expMidpt, expTime,
-            airmass, darkTime, zd
-        ) SET poly = scisql_s2CPolyToBin(llcRa, llcDecl,
-                                         ulcRa, ulcDecl,
-                                         urcRa, urcDecl,
-                                         lrcRa, lrcDecl);
-        SHOW WARNINGS;
-        """ % os.path.abspath("Raw_Amp_Exposure.csv")))
-    sql.execStmt(dedent("""\
-        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_Exposure_Metadata
-        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' (
-            rawAmpExposureId,
-            metadataKey,
-            exposureType,
-            intValue,
-            doubleValue,
-            stringValue);
-        SHOW WARNINGS;
-        """ % os.path.abspath("Raw_Amp_Exposure_Metadata.csv")))
-    sql.execStmt(dedent("""\
-        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_To_Science_Ccd_Exposure
-        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' (
-            rawAmpExposureId,
-            scienceCcdExposureId,
-            snap,
-            amp);
-        SHOW WARNINGS;
-        """ % os.path.abspath("Raw_Amp_To_Science_Ccd_Exposure.csv")))
-    sql.execStmt(dedent("""\
-        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_Exposure_To_Htm11 (
-            rawAmpExposureId,
-            htmId11);
-        SHOW WARNINGS;
-        """ % os.path.abspath("Raw_Amp_Exposure_To_Htm11.tsv")))
+def csvLoads():
+    """Return a list of (CSV file path, LOAD statement) tuples for the CSV
+    files produced by CsvGenerator.
+    """
+    return [tableSpecs.rawAmpExposure("cfht").load("Raw_Amp_Exposure.csv"),
+            tableSpecs.rawAmpExposureMetadata.load("Raw_Amp_Exposure_Metadata.csv"),
+            tableSpecs.rawAmpToScienceCcdExposure.load("Raw_Amp_To_Science_Ccd_Exposure.csv")]
+
+
+def dbLoad(sql, streamed=False, threads=4):
+    """Load CSV files produced by CsvGenerator into database tables, up to
+    threads tables at a time. If streamed is True, the CSV files have
+    already been loaded (see FifoLoader) and only the HTM index is loaded.
+    """
+    loads = [] if streamed else csvLoads()
+    loads.append(tableSpecs.rawAmpExposureToHtm11.load("Raw_Amp_Exposure_To_Htm11.tsv"))
+    ParallelLoader(sql, threads).run(loads)
 
 
 def main():
@@ -211,6 +161,7 @@ def main():
                                      epilog="Make sure to run prepareDb.py before database loads - this "
                                      "instantiates the LSST schema in the target database.")
     addDbOptions(parser)
+    addCsvOptions(parser)
     parser.add_argument(
         "-d", "--database", dest="database",
         help="MySQL database to load CSV files into.")
@@ -218,6 +169,11 @@ def main():
         "-R", "--registry", dest="registry", help="Input registry path; "
         "used for all input roots. If omitted, a file named registry.sqlite3 "
         "must exist in each input root.")
+    parser.add_argument(
+        "--stream", dest="stream", action="store_true",
+        help="Load CSV files into the database while they are generated, "
+             "through named pipes, instead of after generation. Requires "
+             "--database.")
     parser.add_argument("root", help="input root directory")
     ns = parser.parse_args()
     doLoad = ns.database is not None
@@ -225,11 +181,30 @@ def main():
         if ns.user is None:
             parser.error("No database user name specified and $USER " +
                          "is undefined or empty")
-        sql = MysqlExecutor(ns.host, ns.database, ns.user, ns.port)
-    c = CsvGenerator(ns.root, ns.registry, not doLoad)
-    c.csvAll()
+        sql = MysqlExecutor(ns.host, ns.database, ns.user, ns.port, useClient=ns.useClient)
+    try:
+        csvOptions = getCsvOptions(ns, doLoad)
+    except RuntimeError as e:
+        parser.error(str(e))
+    loader = None
+    if ns.stream:
+        if not doLoad:
+            parser.error("--stream requires a database to load into")
+        loader = FifoLoader(sql)
+        for path, stmt in csvLoads():
+            loader.load(path, stmt)
+    try:
+        c = CsvGenerator(ns.root, ns.registry, csvOptions)
+        c.csvAll()
+    except:
+        if loader:
+            print("*** CSV generation failed, tables may hold partial data: " +
+                  ", ".join(loader.abort()), file=sys.stderr)
+        raise
+    if loader:
+        loader.wait()
     if doLoad:
-        dbLoad(sql)
+        dbLoad(sql, streamed=loader is not None, threads=ns.loadThreads)
 
 if __name__ == '__main__':
     main()
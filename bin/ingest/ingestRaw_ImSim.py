@@ -25,24 +25,20 @@
 from __future__ import print_function
 import argparse
 import os
-import subprocess
 import sys
-from textwrap import dedent
 
 import lsst.daf.base as dafBase
 import lsst.daf.persistence as dafPersist
 from lsst.obs.lsstSim import LsstSimMapper
 import lsst.afw.image as afwImage
 
-from lsst.datarel.csvFileWriter import CsvFileWriter
+from lsst.datarel.csvFileWriter import addCsvOptions, getCsvOptions
+from lsst.datarel.fifoLoader import FifoLoader
+from lsst.datarel.htm import HtmIndexWriter
 from lsst.datarel.mysqlExecutor import MysqlExecutor, addDbOptions
-
-
-if 'SCISQL_DIR' not in os.environ:
-    print("Please setup the scisql package and try again", file=sys.stderr)
-    sys.exit(1)
-
-scisqlIndex = os.path.join(os.environ['SCISQL_DIR'], 'bin', 'scisql_index')
+from lsst.datarel.parallelLoader import ParallelLoader
+from lsst.datarel.skyCorners import exposureSkyCorners
+import lsst.datarel.tableSpecs as tableSpecs
 
 rafts = ["0,1", "0,2", "0,3",
          "1,0", "1,1", "1,2", "1,3", "1,4",
@@ -55,32 +51,33 @@ filterMap = ["u", "g", "r", "i", "z", "y"]
 
 class CsvGenerator(object):
 
-    def __init__(self, root, registry=None, compress=True):
+    def __init__(self, root, registry=None, csvOptions={}):
         if registry is None:
             registry = os.path.join(root, "registry.sqlite3")
         self.mapper = LsstSimMapper(root=root, registry=registry)
         bf = dafPersist.ButlerFactory(mapper=self.mapper)
         self.butler = bf.create()
 
-        self.expFile = CsvFileWriter("Raw_Amp_Exposure.csv",
-                                     compress=compress)
-        self.mdFile = CsvFileWriter("Raw_Amp_Exposure_Metadata.csv",
-                                    compress=compress)
-        self.rToSFile = CsvFileWriter("Raw_Amp_To_Science_Ccd_Exposure.csv",
-                                      compress=compress)
-        self.polyFile = open("Raw_Amp_Exposure_Poly.tsv", "wb")
+        self.expFile = tableSpecs.rawAmpExposure("lsstsim").openWriter(
+            "Raw_Amp_Exposure.csv", **csvOptions)
+        self.mdFile = tableSpecs.rawAmpExposureMetadata.openWriter(
+            "Raw_Amp_Exposure_Metadata.csv", **csvOptions)
+        self.rToSFile = tableSpecs.rawAmpToScienceCcdExposure.openWriter(
+            "Raw_Amp_To_Science_Ccd_Exposure.csv", **csvOptions)
+        self.htmFile = HtmIndexWriter("Raw_Amp_Exposure_To_Htm11.tsv", 11)
 
     def csvAll(self):
-        for visit, raft, sensor in self.butler.queryMetadata("raw", "sensor",
-                                                             ("visit", "raft", "sensor")):
-            if self.butler.datasetExists("raw", visit=visit, snap=0,
-                                         raft=raft, sensor=sensor, channel="0,0"):
-                self.toCsv(visit, raft, sensor)
-        self.expFile.flush()
-        self.mdFile.flush()
-        self.rToSFile.flush()
-        self.polyFile.flush()
-        self.polyFile.close()
+        try:
+            for visit, raft, sensor in self.butler.queryMetadata("raw", "sensor",
+                                                                 ("visit", "raft", "sensor")):
+                if self.butler.datasetExists("raw", visit=visit, snap=0,
+                                             raft=raft, sensor=sensor, channel="0,0"):
+                    self.toCsv(visit, raft, sensor)
+        finally:
+            self.expFile.close()
+            self.mdFile.close()
+            self.rToSFile.close()
+            self.htmFile.close()
 
     def getFullMetadata(self, datasetType, **keys):
         filename = self.mapper.map(datasetType, keys).getLocations()[0]
@@ -94,15 +91,13 @@ class CsvGenerator(object):
         ccdNum = int(s1) * 3 + int(s2)
         sciCcdExposureId = (long(visit) << 9) + raftId * 10 + ccdNum
 
+        # Read all amplifier headers for the sensor first, so that sky
+        # positions of their centers and corners are computed in one batch.
+        amps = []
         for snap in xrange(2):
-            rawCcdExposureId = (sciCcdExposureId << 1) + snap
-
             for channelY in xrange(2):
                 for channelX in xrange(8):
                     channel = "%d,%d" % (channelY, channelX)
-                    channelNum = (channelY << 3) + channelX
-                    rawAmpExposureId = (rawCcdExposureId << 4) + channelNum
-
                     try:
                         md = self.getFullMetadata("raw",
                                                   visit=visit, snap=snap,
@@ -113,129 +108,86 @@ class CsvGenerator(object):
                               "raft %s sensor %s channel %s" %
                               (visit, snap, raft, sensor, channel))
                         continue
+                    amps.append((snap, channelY, channelX, md))
+        skyCorners = exposureSkyCorners([amp[3] for amp in amps]).tolist()
 
-                    self.rToSFile.write(rawAmpExposureId, sciCcdExposureId,
-                                        snap, channelNum)
-
-                    width = md.get('NAXIS1')
-                    height = md.get('NAXIS2')
-                    wcs = afwImage.makeWcs(md.deepCopy())
-                    cen = wcs.pixelToSky(0.5*width - 0.5, 0.5*height - 0.5).toIcrs()
-                    corner1 = wcs.pixelToSky(-0.5, -0.5).toIcrs()
-                    corner2 = wcs.pixelToSky(-0.5, height - 0.5).toIcrs()
-                    corner3 = wcs.pixelToSky(width - 0.5, height - 0.5).toIcrs()
-                    corner4 = wcs.pixelToSky(width - 0.5, -0.5).toIcrs()
-                    mjd = md.get('MJD-OBS')
-                    if mjd == 0.0:
-                        mjd = 49563.270671
-                    obsStart = dafBase.DateTime(mjd,
-                                                dafBase.DateTime.MJD, dafBase.DateTime.UTC)
-                    expTime = md.get('EXPTIME')
-                    obsMidpoint = dafBase.DateTime(obsStart.nsecs() +
-                                                   long(expTime * 1000000000 / 2))
-                    filterName = md.get('FILTER').strip()
-                    self.expFile.write(rawAmpExposureId,
-                                       visit, snap, raftNum, raft, ccdNum,
-                                       sensor, channelNum, channel,
-                                       filterMap.index(filterName), filterName,
-                                       cen.getRa().asDegrees(), cen.getDec().asDegrees(),
-                                       md.get('EQUINOX'), md.get('RADESYS'),
-                                       md.get('CTYPE1'), md.get('CTYPE2'),
-                                       md.get('CRPIX1'), md.get('CRPIX2'),
-                                       md.get('CRVAL1'), md.get('CRVAL2'),
-                                       md.get('CD1_1'), md.get('CD1_2'),
-                                       md.get('CD2_1'), md.get('CD2_2'),
-                                       corner1.getRa().asDegrees(),
-                                       corner1.getDec().asDegrees(),
-                                       corner2.getRa().asDegrees(),
-                                       corner2.getDec().asDegrees(),
-                                       corner3.getRa().asDegrees(),
-                                       corner3.getDec().asDegrees(),
-                                       corner4.getRa().asDegrees(),
-                                       corner4.getDec().asDegrees(),
-                                       obsStart.get(dafBase.DateTime.MJD,
-                                                    dafBase.DateTime.TAI),
-                                       obsStart,
-                                       obsMidpoint.get(dafBase.DateTime.MJD,
-                                                       dafBase.DateTime.TAI),
-                                       expTime,
-                                       md.get('AIRMASS'), md.get('DARKTIME'),
-                                       md.get('ZENITH'))
-                    for name in md.paramNames():
-                        if md.typeOf(name) == md.TYPE_Int:
-                            self.mdFile.write(rawAmpExposureId, name, 1,
-                                              md.getInt(name), None, None)
-                        elif md.typeOf(name) == md.TYPE_Double:
-                            self.mdFile.write(rawAmpExposureId, name, 1,
-                                              None, md.getDouble(name), None)
-                        else:
-                            self.mdFile.write(rawAmpExposureId, name, 1,
-                                              None, None, str(md.get(name)))
-                    self.polyFile.write("\t".join([
-                        str(rawAmpExposureId),
-                        repr(corner1.getRa().asDegrees()), repr(corner1.getDec().asDegrees()),
-                        repr(corner2.getRa().asDegrees()), repr(corner2.getDec().asDegrees()),
-                        repr(corner3.getRa().asDegrees()), repr(corner3.getDec().asDegrees()),
-                        repr(corner4.getRa().asDegrees()), repr(corner4.getDec().asDegrees())]))
-                    self.polyFile.write("\n")
+        for (snap, channelY, channelX, md), corners in zip(amps, skyCorners):
+            rawCcdExposureId = (sciCcdExposureId << 1) + snap
+            channel = "%d,%d" % (channelY, channelX)
+            channelNum = (channelY << 3) + channelX
+            rawAmpExposureId = (rawCcdExposureId << 4) + channelNum
+
+            self.rToSFile.write(rawAmpExposureId, sciCcdExposureId,
+                                snap, channelNum)
+
+            # ICRS (ra, dec) of center and corners, in degrees
+            cen, corner1, corner2, corner3, corner4 = corners
+            mjd = md.get('MJD-OBS')
+            if mjd == 0.0:
+                mjd = 49563.270671
+            obsStart = dafBase.DateTime(mjd,
+                                        dafBase.DateTime.MJD, dafBase.DateTime.UTC)
+            expTime = md.get('EXPTIME')
+            obsMidpoint = dafBase.DateTime(obsStart.nsecs() +
+                                           long(expTime * 1000000000 / 2))
+            filterName = md.get('FILTER').strip()
+            self.expFile.write(rawAmpExposureId,
+                               visit, snap, raftNum, raft, ccdNum,
+                               sensor, channelNum, channel,
+                               filterMap.index(filterName), filterName,
+                               cen[0], cen[1],
+                               md.get('EQUINOX'), md.get('RADESYS'),
+                               md.get('CTYPE1'), md.get('CTYPE2'),
+                               md.get('CRPIX1'), md.get('CRPIX2'),
+                               md.get('CRVAL1'), md.get('CRVAL2'),
+                               md.get('CD1_1'), md.get('CD1_2'),
+                               md.get('CD2_1'), md.get('CD2_2'),
+                               corner1[0], corner1[1],
+                               corner2[0], corner2[1],
+                               corner3[0], corner3[1],
+                               corner4[0], corner4[1],
+                               obsStart.get(dafBase.DateTime.MJD,
+                                            dafBase.DateTime.TAI),
+                               obsStart,
+                               obsMidpoint.get(dafBase.DateTime.MJD,
+                                               dafBase.DateTime.TAI),
+                               expTime,
+                               md.get('AIRMASS'), md.get('DARKTIME'),
+                               md.get('ZENITH'))
+            for name in md.paramNames():
+                if md.typeOf(name) == md.TYPE_Int:
+                    self.mdFile.write(rawAmpExposureId, name, 1,
+                                      md.getInt(name), None, None)
+                elif md.typeOf(name) == md.TYPE_Double:
+                    self.mdFile.write(rawAmpExposureId, name, 1,
+                                      None, md.getDouble(name), None)
+                else:
+                    self.mdFile.write(rawAmpExposureId, name, 1,
+                                      None, None, str(md.get(name)))
+            self.htmFile.write(rawAmpExposureId,
+                               [corner1[0], corner2[0], corner3[0], corner4[0]],
+                               [corner1[1], corner2[1], corner3[1], corner4[1]])
 
         print("Processed visit %d raft %s sensor %s" % (visit, raft, sensor))
 
 
-def dbLoad(sql):
-    subprocess.call([scisqlIndex, "-l", "11",
-                     "Raw_Amp_Exposure_To_Htm11.tsv",
-                     "Raw_Amp_Exposure_Poly.tsv"])
-    sql.execStmt(dedent("""\
-        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_Exposure
-        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' (
-            rawAmpExposureId, visit, snap, raft, raftName,
-            ccd, ccdName, amp, ampName, filterId, filterName,
-            ra, decl,
-            equinox, raDeSys,
-            ctype1, ctype2,
-            crpix1, crpix2,
-            crval1, crval2,
-            cd1_1, cd1_2, cd2_1, cd2_2,
-            corner1Ra, corner1Decl,
-            corner2Ra, corner2Decl,
-            corner3Ra, corner3Decl,
-            corner4Ra, corner4Decl,
-            taiMjd, obsStart, expMidpt, expTime,
-            airmass, darkTime, zd
-        ) SET htmId20 = scisql_s2HtmId(ra, decl, 20),
-              poly = scisql_s2CPolyToBin(corner1Ra, corner1Decl,
-                                         corner2Ra, corner2Decl,
-                                         corner3Ra, corner3Decl,
-                                         corner4Ra, corner4Decl);
-        SHOW WARNINGS;
-        """ % os.path.abspath("Raw_Amp_Exposure.csv")))
-    sql.execStmt(dedent("""\
-        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_Exposure_Metadata
-        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' (
-            rawAmpExposureId,
-            metadataKey,
-            exposureType,
-            intValue,
-            doubleValue,
-            stringValue);
-        SHOW WARNINGS;
-        """ % os.path.abspath("Raw_Amp_Exposure_Metadata.csv")))
-    sql.execStmt(dedent("""\
-        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_To_Science_Ccd_Exposure
-        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' (
-            rawAmpExposureId,
-            scienceCcdExposureId,
-            snap,
-            amp);
-        SHOW WARNINGS;
-        """ % os.path.abspath("Raw_Amp_To_Science_Ccd_Exposure.csv")))
-    sql.execStmt(dedent("""\
-        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_Exposure_To_Htm11 (
-            rawAmpExposureId,
-            htmId11);
-        SHOW WARNINGS;
-        """ % os.path.abspath("Raw_Amp_Exposure_To_Htm11.tsv")))
+def csvLoads():
+    """Return a list of (CSV file path, LOAD statement) tuples for the CSV
+    files produced by CsvGenerator.
+    """
+    return [tableSpecs.rawAmpExposure("lsstsim").load("Raw_Amp_Exposure.csv"),
+            tableSpecs.rawAmpExposureMetadata.load("Raw_Amp_Exposure_Metadata.csv"),
+            tableSpecs.rawAmpToScienceCcdExposure.load("Raw_Amp_To_Science_Ccd_Exposure.csv")]
+
+
+def dbLoad(sql, streamed=False, threads=4):
+    """Load CSV files produced by CsvGenerator into database tables, up to
+    threads tables at a time. If streamed is True, the CSV files have
+    already been loaded (see FifoLoader) and only the HTM index is loaded.
+    """
+    loads = [] if streamed else csvLoads()
+    loads.append(tableSpecs.rawAmpExposureToHtm11.load("Raw_Amp_Exposure_To_Htm11.tsv"))
+    ParallelLoader(sql, threads).run(loads)
 
 
 def main():
@@ -246,6 +198,7 @@ def main():
                                      epilog="Make sure to run prepareDb.py before database loads - this "
                                      "instantiates the LSST schema in the target database.")
     addDbOptions(parser)
+    addCsvOptions(parser)
     parser.add_argument(
         "-d", "--database", dest="database",
         help="MySQL database to load CSV files into.")
@@ -253,6 +206,11 @@ def main():
         "-R", "--registry", dest="registry", help="Input registry path; "
         "used for all input roots. If omitted, a file named registry.sqlite3 "
         "must exist in each input root.")
+    parser.add_argument(
+        "--stream", dest="stream", action="store_true",
+        help="Load CSV files into the database while they are generated, "
+             "through named pipes, instead of after generation. Requires "
+             "--database.")
     parser.add_argument("root", help="input root directory")
     ns = parser.parse_args()
     doLoad = ns.database is not None
@@ -260,11 +218,30 @@ def main():
         if ns.user is None:
             parser.error("No database user name specified and $USER " +
                          "is undefined or empty")
-        sql = MysqlExecutor(ns.host, ns.database, ns.user, ns.port)
-    c = CsvGenerator(ns.root, ns.registry, not doLoad)
-    c.csvAll()
+        sql = MysqlExecutor(ns.host, ns.database, ns.user, ns.port, useClient=ns.useClient)
+    try:
+        csvOptions = getCsvOptions(ns, doLoad)
+    except RuntimeError as e:
+        parser.error(str(e))
+    loader = None
+    if ns.stream:
+        if not doLoad:
+            parser.error("--stream requires a database to load into")
+        loader = FifoLoader(sql)
+        for path, stmt in csvLoads():
+            loader.load(path, stmt)
+    try:
+        c = CsvGenerator(ns.root, ns.registry, csvOptions)
+        c.csvAll()
+    except:
+        if loader:
+            print("*** CSV generation failed, tables may hold partial data: " +
+                  ", ".join(loader.abort()), file=sys.stderr)
+        raise
+    if loader:
+        loader.wait()
     if doLoad:
-        dbLoad(sql)
+        dbLoad(sql, streamed=loader is not None, threads=ns.loadThreads)
 
 if __name__ == '__main__':
     main()
@@ -43,7 +43,7 @@ def main():
         parser.error("No database user name specified and $USER is undefined or empty")
     viewName = "buildbot_weekly_latest_" + ns.type
     print(viewName)
-    sql = MysqlExecutor(ns.host, viewName, ns.user, ns.port)
+    sql = MysqlExecutor(ns.host, viewName, ns.user, ns.port, useClient=ns.useClient)
     for table in (
             "AmpMap", "CcdMap", "Filter", "LeapSeconds", "Logs",
             "Object", "ObjectType", "RaftMap",
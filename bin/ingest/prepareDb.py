@@ -55,6 +55,12 @@ loadTables = {
 }
 
 
+def reportStatement(i, stmt, seconds):
+    """Print the number, execution time and first line of a script statement.
+    """
+    print("{:5d} {:10.3f} sec  {}".format(i, seconds, stmt.split("\n", 1)[0][:80]))
+
+
 def checkDb(sql, camera):
     for table in loadTables[camera]:
         try:
@@ -81,7 +87,7 @@ def main():
     parser.add_argument("database", help="Name of database to create and "
                         "instantiate the LSST schema in.")
     ns = parser.parse_args()
-    sql = MysqlExecutor(ns.host, ns.database, ns.user, ns.port)
+    sql = MysqlExecutor(ns.host, ns.database, ns.user, ns.port, useClient=ns.useClient)
     camera = ns.camera.lower()
     if camera not in loadTables:
         parser.error("Unknown camera: {}. Choices (not case sensitive): {}".format(
@@ -92,13 +98,14 @@ def main():
                          "please setup the cat package and try again.")
         catDir = os.environ['CAT_DIR']
         sql.createDb(ns.database)
-        sql.execScript(os.path.join(
-            catDir, 'sql', 'lsstSchema4mysqlS12_{}.sql'.format(camera)))
-        sql.execScript(os.path.join(catDir, 'sql', 'setup_perRunTablesS12_{}.sql'.format(camera)))
-        sql.execScript(os.path.join(catDir, 'sql', 'setup_storedFunctions.sql'))
+        for script in ('lsstSchema4mysqlS12_{}.sql'.format(camera),
+                       'setup_perRunTablesS12_{}.sql'.format(camera),
+                       'setup_storedFunctions.sql'):
+            print("Running " + script)
+            sql.execScript(os.path.join(catDir, 'sql', script), progress=reportStatement)
     # Disable indexes on tables for faster loading
-    for table in loadTables[camera]:
-        sql.execStmt("ALTER TABLE {} DISABLE KEYS;".format(table))
+    sql.execStmt("\n".join("ALTER TABLE {} DISABLE KEYS;".format(table)
+                           for table in loadTables[camera]))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,110 @@
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+from __future__ import with_statement
+from collections import deque
+from contextlib import closing
+from cStringIO import StringIO
+import gzip
+from multiprocessing.pool import ThreadPool
+
+__all__ = ['BlockGzipFile']
+
+
+def _compressBlock(data, level):
+    """Return data as a complete, stand-alone gzip member.
+    """
+    buf = StringIO()
+    with closing(gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0)) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class BlockGzipFile(object):
+    """A write-only file object that gzip compresses its output using
+    multiple threads.
+
+    Written data is split into fixed size blocks, each of which is
+    compressed into a separate gzip member on a thread pool (zlib releases
+    the GIL while compressing). Members are written out in order. A
+    concatenation of gzip members is itself a valid gzip stream, so the
+    result can be read by gzip/zcat and the python gzip module as usual,
+    at the cost of a slightly lower compression ratio than a single member.
+    """
+
+    def __init__(self, path, mode='wb', compresslevel=9, threads=4, blockSize=1 << 20):
+        if mode not in ('w', 'wb', 'a', 'ab'):
+            raise ValueError('BlockGzipFile mode must be one of w, wb, a, ab')
+        self.f = open(path, mode[0] + 'b')
+        self.level = compresslevel
+        self.threads = threads
+        self.blockSize = blockSize
+        self.pool = ThreadPool(threads)
+        self.pending = deque()
+        self.buf = []
+        self.size = 0
+        self.members = 0
+
+    @property
+    def closed(self):
+        return self.f.closed
+
+    def write(self, data):
+        self.buf.append(data)
+        self.size += len(data)
+        if self.size >= self.blockSize:
+            self._submit()
+
+    def flush(self):
+        self._submit()
+        self._drain(0)
+        self.f.flush()
+
+    def close(self):
+        if self.f.closed:
+            return
+        try:
+            self._submit()
+            self._drain(0)
+            if self.members == 0:
+                # an empty file is not a valid gzip stream
+                self.f.write(_compressBlock('', self.level))
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.f.close()
+
+    def _submit(self):
+        """Queue the buffered data for compression."""
+        if self.size == 0:
+            return
+        data = ''.join(self.buf)
+        self.buf = []
+        self.size = 0
+        self.pending.append(self.pool.apply_async(_compressBlock, (data, self.level)))
+        # bound the amount of uncompressed data in flight
+        self._drain(2 * self.threads)
+
+    def _drain(self, maxPending):
+        """Write out compressed blocks until at most maxPending remain."""
+        while len(self.pending) > maxPending:
+            self.f.write(self.pending.popleft().get())
+            self.members += 1
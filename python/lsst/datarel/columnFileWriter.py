@@ -0,0 +1,240 @@
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import shutil
+
+import numpy
+
+import lsst.daf.base as dafBase
+
+__all__ = ['ColumnFileWriter', 'columnDirectory', 'readColumns', 'mergeColumnDirectories']
+
+
+def _toInt(value):
+    return 0 if value is None else value
+
+
+def _toFloat(value):
+    return numpy.nan if value is None else value
+
+
+def _toStr(value):
+    return '' if value is None else value.strip()
+
+
+def _toDateTime(value):
+    return 0 if value is None else value.nsecs(dafBase.DateTime.UTC)
+
+
+# Maps column types to (value conversion function, numpy dtype) pairs.
+# Strings are stored as fixed width byte strings, and times as UTC
+# nanoseconds since the epoch.
+_columnConverters = {
+    int: (_toInt, numpy.int64),
+    long: (_toInt, numpy.int64),
+    float: (_toFloat, numpy.float64),
+    str: (_toStr, numpy.string_),
+    dafBase.DateTime: (_toDateTime, 'datetime64[ns]'),
+}
+
+
+def columnDirectory(path):
+    """Return the name of the directory holding the columnar counterpart of
+    the CSV file at path.
+    """
+    return os.path.splitext(path)[0] + '.columns'
+
+
+def _partPath(directory, i):
+    return os.path.join(directory, '{:06d}.npz'.format(i))
+
+
+def _parts(directory):
+    return sorted(n for n in os.listdir(directory) if n.endswith('.npz'))
+
+
+class ColumnFileWriter(object):
+    """Writes rows of values to NumPy column arrays, so that tables produced
+    by the ingest scripts can be analyzed without parsing CSV files.
+
+    The output is a directory (see columnDirectory()) of .npz files, each
+    holding one array per column for a block of up to bufferRows rows.
+    Column values are converted according to their column type, which
+    must be a key of _columnConverters, or None to infer the type of each
+    block from its non-NULL values. Inferred integer columns become floats
+    in blocks that also contain floats, and readColumns() promotes them
+    across blocks in the same way; mixing numbers, strings and times in an
+    untyped column raises a TypeError. NULL (None) values are recorded
+    in boolean arrays named after the column with a ".mask" suffix, which
+    readColumns() turns into masked arrays.
+
+    The interface mirrors that of CsvFileWriter: rows are passed to write(),
+    and the number of rows written so far is available as numRows.
+    """
+
+    def __init__(self, path, names, columns=None, overwrite=True, bufferRows=65536):
+        if columns is None:
+            columns = [None] * len(names)
+        if len(columns) != len(names):
+            raise ValueError('Column name and type lists have different lengths')
+        for typ in columns:
+            if typ is not None and typ not in _columnConverters:
+                raise TypeError('No column converter for column type {}'.format(typ))
+        self.directory = columnDirectory(path)
+        if overwrite and os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.names = list(names)
+        self.columns = list(columns)
+        self.numParts = len(_parts(self.directory))
+        self.rows = []
+        self.numRows = 0
+        self.bufferRows = max(1, bufferRows)
+        self.closed = False
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            self._writeRows()
+            self.closed = True
+
+    def flush(self):
+        self._writeRows()
+
+    def write(self, *fields):
+        if len(fields) != len(self.names):
+            raise RuntimeError('Expecting {} column values, got {}'.format(
+                len(self.names), len(fields)))
+        self.rows.append(fields)
+        self.numRows += 1
+        if len(self.rows) >= self.bufferRows:
+            self._writeRows()
+
+    def writeHeader(self, *names):
+        """Column names are given to the constructor; this is a no-op
+        provided for compatibility with CsvFileWriter.
+        """
+        pass
+
+    def _columnType(self, i, values):
+        """Return the type of column i for a block of values, or None if
+        the column is untyped and all its values are NULL.
+        """
+        if self.columns[i] is not None:
+            return self.columns[i]
+        types = set()
+        for v in values:
+            if v is not None:
+                for typ in (dafBase.DateTime, float, long, int, str):
+                    if isinstance(v, typ):
+                        types.add(typ)
+                        break
+                else:
+                    raise TypeError('No column converter for {!r} (column {})'.format(
+                        v, self.names[i]))
+        if not types:
+            return None
+        if types <= set([int, long]):
+            return long
+        if types <= set([int, long, float]):
+            return float
+        if len(types) == 1:
+            return types.pop()
+        raise TypeError('Column {} has values of incompatible types {}'.format(
+            self.names[i], ', '.join(sorted(t.__name__ for t in types))))
+
+    def _writeRows(self):
+        if not self.rows:
+            return
+        arrays = {}
+        for i, values in enumerate(zip(*self.rows)):
+            name = self.names[i]
+            typ = self._columnType(i, values)
+            if typ is None:
+                # all values of the column so far are NULL
+                arrays[name] = numpy.zeros(len(values), dtype=numpy.float64)
+                arrays[name + '.mask'] = numpy.ones(len(values), dtype=bool)
+                continue
+            convert, dtype = _columnConverters[typ]
+            arrays[name] = numpy.array([convert(v) for v in values], dtype=dtype)
+            mask = numpy.array([v is None for v in values], dtype=bool)
+            if mask.any():
+                arrays[name + '.mask'] = mask
+        self.rows = []
+        numpy.savez(_partPath(self.directory, self.numParts), **arrays)
+        self.numParts += 1
+
+
+def readColumns(path, names=None):
+    """Read the column arrays written by a ColumnFileWriter for the CSV file
+    at path, returning a dict mapping column names to numpy arrays. Columns
+    containing NULLs are returned as numpy.ma.MaskedArray instances. If
+    names is not None, only the given columns are read.
+    """
+    directory = columnDirectory(path)
+    blocks = {}
+    for part in _parts(directory):
+        with numpy.load(os.path.join(directory, part)) as data:
+            for n in names or [n for n in data.files if not n.endswith('.mask')]:
+                mask = data[n + '.mask'] if n + '.mask' in data.files else None
+                blocks.setdefault(n, []).append((data[n], mask))
+    result = {}
+    for n, b in blocks.iteritems():
+        # blocks in which a column is entirely NULL may have been written
+        # with a placeholder type
+        typed = [a for a, mask in b if mask is None or not mask.all()]
+        if len(set('n' if a.dtype.kind in 'iuf' else a.dtype.kind for a in typed)) > 1:
+            raise TypeError('Column {} has blocks of incompatible types {}'.format(
+                n, ', '.join(sorted(set(str(a.dtype) for a in typed)))))
+        dtype = numpy.result_type(*typed) if typed else numpy.float64
+        a = numpy.concatenate([a if mask is None or not mask.all() else numpy.zeros(len(a), dtype)
+                               for a, mask in b])
+        if any(mask is not None for a_, mask in b):
+            mask = numpy.concatenate([mask if mask is not None else numpy.zeros(len(a_), bool)
+                                      for a_, mask in b])
+            a = numpy.ma.MaskedArray(a, mask=mask)
+        result[n] = a
+    return result
+
+
+def mergeColumnDirectories(dest, sources):
+    """Move the column blocks of the ColumnFileWriter outputs for the CSV
+    files in sources to the output for the CSV file dest, in order, and
+    remove the source directories. Any existing output for dest is
+    replaced, and missing sources are skipped.
+    """
+    destDir = columnDirectory(dest)
+    if os.path.exists(destDir):
+        shutil.rmtree(destDir)
+    os.makedirs(destDir)
+    i = 0
+    for src in sources:
+        srcDir = columnDirectory(src)
+        if not os.path.exists(srcDir):
+            continue
+        for part in _parts(srcDir):
+            os.rename(os.path.join(srcDir, part), _partPath(destDir, i))
+            i += 1
+        shutil.rmtree(srcDir)
@@ -1,35 +1,239 @@
 from __future__ import print_function
+import argparse
 import gzip
 import re
 import lsst.daf.base as dafBase
 
+from .blockGzip import BlockGzipFile
+from .columnFileWriter import ColumnFileWriter
+
+__all__ = ['CsvFileWriter', 'openTableWriter', 'addCsvOptions', 'getCsvOptions']
+
+# MySQL LOAD DATA representation of NULL
+_null = r'\N'
+
+
+def _formatInt(value):
+    if value is None:
+        return _null
+    return str(value)
+
+
+def _formatFloat(value):
+    if value is None:
+        return _null
+    return "%.17g" % (value,)
+
+
+def _formatStr(value):
+    if value is None:
+        return _null
+    if '"' in value:
+        value = value.replace('"', r'\"')
+    return '"' + value.strip() + '"'
+
+
+def _formatDateTime(value):
+    if value is None:
+        return _null
+    value = value.toString(dafBase.DateTime.UTC)
+    return '"' + value[0:10] + ' ' + value[11:19] + '"'
+
+
+def _quote(value):
+    if value is None:
+        return _null
+    if isinstance(value, float):
+        return "%.17g" % (value,)
+    if isinstance(value, str):
+        value = re.sub(r'"', r'\"', value)
+        return '"' + value.strip() + '"'
+    if isinstance(value, dafBase.DateTime):
+        value = value.toString(dafBase.DateTime.UTC)
+        return '"' + value[0:10] + ' ' + value[11:19] + '"'
+    return str(value)
+
+
+# Maps column types to value formatting functions
+_columnFormatters = {
+    int: _formatInt,
+    long: _formatInt,
+    float: _formatFloat,
+    str: _formatStr,
+    dafBase.DateTime: _formatDateTime,
+}
+
 
 class CsvFileWriter(object):
+    """Writes rows of values to a (optionally compressed) CSV file
+    suitable for MySQL LOAD DATA INFILE.
 
-    def __init__(self, path, overwrite=True, compress=True):
-        if compress:
-            self.f = gzip.open(path + ".gz", "w" if overwrite else "a")
+    If a list of column types is given, rows are formatted by a row
+    function specialized for those types, avoiding per-value type
+    dispatch. Column types must be keys of _columnFormatters, or None
+    for columns whose values are formatted by quote(). Rows are
+    buffered and written out bufferRows at a time. The number of rows
+    written so far (excluding header lines) is available as numRows.
+
+    Compressed output is written to path + ".gz" using the given gzip
+    compression level. If compressThreads is greater than 1, blocks of
+    output are compressed in parallel (see BlockGzipFile). Uncompressed
+    output goes through a large write buffer, and is the better choice
+    when the file is loaded into MySQL right after being written.
+    """
+
+    def __init__(self, path, overwrite=True, compress=True, columns=None, bufferRows=1024,
+                 compressLevel=9, compressThreads=1):
+        mode = "w" if overwrite else "a"
+        if compress and compressThreads > 1:
+            self.f = BlockGzipFile(path + ".gz", mode, compressLevel, compressThreads)
+        elif compress:
+            self.f = gzip.open(path + ".gz", mode, compressLevel)
         else:
-            self.f = open(path, "w" if overwrite else "a")
+            self.f = open(path, mode, 1 << 20)
+        self.rows = []
+        self.numRows = 0
+        self.bufferRows = max(1, bufferRows)
+        self.format = self._compileRowFormat(columns)
 
     def __del__(self):
-        self.f.close()
+        self.close()
+
+    def close(self):
+        if not self.f.closed:
+            self._writeRows()
+            self.f.close()
 
     def flush(self):
+        self._writeRows()
         self.f.flush()
 
     def quote(self, value):
-        if value is None:
-            return '\N'
-        if isinstance(value, float):
-            return "%.17g" % (value,)
-        if isinstance(value, str):
-            value = re.sub(r'"', r'\"', value)
-            return '"' + value.strip() + '"'
-        if isinstance(value, dafBase.DateTime):
-            value = value.toString(dafBase.DateTime.UTC)
-            return '"' + value[0:10] + ' ' + value[11:19] + '"'
-        return str(value)
+        return _quote(value)
 
     def write(self, *fields):
-        print(",".join([self.quote(field) for field in fields]), file=self.f)
+        self.rows.append(self.format(*fields))
+        self.numRows += 1
+        if len(self.rows) >= self.bufferRows:
+            self._writeRows()
+
+    def writeHeader(self, *names):
+        """Write a line of column names, regardless of column types.
+        """
+        self.rows.append(",".join([_quote(n) for n in names]))
+
+    def _writeRows(self):
+        if self.rows:
+            self.rows.append('')
+            self.f.write('\n'.join(self.rows))
+            self.rows = []
+
+    @staticmethod
+    def _compileRowFormat(columns):
+        """Return a function mapping the fields of a row to a CSV line.
+        """
+        if columns is None:
+            return lambda *fields: ",".join([_quote(field) for field in fields])
+        if len(columns) == 0:
+            raise ValueError('Empty CSV column list')
+        env = {}
+        for i, typ in enumerate(columns):
+            if typ is None:
+                env['f%d' % i] = _quote
+            elif typ in _columnFormatters:
+                env['f%d' % i] = _columnFormatters[typ]
+            else:
+                raise TypeError('No CSV formatter for column type {}'.format(typ))
+        # Generate a function with one argument and formatter call per column,
+        # so that formatting a row requires no loop and no type dispatch.
+        args = ', '.join('v%d' % i for i in xrange(len(columns)))
+        calls = ', '.join('f%d(v%d)' % (i, i) for i in xrange(len(columns)))
+        return eval('lambda {}: ",".join(({},))'.format(args, calls), env)
+
+
+class _TeeWriter(object):
+    """Writes rows to a CsvFileWriter and a ColumnFileWriter.
+    """
+
+    def __init__(self, csvWriter, columnWriter):
+        self.csvWriter = csvWriter
+        self.columnWriter = columnWriter
+
+    @property
+    def numRows(self):
+        return self.csvWriter.numRows
+
+    def close(self):
+        self.csvWriter.close()
+        self.columnWriter.close()
+
+    def flush(self):
+        self.csvWriter.flush()
+        self.columnWriter.flush()
+
+    def write(self, *fields):
+        self.csvWriter.write(*fields)
+        self.columnWriter.write(*fields)
+
+    def writeHeader(self, *names):
+        self.csvWriter.writeHeader(*names)
+
+
+def openTableWriter(path, names, columns=None, format="csv", overwrite=True, **kwargs):
+    """Return a writer for the rows of a table with the given column names
+    and types. Depending on format, rows are written to a CsvFileWriter for
+    path ("csv"), to a ColumnFileWriter for path ("columns"), or to both
+    ("both"). Remaining keyword arguments are passed to CsvFileWriter.
+    """
+    if format == "csv":
+        return CsvFileWriter(path, overwrite, columns=columns, **kwargs)
+    columnWriter = ColumnFileWriter(path, names, columns, overwrite)
+    if format == "columns":
+        return columnWriter
+    elif format == "both":
+        return _TeeWriter(CsvFileWriter(path, overwrite, columns=columns, **kwargs), columnWriter)
+    raise RuntimeError("Unknown table output format {}".format(format))
+
+
+def addCsvOptions(parser):
+    """Add CSV output compression options to an argparse.ArgumentParser.
+    """
+    if not isinstance(parser, argparse.ArgumentParser):
+        raise TypeError('Expecting an argparse.ArgumentParser')
+    parser.add_argument(
+        "--compress", default="auto", dest="compress",
+        choices=["auto", "none", "gzip"],
+        help="CSV output compression. The default, auto, gzips CSV files "
+             "unless they are loaded into a database (%(default)s).")
+    parser.add_argument(
+        "--compress-level", default=9, type=int, dest="compressLevel",
+        choices=range(1, 10), metavar="{1..9}",
+        help="gzip compression level (%(default)d).")
+    parser.add_argument(
+        "--compress-threads", default=1, type=int, dest="compressThreads",
+        help="Number of threads used to compress each CSV file. Values "
+             "greater than 1 produce multi-member gzip files (%(default)d).")
+    parser.add_argument(
+        "--format", default="csv", dest="format",
+        choices=["csv", "columns", "both"],
+        help="Table output format: CSV files, NumPy column files for analysis "
+             "(see lsst.datarel.columnFileWriter), or both (%(default)s).")
+
+
+def getCsvOptions(namespace, load):
+    """Return a dict of openTableWriter keyword arguments corresponding to the
+    options added by addCsvOptions. Pass load=True if the CSV files are to
+    be loaded into a database.
+    """
+    if namespace.compress == "auto":
+        compress = not load
+    else:
+        compress = namespace.compress == "gzip"
+    if compress and load:
+        raise RuntimeError("Compressed CSV files cannot be loaded into MySQL")
+    if namespace.format == "columns" and load:
+        raise RuntimeError("Loading into MySQL requires CSV output")
+    return dict(compress=compress,
+                compressLevel=namespace.compressLevel,
+                compressThreads=max(1, namespace.compressThreads),
+                format=namespace.format)
@@ -19,13 +19,33 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
+import bisect
+import errno
+import functools
+import itertools
 import os
 import os.path
+import Queue
 import re
+import stat
+import sys
+import threading
+import time
 import lsst.daf.butlerUtils
 from functools import reduce
 
+# scandir is in the standard library as of python 3.5, and available as a
+# separate package for earlier versions
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
 __all__ = ['getMapperClass',
+           'IntervalSet',
            'parseDataIdRules',
            'HfsScanner',
            'DatasetScanner',
@@ -102,6 +122,57 @@ _keyTypes = {
 }
 
 
+class IntervalSet(object):
+    """An immutable set of integers, stored as a sorted list of disjoint,
+    non-adjacent closed intervals. Membership tests are binary searches,
+    and memory use depends on the number of intervals rather than on the
+    number of integers in the set.
+    """
+
+    def __init__(self, intervals=()):
+        """Build the set from an iterable over (first, last) pairs of
+        integers, each identifying the integers first through last
+        (inclusive). Pairs with first > last are ignored.
+        """
+        self._starts = []
+        self._ends = []
+        for first, last in sorted((int(a), int(b)) for a, b in intervals if a <= b):
+            if self._ends and first <= self._ends[-1] + 1:
+                self._ends[-1] = max(self._ends[-1], last)
+            else:
+                self._starts.append(first)
+                self._ends.append(last)
+
+    @property
+    def intervals(self):
+        """List of (first, last) pairs, in ascending order."""
+        return zip(self._starts, self._ends)
+
+    def union(self, other):
+        return IntervalSet(self.intervals + other.intervals)
+
+    def __contains__(self, value):
+        i = bisect.bisect_right(self._starts, value)
+        return i > 0 and value <= self._ends[i - 1]
+
+    def __len__(self):
+        return sum(b - a + 1 for a, b in self.intervals)
+
+    def __iter__(self):
+        for a, b in self.intervals:
+            for v in xrange(a, b + 1):
+                yield v
+
+    def __eq__(self, other):
+        return isinstance(other, IntervalSet) and self.intervals == other.intervals
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'IntervalSet({!r})'.format(self.intervals)
+
+
 def parseDataIdRules(ruleList, camera):
     """A rule is a string in the following format:
 
@@ -112,7 +183,8 @@ def parseDataIdRules(ruleList, camera):
     range). So '0^2..4^7..9' is equivalent to '0^2^3^4^7^8^9'.
 
     This function parses a list of such strings, and returns a dict mapping
-    keys to sets of legal values.
+    keys to sets of legal values. The values of integer keys are returned
+    as IntervalSet objects, so that huge ranges take up little memory.
 
     ruleList:
         List of rule strings
@@ -130,27 +202,29 @@ def parseDataIdRules(ruleList, camera):
             raise RuntimeError('{} is not a valid dataId key for camera {}'.format(key, camera))
         if len(pattern) == 0:
             continue
-        values = set()
         # compute union of all values or value ranges
-        for p in pattern.split('^'):
-            if _keyTypes[camera][key] == int:
+        if _keyTypes[camera][key] == int:
+            intervals = []
+            for p in pattern.split('^'):
                 # check for range syntax
                 m = re.search(r'^(\d+)\.\.(\d+)$', p)
                 if m:
-                    values.update(xrange(int(m.group(1)), int(m.group(2)) + 1))
+                    intervals.append((int(m.group(1)), int(m.group(2))))
                 else:
-                    values.add(int(p))
-            else:
-                values.add(p)
-        if key in kvs:
-            kvs[key].update(values)
+                    intervals.append((int(p), int(p)))
+            values = IntervalSet(intervals)
+            if key in kvs:
+                values = kvs[key].union(values)
         else:
-            kvs[key] = values
+            values = set(pattern.split('^'))
+            if key in kvs:
+                values |= kvs[key]
+        kvs[key] = values
     return kvs
 
 
 class _FormatKey(object):
-    """A key in a path template. Three attributes are provided:
+    """A key in a path template. Four attributes are provided:
 
     spec
         Formatting spec for the key, e.g. '%(filter)s'.
@@ -159,30 +233,43 @@ class _FormatKey(object):
         key value type; int or str
 
     munge
-        A function that takes a key name, key value string and a dictionary.
-        This function should return a fresh dictionary including new entries
-        derived from the given key, value, and existing entries. The
-        _mungeStr and _mungeInt functions are examples.
+        A function that takes a key name, key value string and a dictionary,
+        and stores the entries derived from the given key and value in the
+        dictionary. The _mungeStr and _mungeInt functions are examples.
+
+    unmunge
+        The inverse of munge: a function that takes a key name and a dataId
+        rule (a dict mapping keys to sets of values), and returns the key
+        values the rule allows, suitable for formatting with spec. If the
+        rule does not constrain the key to a finite set of values, None
+        is returned. The _unmungeStr and _unmungeInt functions are examples.
     """
 
-    def __init__(self, spec, typ, munge):
+    def __init__(self, spec, typ, munge, unmunge):
         self.spec = spec
         self.typ = typ
         self.munge = munge
+        self.unmunge = unmunge
 
 
 def _mungeStr(k, v, dataId):
     """Munger for keys with string formats."""
-    kv = dataId.copy()
-    kv[k] = str(v)
-    return kv
+    dataId[k] = str(v)
 
 
 def _mungeInt(k, v, dataId):
     """Munger for keys with integer formats."""
-    kv = dataId.copy()
-    kv[k] = int(v)
-    return kv
+    dataId[k] = int(v)
+
+
+def _unmungeStr(k, rule):
+    """Inverse of _mungeStr."""
+    return rule.get(k)
+
+
+def _unmungeInt(k, rule):
+    """Inverse of _mungeInt."""
+    return rule.get(k)
 
 
 class _PathComponent(object):
@@ -200,19 +287,40 @@ class _PathComponent(object):
     simple
         True if regex is a simple string literal rather than a pattern.
         In this case, keys will always by None or [].
+
+    format
+        The path component template, if all the keys it contains occur
+        in it for the first time, and None otherwise. Formatting it with
+        values for keys gives the name of a matching entry.
     """
 
-    def __init__(self, keys, regex, simple):
+    def __init__(self, keys, regex, simple, format=None):
         self.keys = keys
         self.regex = regex
         self.simple = simple
+        self.format = format
 
 
 class HfsScanner(object):
     """A hierarchical scanner for paths matching a template, optionally
     also restricting visited paths to those matching a list of dataId rules.
+
+    When the rules allow only a few values for every key of a path
+    component, the names of matching entries are generated from the rules
+    and probed with stat, rather than listing the directory. When the rules
+    only constrain the leading keys of a component (e.g. visit but not
+    filter for 'v%(visit)d-f%(filter)s'), the directory is listed, but
+    only entries starting with a name prefix generated from the rules are
+    matched against the template. Either way, only names formatted exactly
+    as the template would format them are found (e.g. 'v0042' is not found
+    for the template 'v%(visit)d' and the rule visit=42, though it is
+    found when visit is unconstrained).
     """
 
+    # Maximum number of candidate names probed in a directory; beyond this
+    # the directory is listed instead.
+    maxProbes = 64
+
     def __init__(self, template):
         """Build an FsScanner for given a path template. The path template
         should be a Python string with named format substitution
@@ -232,6 +340,7 @@ class HfsScanner(object):
                 template[-1] == os.sep):
             raise RuntimeError(
                 'Path template is empty, absolute, or identifies a directory')
+        self._template = template
         self._formatKeys = {}
         self._pathComponents = []
         fmt = re.compile(r'%\((\w+)\).*?([diucrs])')
@@ -243,6 +352,7 @@ class HfsScanner(object):
             last = 0
             regex = ''
             newKeys = []
+            repeated = False
             for m in fmt.finditer(component):
                 simple = False
                 spec = m.group(0)
@@ -254,12 +364,13 @@ class HfsScanner(object):
                 regex += '('
                 if seenBefore:
                     regex += '?:'
+                    repeated = True
                 if m.group(2) in 'crs':
-                    munge = _mungeStr
+                    munge, unmunge = _mungeStr, _unmungeStr
                     typ = str
                     regex += r'.+)'
                 else:
-                    munge = _mungeInt
+                    munge, unmunge = _mungeInt, _unmungeInt
                     typ = int
                     regex += r'[+-]?\d+)'
                 if seenBefore:
@@ -270,81 +381,568 @@ class HfsScanner(object):
                             'for the same key')
                 else:
                     newKeys.append(k)
-                    self._formatKeys[k] = _FormatKey(spec, typ, munge)
+                    self._formatKeys[k] = _FormatKey(spec, typ, munge, unmunge)
             regex += re.escape(component[last:])
             if simple:
                 regex = component  # literal match
             else:
                 regex = re.compile('^' + regex + '$')
-            self._pathComponents.append(_PathComponent(newKeys, regex, simple))
+            self._pathComponents.append(_PathComponent(
+                newKeys, regex, simple, None if simple or repeated else component))
 
-    def walk(self, root, rules=None):
+    def walk(self, root, rules=None, threads=1, index=None):
         """Generator that descends the given root directory in top-down
         fashion, matching paths corresponding to the template and satisfying
         the given rule list. The generator yields tuples of the form
         (path, dataId), where path is a dataset file name relative to root,
         and dataId is a key value dictionary identifying the file.
+
+        If threads is greater than 1, directories are listed concurrently
+        by that many threads, which greatly speeds up scans of file systems
+        with high metadata latency (e.g. NFS, Lustre). Results are yielded
+        as they are found, so their order is not deterministic.
+
+        If index is a lsst.datarel.scanIndex.ScanIndex, directories that
+        have not been modified since the index recorded them are not
+        listed; their matches are read from the index instead. Newly listed
+        directories are recorded in the index.
         """
-        oneFound = False
-        while os.path.exists(root) and not oneFound:
-            stack = [(0, root, rules, {})]
-            while stack:
-                depth, path, rules, dataId = stack.pop()
-                if os.path.isfile(path):
-                    continue
-                pc = self._pathComponents[depth]
-                if pc.simple:
-                    # No need to list directory contents
-                    entries = [pc.regex]
-                    if not os.path.exists(os.path.join(path, pc.regex)):
-                        continue
-                else:
-                    entries = os.listdir(path)
-                depth += 1
-                for e in entries:
-                    subRules = rules
-                    subDataId = dataId
-                    if not pc.simple:
-                        # make sure e matches path component regular expression
-                        m = pc.regex.match(e)
-                        if not m:
-                            continue
-                        # got a match - update dataId with new key values (if any)
-                        try:
-                            for i, k in enumerate(pc.keys):
-                                subDataId = self._formatKeys[k].munge(k, m.group(i + 1), subDataId)
-                        except:
-                            # Munger raises if value is invalid for key, so
-                            # not really a match
-                            continue
-                        if subRules and pc.keys:
-                            # have dataId rules and saw new keys; filter rule list
-                            for k in subDataId:
-                                newRules = []
-                                for r in subRules:
-                                    if k not in r or subDataId[k] in r[k]:
-                                        newRules.append(r)
-                                subRules = newRules
-                            if not subRules:
-                                continue  # no rules matched
-                    # Have path matching template and at least one rule
-                    p = os.path.join(path, e)
-                    if depth < len(self._pathComponents):
-                        # recurse
-                        stack.append((depth, p, subRules, subDataId))
-                    elif depth == len(self._pathComponents):
-                        if os.path.isfile(p):
-                            # found a matching file, yield it
-                            yield os.path.relpath(p, root), subDataId
-                            oneFound = True
-            # end while stack
+        matcher = _RuleMatcher(rules) if rules else None
+        mask = matcher.all if matcher else None
+        while os.path.exists(root):
+            oneFound = False
+            expand = functools.partial(self._expand, matcher=matcher)
+            if index is not None:
+                expand = functools.partial(self._expandIndexed, matcher=matcher,
+                                           scan=index.scan(root, self.indexKey()))
+            if threads > 1:
+                results = self._walkParallel(root, mask, threads, expand)
+            else:
+                results = self._walkSerial(root, mask, expand)
+            try:
+                for p, dataId in results:
+                    yield os.path.relpath(p, root), dataId
+                    oneFound = True
+            finally:
+                if index is not None:
+                    index.commit()
+            if oneFound:
+                break
             root = os.path.join(root, "_parent")
 
+    def backgroundWalk(self, root, rules=None, threads=1, index=None, maxQueued=1024):
+        """Start walk() in a background thread, and return an iterator over
+        its results. Scanning overlaps with whatever the consumer does with
+        the results (reading headers, writing to a database, ...). At most
+        maxQueued results are buffered; the background walk blocks when the
+        consumer falls that far behind. Exceptions raised by the walk are
+        re-raised by the iterator. Call close() on the iterator to abandon
+        the walk before it is exhausted.
+        """
+        return _BackgroundWalk(self.walk(root, rules, threads, index), maxQueued)
+
+    def indexKey(self):
+        """Return a string identifying the template and dataId munging
+        functions of this scanner, for use as a ScanIndex key.
+        """
+        return '{} {}'.format(self._template, ' '.join(
+            sorted(k + ':' + fk.munge.__name__ for k, fk in self._formatKeys.iteritems())))
+
+    def _walkSerial(self, root, mask, expand):
+        stack = [(0, root, mask, ())]
+        while stack:
+            children, found = expand(*stack.pop())
+            for f in found:
+                yield f
+            stack.extend(children)
+
+    def _walkParallel(self, root, mask, threads, expand):
+        """Walk root using a pool of threads, each of which expands one
+        directory at a time. At most threads directories are in flight;
+        the remainder of the search frontier is kept on a local stack.
+        """
+        tasks = Queue.Queue()
+        results = Queue.Queue()
+        workers = [threading.Thread(target=self._expandWorker, args=(tasks, results, expand))
+                   for i in xrange(threads)]
+        for w in workers:
+            w.daemon = True
+            w.start()
+        try:
+            stack = [(0, root, mask, ())]
+            inFlight = 0
+            while stack or inFlight > 0:
+                while stack and inFlight < threads:
+                    tasks.put(stack.pop())
+                    inFlight += 1
+                ok, result = results.get()
+                inFlight -= 1
+                if not ok:
+                    raise result[0], result[1], result[2]
+                children, found = result
+                for f in found:
+                    yield f
+                stack.extend(children)
+        finally:
+            for w in workers:
+                tasks.put(None)
+            # each worker finishes at most one more directory
+            for w in workers:
+                w.join()
+
+    def _expandWorker(self, tasks, results, expand):
+        for task in iter(tasks.get, None):
+            try:
+                results.put((True, expand(*task)))
+            except:
+                results.put((False, sys.exc_info()))
+
+    def _expand(self, depth, path, mask, parts, matcher):
+        """Match the contents of the directory at the given template depth
+        against the corresponding path component. Returns a list of
+        (depth, path, mask, parts) tuples for matching sub-directories to
+        descend into, and a list of (path, dataId) tuples for matching files.
+
+        To avoid copying dataIds for every matching directory, the dataId of
+        a directory is represented by parts, a tuple containing a dict of
+        the entries derived from each path component matched so far. Only
+        matching files get a complete dataId (see _materialize). The mask
+        identifies the rules of matcher (a
+        _RuleMatcher) that the dataId satisfies, and is None if there are
+        no rules.
+        """
+        children = []
+        found = []
+        pc = self._pathComponents[depth]
+        depth += 1
+        leaf = depth == len(self._pathComponents)
+        if pc.simple:
+            # No need to list directory contents; a single stat tells
+            # whether the entry exists and what type it is
+            p = os.path.join(path, pc.regex)
+            try:
+                mode = os.stat(p).st_mode
+            except OSError:
+                return children, found
+            if leaf and stat.S_ISREG(mode):
+                found.append((p, _materialize(parts)))
+            elif not leaf and stat.S_ISDIR(mode):
+                children.append((depth, p, mask, parts))
+            return children, found
+        names = self._candidateNames(pc, mask, matcher)
+        if names is not None:
+            return self._probe(pc, depth, leaf, path, mask, parts, matcher, names)
+        prefixes = self._candidatePrefixes(pc, mask, matcher)
+        try:
+            entries = _listDir(path)
+        except OSError as e:
+            if e.errno == errno.ENOTDIR:
+                return children, found
+            raise
+        for e in entries:
+            if prefixes is not None and not e.name.startswith(prefixes):
+                continue
+            kv = self._matchName(pc, e.name, parts if leaf else None)
+            if kv is None:
+                continue
+            subMask = mask
+            if mask is not None and pc.keys:
+                # have dataId rules and saw new keys; filter rules
+                subMask = matcher.match(mask, kv)
+                if not subMask:
+                    continue  # no rules matched
+            # Have path matching template and at least one rule. Entry types
+            # usually come from the directory listing itself (see _listDir),
+            # so checking them does not require a stat.
+            if leaf:
+                if e.is_file():
+                    # found a matching file
+                    found.append((e.path, kv))
+            elif e.is_dir():
+                # recurse
+                children.append((depth, e.path, subMask, parts + (kv,)))
+        return children, found
+
+    def _expandIndexed(self, depth, path, mask, parts, matcher, scan):
+        """Like _expand, but reads the matches for directories that have
+        not changed since they were last listed from scan (a ScanIndex
+        record), and records the matches for directories that have.
+        """
+        pc = self._pathComponents[depth]
+        if pc.simple or self._candidateNames(pc, mask, matcher) is not None:
+            # no directory listing required
+            return self._expand(depth, path, mask, parts, matcher)
+        children = []
+        found = []
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError as e:
+            if e.errno == errno.ENOTDIR:
+                return children, found
+            raise
+        depth += 1
+        leaf = depth == len(self._pathComponents)
+        matches = scan.get(path, mtime)
+        if matches is None:
+            # list the directory, recording all matches regardless of rules
+            listed = time.time()
+            matches = []
+            for e in _listDir(path):
+                kv = self._matchName(pc, e.name)
+                if kv is None:
+                    continue
+                if leaf:
+                    if e.is_file():
+                        st = e.stat()
+                        matches.append((e.name, kv, st.st_size, st.st_mtime))
+                elif e.is_dir():
+                    matches.append((e.name, kv, None, None))
+            scan.put(path, mtime, listed, leaf, matches)
+        for name, kv, size, t in matches:
+            subMask = mask
+            if mask is not None and kv:
+                subMask = matcher.match(mask, kv)
+                if not subMask:
+                    continue
+            p = os.path.join(path, name)
+            if leaf:
+                dataId = _materialize(parts)
+                dataId.update(kv)
+                found.append((p, dataId))
+            else:
+                children.append((depth, p, subMask, parts + (kv,)))
+        return children, found
+
+    def _candidateNames(self, pc, mask, matcher):
+        """Return the set of entry names matching path component pc that
+        are allowed by the rules of matcher identified by mask, or None if
+        those rules do not constrain every key of pc to a finite set of
+        values, or if there are more than maxProbes such names. Names are
+        formatted from rule values with the template, so entries with
+        differently formatted names (e.g. zero padded integers) are not
+        among them, even though they match the template.
+        """
+        if mask is None or pc.format is None:
+            return None
+        values = []
+        n = 0
+        for r in matcher.rules(mask):
+            vs = []
+            size = 1
+            for k in pc.keys:
+                v = self._formatKeys[k].unmunge(k, r)
+                if v is None:
+                    return None
+                vs.append(v)
+                size *= len(v)
+            n += size
+            if n > self.maxProbes:
+                return None
+            values.append(vs)
+        names = set()
+        for vs in values:
+            for combo in itertools.product(*vs):
+                try:
+                    name = pc.format % dict(zip(pc.keys, combo))
+                except (TypeError, ValueError):
+                    continue
+                if name and os.sep not in name:
+                    names.add(name)
+        return names
+
+    def _candidatePrefixes(self, pc, mask, matcher):
+        """Return a tuple of prefixes, one of which starts the name of every
+        entry matching path component pc that is allowed by the rules of
+        matcher identified by mask. For each rule, prefixes are formatted
+        from the values of the leading keys of pc that the rule constrains
+        to a finite set, up to the first key it does not constrain. Returns
+        None if there are no rules, or more than maxProbes prefixes. As
+        with _candidateNames, entries with names not formatted the way the
+        template formats them may lack these prefixes.
+        """
+        if mask is None or pc.format is None:
+            return None
+        prefixes = set()
+        for r in matcher.rules(mask):
+            keys = []
+            values = []
+            end = len(pc.format)
+            size = 1
+            for k in pc.keys:
+                v = self._formatKeys[k].unmunge(k, r)
+                if v is None:
+                    end = pc.format.index(self._formatKeys[k].spec)
+                    break
+                keys.append(k)
+                values.append(v)
+                size *= len(v)
+            if size > self.maxProbes:
+                return None
+            for combo in itertools.product(*values):
+                try:
+                    prefixes.add(pc.format[:end] % dict(zip(keys, combo)))
+                except (TypeError, ValueError):
+                    continue
+            if len(prefixes) > self.maxProbes:
+                return None
+        return tuple(prefixes)
+
+    def _probe(self, pc, depth, leaf, path, mask, parts, matcher, names):
+        """Check the given candidate names for entries matching path
+        component pc with stat, instead of listing the directory. Returns
+        the same results as _expand; depth is the template depth of the
+        matches.
+        """
+        children = []
+        found = []
+        for name in sorted(names):
+            kv = self._matchName(pc, name, parts if leaf else None)
+            if kv is None:
+                continue
+            subMask = matcher.match(mask, kv)
+            if not subMask:
+                continue
+            p = os.path.join(path, name)
+            try:
+                mode = os.stat(p).st_mode
+            except OSError as e:
+                if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise
+            if leaf:
+                if stat.S_ISREG(mode):
+                    found.append((p, kv))
+            elif stat.S_ISDIR(mode):
+                children.append((depth, p, subMask, parts + (kv,)))
+        return children, found
+
+    def _matchName(self, pc, name, parts=None):
+        """Match a directory entry name against a path component. Returns
+        a dict of the dataId entries derived from the key values in name,
+        or None if there is no match. If parts is not None, the entries are
+        added to the dataId merged from parts (see _materialize) instead,
+        so that matching files need only one dict.
+        """
+        # make sure name matches path component regular expression
+        m = pc.regex.match(name)
+        if not m:
+            return None
+        # got a match - compute dataId entries for new key values (if any)
+        dataId = {} if parts is None else _materialize(parts)
+        try:
+            for i, k in enumerate(pc.keys):
+                self._formatKeys[k].munge(k, m.group(i + 1), dataId)
+        except:
+            # Munger raises if value is invalid for key, so
+            # not really a match
+            return None
+        return dataId
+
+
+class _BackgroundWalk(object):
+    """Iterator over the results of a generator run in a background
+    thread; see HfsScanner.backgroundWalk().
+    """
+
+    _done = object()
+
+    def __init__(self, results, maxQueued):
+        self._queue = Queue.Queue(maxQueued)
+        self._stopped = threading.Event()
+        self._finished = False
+        self._thread = threading.Thread(target=self._run, args=(results,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._finished:
+            raise StopIteration
+        item = self._queue.get()
+        if item is self._done:
+            self._finished = True
+            self._thread.join()
+            raise StopIteration
+        if isinstance(item, _Failure):
+            self._finished = True
+            self._thread.join()
+            raise item.excInfo[0], item.excInfo[1], item.excInfo[2]
+        return item
+
+    def close(self):
+        """Stop the background walk and wait for it to finish."""
+        self._stopped.set()
+        self._finished = True
+        self._thread.join()
+
+    def _run(self, results):
+        try:
+            for r in results:
+                if not self._put(r):
+                    return
+            self._put(self._done)
+        except:
+            self._put(_Failure(sys.exc_info()))
+        finally:
+            results.close()
+
+    def _put(self, item):
+        """Queue item, waiting for space unless the walk is stopped.
+        Returns False if the walk was stopped.
+        """
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, True, 0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+
+class _Failure(object):
+    """Wraps the exception info of a failed background walk."""
+
+    def __init__(self, excInfo):
+        self.excInfo = excInfo
+
+
+def _materialize(parts):
+    """Merge a tuple of dicts, each holding the dataId entries derived from
+    one path component, into a single dataId dict. Entries from later
+    components take precedence.
+    """
+    if len(parts) == 1:
+        return parts[0].copy()
+    dataId = {}
+    for kv in parts:
+        dataId.update(kv)
+    return dataId
+
+
+class _RuleMatcher(object):
+    """A list of dataId rules (see parseDataIdRules) compiled for fast
+    matching. A subset of the rules is represented by an integer bit mask,
+    where bit i is set if rule i is in the subset.
+
+    For every key referenced by a rule, the matcher stores the mask of
+    rules that do not constrain the key, and a dict mapping each value
+    allowed by some rule to the mask of rules that allow it. Keys with
+    IntervalSet values instead get a segment table: a sorted list of
+    segment start values, and the mask of rules allowing each segment,
+    which is searched with bisect. Narrowing a set of rules down to those
+    satisfied by a dataId then takes a lookup and a bitwise and per key,
+    rather than a pass over the rules for every key.
+    """
+
+    def __init__(self, rules):
+        self._rules = list(rules)
+        self.all = (1 << len(self._rules)) - 1
+        constrained = {}
+        values = {}
+        for i, r in enumerate(self._rules):
+            for k in r:
+                constrained[k] = constrained.get(k, 0) | (1 << i)
+                values.setdefault(k, []).append((i, r[k]))
+        self._keys = {}
+        for k, vs in values.iteritems():
+            if any(isinstance(v, IntervalSet) for i, v in vs):
+                starts, masks = _segmentTable(
+                    [(i, v if isinstance(v, IntervalSet) else IntervalSet((x, x) for x in v))
+                     for i, v in vs])
+            else:
+                starts, masks = None, {}
+                for i, v in vs:
+                    for x in v:
+                        masks[x] = masks.get(x, 0) | (1 << i)
+            self._keys[k] = (self.all & ~constrained[k], starts, masks)
+
+    def match(self, mask, dataId):
+        """Return the subset of the rules in mask that are satisfied by
+        the entries in dataId; 0 if there are none. Only the keys in dataId
+        are checked, so when a dataId is built up incrementally, mask need
+        only be narrowed by the newly added entries.
+        """
+        for k, v in dataId.iteritems():
+            entry = self._keys.get(k)
+            if entry is None:
+                continue
+            unconstrained, starts, masks = entry
+            if starts is None:
+                m = masks.get(v, 0)
+            else:
+                j = bisect.bisect_right(starts, v)
+                m = masks[j - 1] if j > 0 else 0
+            mask &= unconstrained | m
+            if not mask:
+                break
+        return mask
+
+    def rules(self, mask):
+        """Return the list of rules in mask."""
+        return [r for i, r in enumerate(self._rules) if mask >> i & 1]
+
+
+def _segmentTable(values):
+    """Given a list of (rule index, IntervalSet) pairs, split the integers
+    into segments allowed by the same rules. Returns a sorted list of
+    segment start values, and a list containing the mask of rules allowing
+    each segment. The last segment extends to infinity; integers smaller
+    than the first start are allowed by no rule.
+    """
+    events = {}
+    for i, v in values:
+        bit = 1 << i
+        for first, last in v.intervals:
+            events[first] = events.get(first, 0) ^ bit
+            events[last + 1] = events.get(last + 1, 0) ^ bit
+    starts = []
+    masks = []
+    mask = 0
+    for x in sorted(events):
+        # intervals of a single rule are disjoint and non-adjacent, so each
+        # event toggles the bit of a rule entering or leaving
+        mask ^= events[x]
+        starts.append(x)
+        masks.append(mask)
+    return starts, masks
+
+
+class _DirEntry(object):
+    """Minimal stand-in for os.DirEntry, used when scandir is unavailable.
+    Entry types are determined with stat calls, on demand.
+    """
+
+    def __init__(self, dir, name):
+        self.name = name
+        self.path = os.path.join(dir, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+def _listDir(path):
+    """Return a list of os.DirEntry-like objects for the contents of a
+    directory. With scandir, entry types are taken from the d_type field
+    returned by the directory read, and is_dir()/is_file() need no extra
+    system call for anything but symbolic links (or on file systems that
+    do not report d_type).
+    """
+    if _scandir is not None:
+        return list(_scandir(path))
+    return [_DirEntry(path, e) for e in os.listdir(path)]
+
 
 # -- Camera specific dataId mungers ----
 
 def _mungeLsstSim(k, v, dataId):
-    dataId = dataId.copy()
     if k == 'raft':
         r1, r2 = v
         dataId['raft'] = r1 + ',' + r2
@@ -363,20 +961,16 @@ def _mungeLsstSim(k, v, dataId):
         dataId[k] = int(v)
     else:
         dataId[k] = v
-    return dataId
 
 
 def _mungeSdss(k, v, dataId):
-    dataId = dataId.copy()
     if _keyTypes['sdss'][k] == int:
         dataId[k] = int(v)
     else:
         dataId[k] = v
-    return dataId
 
 
 def _mungeCfht(k, v, dataId):
-    dataId = dataId.copy()
     if k == 'ccd':
         dataId['ccd'] = int(v)
         dataId['ccdName'] = v
@@ -387,7 +981,6 @@ def _mungeCfht(k, v, dataId):
         dataId[k] = int(v)
     else:
         dataId[k] = v
-    return dataId
 
 _mungeFunctions = {
     'lsstsim': _mungeLsstSim,
@@ -396,6 +989,38 @@ _mungeFunctions = {
 }
 
 
+# -- Camera specific inverse dataId mungers ----
+
+def _unmungeLsstSim(k, rule):
+    if k == 'raft':
+        values = rule.get('raft')
+    elif k in ('sensor', 'ccd'):
+        values = rule.get('sensor')
+    elif k in ('channel', 'amp'):
+        values = rule.get('channel')
+    elif k in ('snap', 'exposure'):
+        return rule.get('snap')
+    else:
+        return rule.get(k)
+    if values is None:
+        return None
+    return [v.replace(',', '') for v in values]
+
+
+def _unmungeSdss(k, rule):
+    return rule.get(k)
+
+
+def _unmungeCfht(k, rule):
+    return rule.get(k)
+
+_unmungeFunctions = {
+    'lsstsim': _unmungeLsstSim,
+    'sdss': _unmungeSdss,
+    'cfht': _unmungeCfht,
+}
+
+
 class DatasetScanner(HfsScanner):
     """File system scanner for a dataset known to a camera mapper.
     """
@@ -413,3 +1038,4 @@ class DatasetScanner(HfsScanner):
             if k not in _keyTypes[camera]:
                 raise RuntimeError('{} is not a valid dataId key for camera {}'.format(k, camera))
             self._formatKeys[k].munge = _mungeFunctions[camera]
+            self._formatKeys[k].unmunge = _unmungeFunctions[camera]
@@ -0,0 +1,132 @@
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+from __future__ import with_statement
+from __future__ import print_function
+import errno
+import os
+import re
+import sys
+import threading
+
+__all__ = ['FifoLoader']
+
+
+class FifoLoader(object):
+    """Loads CSV files into MySQL while they are being written.
+
+    For each CSV file, a named pipe (FIFO) is created in place of the file,
+    and a thread runs the LOAD DATA LOCAL INFILE statement for it. Anything
+    that subsequently opens the file path for writing, e.g. a CsvFileWriter
+    with compression turned off, streams rows straight into the database,
+    so generation and loading overlap and no intermediate file is stored.
+
+    All FIFOs must be set up with load() before writers open them. Writers
+    must close their files before wait() or abort() is called.
+
+    Rows are committed as they are loaded, so if generation fails part way,
+    the tables being loaded hold whatever was written before the failure.
+    Call abort() rather than wait() in that case: it stops the loads and
+    returns the tables that may hold partial data.
+    """
+
+    def __init__(self, sql):
+        """@param[in] sql: MysqlExecutor used to run LOAD statements"""
+        self.sql = sql
+        self.loads = []
+        self.errors = []
+        self.finished = False
+
+    def load(self, path, stmt):
+        """Replace path with a FIFO and start loading from it using stmt,
+        which must be a LOAD DATA LOCAL INFILE statement reading path.
+        """
+        if os.path.lexists(path):
+            os.remove(path)
+        os.mkfifo(path)
+        # Hold a read end open until loading is over, so that writers never
+        # see a FIFO without readers (and fail with EPIPE) between a load
+        # failing and its output being drained.
+        fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        t = threading.Thread(target=self._run, args=(path, stmt, fd))
+        t.daemon = True
+        t.start()
+        self.loads.append((path, t, stmt))
+
+    def wait(self):
+        """Wait for all loads to finish and remove the FIFOs.
+
+        @raise RuntimeError if any load failed
+        """
+        self._join()
+        if self.errors:
+            raise RuntimeError('Failed to load ' + ', '.join(self.errors))
+
+    def abort(self):
+        """Stop loading after generation has failed, and remove the FIFOs.
+        Loads still waiting for a writer see end-of-file, and load errors are
+        reported on stderr but not raised.
+
+        @return the names of the tables being loaded, which may hold
+                partial data.
+        """
+        tables = []
+        for path, t, stmt in self.loads:
+            match = re.search(r'INTO\s+TABLE\s+([^\s;(]+)', stmt, re.IGNORECASE)
+            tables.append(match.group(1) if match else path)
+        self._join()
+        return tables
+
+    def _join(self):
+        self.finished = True
+        for path, t, stmt in self.loads:
+            while t.is_alive():
+                # wake up a loader blocked waiting for a writer
+                _poke(path)
+                t.join(0.1)
+            os.remove(path)
+        self.loads = []
+
+    def _run(self, path, stmt, fd):
+        try:
+            self.sql.execStmt(stmt)
+        except Exception as e:
+            print('*** Load from {} failed: {}'.format(path, e), file=sys.stderr)
+            self.errors.append(path)
+            # Keep consuming output so that writers do not block forever
+            while not self.finished:
+                with open(path, 'rb') as f:
+                    while f.read(1 << 20):
+                        pass
+        finally:
+            os.close(fd)
+
+
+def _poke(path):
+    """Open and close a FIFO for writing without blocking, so that a reader
+    waiting for a writer sees end-of-file.
+    """
+    try:
+        os.close(os.open(path, os.O_WRONLY | os.O_NONBLOCK))
+    except OSError as e:
+        # ENXIO: no reader is waiting
+        if e.errno != errno.ENXIO:
+            raise
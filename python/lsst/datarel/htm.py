@@ -0,0 +1,364 @@
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Hierarchical Triangular Mesh (HTM) indexing of points and convex
+spherical polygons, vectorized with numpy.
+
+The mesh is the one used by scisql (and SDSS): level 0 consists of the 8
+root triangles S0, S1, S2, S3, N0, N1, N2, N3 with IDs 8 through 15, and
+the children of the triangle with ID i have IDs 4*i, 4*i + 1, 4*i + 2 and
+4*i + 3. polygonHtmIds() computes the same (polygon, HTM ID) pairs as the
+scisql_index program.
+"""
+from __future__ import print_function
+import sys
+
+import numpy
+
+__all__ = ['maxLevel', 'htmIds', 'convexPolygons', 'polygonHtmIds', 'HtmIndexWriter']
+
+maxLevel = 24
+
+_x = numpy.array([1.0, 0.0, 0.0])
+_y = numpy.array([0.0, 1.0, 0.0])
+_z = numpy.array([0.0, 0.0, 1.0])
+
+# Vertices of the root triangles S0, S1, S2, S3, N0, N1, N2, N3, in
+# counter-clockwise order when viewed from outside the unit sphere.
+_roots = numpy.array([
+    [_x, -_z, _y],
+    [_y, -_z, -_x],
+    [-_x, -_z, -_y],
+    [-_y, -_z, _x],
+    [_x, _z, -_y],
+    [-_y, _z, -_x],
+    [-_x, _z, _y],
+    [_y, _z, _x],
+])
+
+# Triangle/polygon relationships
+_DISJOINT = 0
+_INTERSECT = 1
+_INSIDE = 2
+
+
+def _unitVectors(ra, dec):
+    """Convert arrays of ra, dec (in degrees) to unit vectors, stored along
+    a new trailing axis of length 3.
+    """
+    ra = numpy.radians(numpy.asarray(ra, dtype=numpy.float64))
+    dec = numpy.radians(numpy.asarray(dec, dtype=numpy.float64))
+    cosDec = numpy.cos(dec)
+    return numpy.stack([numpy.cos(ra) * cosDec, numpy.sin(ra) * cosDec, numpy.sin(dec)], axis=-1)
+
+
+def _normalize(v):
+    return v / numpy.sqrt(numpy.einsum('...i,...i->...', v, v))[..., numpy.newaxis]
+
+
+def _checkLevel(level):
+    if level < 0 or level > maxLevel:
+        raise RuntimeError('HTM subdivision level {} is not in [0, {}]'.format(level, maxLevel))
+
+
+def _children(tri):
+    """Given an array of triangles with shape (n, 3, 3), return the array of
+    their children, with shape (n, 4, 3, 3).
+    """
+    v0, v1, v2 = tri[:, 0], tri[:, 1], tri[:, 2]
+    w0 = _normalize(v1 + v2)
+    w1 = _normalize(v0 + v2)
+    w2 = _normalize(v0 + v1)
+    return numpy.stack([
+        numpy.stack([v0, w2, w1], axis=1),
+        numpy.stack([v1, w0, w2], axis=1),
+        numpy.stack([v2, w1, w0], axis=1),
+        numpy.stack([w0, w1, w2], axis=1),
+    ], axis=1)
+
+
+def _contains(tri, p):
+    """Return a boolean array indicating whether each triangle of tri
+    (shape (n, 3, 3)) contains the corresponding point of p (shape (n, 3)).
+    Points on triangle edges are contained.
+    """
+    normals = numpy.cross(tri, numpy.roll(tri, -1, axis=1))
+    return (numpy.einsum('nei,ni->ne', normals, p) >= 0.0).all(axis=1)
+
+
+def _rootIndexes(p):
+    """Return the index (0 for S0, ..., 7 for N3) of the root triangle
+    containing each point of p, which has shape (n, 3). Points on root
+    triangle boundaries are assigned as by scisql.
+    """
+    x, y, z = p[:, 0], p[:, 1], p[:, 2]
+    south = numpy.where(y > 0.0, numpy.where(x > 0.0, 0, 1),
+                        numpy.where(y == 0.0, numpy.where(x >= 0.0, 0, 2),
+                                    numpy.where(x < 0.0, 2, 3)))
+    north = numpy.where(y > 0.0, numpy.where(x > 0.0, 7, 6),
+                        numpy.where(y == 0.0, numpy.where(x >= 0.0, 7, 5),
+                                    numpy.where(x < 0.0, 5, 4)))
+    return numpy.where(z < 0.0, south, north)
+
+
+def htmIds(ra, dec, level):
+    """Compute HTM IDs of points.
+
+    @param[in] ra:     sequence of n right ascensions, in degrees
+    @param[in] dec:    sequence of n declinations, in degrees
+    @param[in] level:  HTM subdivision level, in [0, maxLevel]
+
+    @return a numpy int64 array containing the ID of the level-level HTM
+            triangle containing each point.
+    """
+    _checkLevel(level)
+    p = _unitVectors(numpy.ravel(ra), numpy.ravel(dec))
+    roots = _rootIndexes(p)
+    ids = roots.astype(numpy.int64) + 8
+    tri = _roots[roots]
+    rows = numpy.arange(len(ids))
+    for l in xrange(level):
+        children = _children(tri)
+        child = numpy.full(len(ids), 3, dtype=numpy.int64)
+        for c in (2, 1, 0):
+            child[_contains(children[:, c], p)] = c
+        ids = ids * 4 + child
+        tri = children[rows, child]
+    return ids
+
+
+def _orientedEdges(verts):
+    """Return the edge plane normals of the polygons with the given vertices
+    (an array of shape (n, m, 3)), oriented so that the interiors of convex
+    polygons lie on their positive side, along with a boolean array that is
+    False for degenerate or non-convex polygons.
+    """
+    m = verts.shape[1]
+    if m < 3:
+        raise RuntimeError('Polygons must have at least 3 vertices')
+    edges = numpy.cross(verts, numpy.roll(verts, -1, axis=1))
+    # vertices must be on the inner side of every edge they do not belong to,
+    # for either vertex order
+    sides = numpy.einsum('nei,nvi->nev', edges, verts)
+    own = numpy.zeros((m, m), dtype=bool)
+    own[numpy.arange(m), numpy.arange(m)] = True
+    own[numpy.arange(m), (numpy.arange(m) + 1) % m] = True
+    ccw = numpy.where(own, True, sides > 0.0).all(axis=(1, 2))
+    cw = numpy.where(own, True, sides < 0.0).all(axis=(1, 2))
+    edges[cw] *= -1.0
+    return edges, ccw | cw
+
+
+def _polygonEdges(verts):
+    """Return the edge plane normals of the convex polygons with the given
+    vertices (an array of shape (n, m, 3)), oriented so that polygon
+    interiors lie on their positive side. Raise a RuntimeError if a polygon
+    is degenerate or not convex.
+    """
+    edges, valid = _orientedEdges(verts)
+    bad = numpy.flatnonzero(~valid)
+    if len(bad) > 0:
+        raise RuntimeError('Polygon {} is degenerate or not convex'.format(bad[0]))
+    return edges
+
+
+def convexPolygons(ra, dec):
+    """Return a boolean array that is True for the polygons accepted by
+    polygonHtmIds() and False for degenerate or non-convex ones.
+
+    @param[in] ra:     array of shape (n, m) containing the right
+                       ascensions (in degrees) of the m vertices of each of
+                       n polygons
+    @param[in] dec:    array of shape (n, m) containing the corresponding
+                       declinations, in degrees
+    """
+    verts = _unitVectors(ra, dec)
+    if verts.ndim != 3:
+        raise RuntimeError('Polygon vertex coordinates must be 2 dimensional arrays')
+    if verts.shape[0] == 0:
+        return numpy.zeros(0, dtype=bool)
+    return _orientedEdges(verts)[1]
+
+
+def _relate(tri, verts, edges):
+    """Classify triangles with respect to convex polygons.
+
+    @param[in] tri:    triangle vertices, shape (n, 3, 3)
+    @param[in] verts:  polygon vertices, shape (n, m, 3)
+    @param[in] edges:  polygon edge plane normals, shape (n, m, 3)
+
+    @return an array of n _DISJOINT, _INTERSECT or _INSIDE values, where
+            _INSIDE means that the triangle is entirely inside the polygon.
+    """
+    # sides of the polygon edge planes on which triangle vertices fall
+    triSides = numpy.einsum('nti,nei->nte', tri, edges)
+    numIn = (triSides >= 0.0).all(axis=2).sum(axis=1)
+    rel = numpy.where(numIn == 3, _INSIDE, numpy.where(numIn > 0, _INTERSECT, _DISJOINT))
+    rest = numpy.flatnonzero(numIn == 0)
+    if len(rest) == 0:
+        return rel
+    tri, verts, edges, triSides = tri[rest], verts[rest], edges[rest], triSides[rest]
+    triEdges = numpy.cross(tri, numpy.roll(tri, -1, axis=1))
+    # sides of the triangle edge planes on which polygon vertices fall
+    polySides = numpy.einsum('nei,nvi->nev', triEdges, verts)
+    hit = (polySides >= 0.0).all(axis=1).any(axis=1)
+    # Triangle edge e and polygon edge j cross if the end points of each
+    # are on opposite sides of the other's plane, and the same one of the
+    # two intersections of the planes lies on both edges.
+    straddle = ((polySides * numpy.roll(polySides, -1, axis=2) < 0.0) &
+                (triSides * numpy.roll(triSides, -1, axis=1) < 0.0))
+    x = numpy.cross(triEdges[:, :, numpy.newaxis, :], edges[:, numpy.newaxis, :, :])
+    triMid = tri + numpy.roll(tri, -1, axis=1)
+    polyMid = verts + numpy.roll(verts, -1, axis=1)
+    dt = numpy.einsum('neji,nei->nej', x, triMid)
+    dp = numpy.einsum('neji,nji->nej', x, polyMid)
+    hit |= (straddle & (dt * dp > 0.0)).any(axis=(1, 2))
+    rel[rest[hit]] = _INTERSECT
+    return rel
+
+
+def polygonHtmIds(ra, dec, level):
+    """Compute the HTM triangles overlapping convex spherical polygons.
+
+    @param[in] ra:     array of shape (n, m) containing the right
+                       ascensions (in degrees) of the m vertices of each of
+                       n polygons
+    @param[in] dec:    array of shape (n, m) containing the corresponding
+                       declinations, in degrees
+    @param[in] level:  HTM subdivision level, in [0, maxLevel]
+
+    @return a pair of numpy int64 arrays (indexes, ids), sorted by polygon
+            index and then HTM ID, such that ids[k] is the ID of a
+            level-level HTM triangle overlapping polygon indexes[k].
+
+    Polygon edges are great circle arcs between consecutive vertices, which
+    may be given in either clockwise or counter-clockwise order. Polygons
+    must be convex and smaller than a hemisphere; a RuntimeError is raised
+    for degenerate or non-convex polygons.
+    """
+    _checkLevel(level)
+    verts = _unitVectors(ra, dec)
+    if verts.ndim != 3:
+        raise RuntimeError('Polygon vertex coordinates must be 2 dimensional arrays')
+    n = verts.shape[0]
+    empty = numpy.zeros(0, dtype=numpy.int64)
+    if n == 0:
+        return empty, empty
+    edges = _polygonEdges(verts)
+    # Traverse the mesh breadth first. Triangles inside a polygon contribute
+    # all their descendants at the target level; triangles intersecting it
+    # are subdivided.
+    poly = numpy.repeat(numpy.arange(n, dtype=numpy.int64), 8)
+    ids = numpy.tile(numpy.arange(8, 16, dtype=numpy.int64), n)
+    tri = numpy.tile(_roots, (n, 1, 1))
+    ranges = []
+    for l in xrange(level + 1):
+        rel = _relate(tri, verts[poly], edges[poly])
+        inside = rel == _INSIDE
+        shift = 2 * (level - l)
+        ranges.append((poly[inside], ids[inside] << shift, (ids[inside] + 1) << shift))
+        partial = rel == _INTERSECT
+        poly, ids, tri = poly[partial], ids[partial], tri[partial]
+        if l == level:
+            ranges.append((poly, ids, ids + 1))
+            break
+        poly = numpy.repeat(poly, 4)
+        ids = (ids[:, numpy.newaxis] * 4 + numpy.arange(4)).ravel()
+        tri = _children(tri).reshape(-1, 3, 3)
+    # expand [begin, end) ID ranges
+    poly, begin, end = [numpy.concatenate(a) for a in zip(*ranges)]
+    counts = end - begin
+    total = counts.sum()
+    if total == 0:
+        return empty, empty
+    offsets = numpy.arange(total, dtype=numpy.int64) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    indexes = numpy.repeat(poly, counts)
+    ids = numpy.repeat(begin, counts) + offsets
+    order = numpy.lexsort((ids, indexes))
+    return indexes[order], ids[order]
+
+
+class HtmIndexWriter(object):
+    """Writes (polygon ID, HTM ID) rows for the HTM triangles overlapping
+    convex polygons to a tab separated file, in the format of scisql_index
+    output, suitable for MySQL LOAD DATA INFILE.
+
+    Polygons are buffered and indexed bufferRows at a time. The number of
+    polygons written so far is available as numRows, and the number of
+    (polygon ID, HTM ID) rows as numIds. Degenerate or non-convex polygons
+    cannot be indexed; rather than failing the whole file, they are skipped
+    with a warning on stderr, and counted in numSkipped.
+    """
+
+    def __init__(self, path, level, overwrite=True, bufferRows=1024):
+        _checkLevel(level)
+        self.f = open(path, "wb" if overwrite else "ab", 1 << 20)
+        self.level = level
+        self.polyIds = []
+        self.ra = []
+        self.dec = []
+        self.numRows = 0
+        self.numIds = 0
+        self.numSkipped = 0
+        self.bufferRows = max(1, bufferRows)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if not self.f.closed:
+            self._writeRows()
+            self.f.close()
+
+    def flush(self):
+        self._writeRows()
+        self.f.flush()
+
+    def write(self, polyId, ra, dec):
+        """Buffer a polygon with the given ID and vertex coordinates (in
+        degrees). All polygons written must have the same number of vertices.
+        """
+        self.polyIds.append(polyId)
+        self.ra.append(ra)
+        self.dec.append(dec)
+        self.numRows += 1
+        if len(self.polyIds) >= self.bufferRows:
+            self._writeRows()
+
+    def _writeRows(self):
+        if not self.polyIds:
+            return
+        polyIds, ra, dec = self.polyIds, self.ra, self.dec
+        self.polyIds, self.ra, self.dec = [], [], []
+        valid = convexPolygons(ra, dec)
+        if not valid.all():
+            for i in numpy.flatnonzero(~valid).tolist():
+                print('*** Skipping polygon {} : degenerate or not convex'.format(polyIds[i]),
+                      file=sys.stderr)
+            self.numSkipped += int((~valid).sum())
+            keep = numpy.flatnonzero(valid)
+            polyIds = [polyIds[i] for i in keep.tolist()]
+            ra = numpy.asarray(ra, dtype=numpy.float64)[keep]
+            dec = numpy.asarray(dec, dtype=numpy.float64)[keep]
+        indexes, ids = polygonHtmIds(ra, dec, self.level)
+        self.numIds += len(ids)
+        self.f.write(''.join(['{}\t{}\n'.format(polyIds[i], h)
+                              for i, h in zip(indexes.tolist(), ids.tolist())]))
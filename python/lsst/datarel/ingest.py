@@ -22,6 +22,7 @@
 import argparse
 import shlex
 
+from .csvFileWriter import addCsvOptions
 from .mysqlExecutor import addDbOptions
 from .datasetScanner import parseDataIdRules
 
@@ -77,6 +78,7 @@ def makeArgumentParser(description, inRootsRequired=True, addRegistryOption=True
                "append only.")
     parser.convert_arg_line_to_args = _line_to_args
     addDbOptions(parser)
+    addCsvOptions(parser)
     parser.add_argument(
         "-d", "--database", dest="database",
         help="MySQL database to load CSV files into.")
@@ -0,0 +1,154 @@
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+from __future__ import with_statement
+import json
+import os
+
+__all__ = ['ChunkManifest']
+
+
+def _toStr(obj):
+    """Recursively convert unicode strings produced by the json module
+    to plain str, which is what the ingest code expects.
+    """
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    if isinstance(obj, list):
+        return [_toStr(o) for o in obj]
+    if isinstance(obj, dict):
+        return dict((_toStr(k), _toStr(v)) for k, v in obj.iteritems())
+    return obj
+
+
+class ChunkManifest(object):
+    """Records the progress of a chunked ingest in JSON files, so that an
+    interrupted ingest can be resumed.
+
+    The work items of an ingest (e.g. (root, path, dataId) lists for the
+    exposures found by a scan) are divided into fixed size chunks. The
+    items are saved once, next to the manifest, in path + '.items'. For
+    each chunk, the manifest holds a dict with the following entries:
+
+    status
+        'pending' until the CSV files for the chunk have been written,
+        'written' until loading them starts, 'loading' until they have
+        been loaded, and 'loaded' thereafter. Files of a 'loading' chunk
+        that are not listed in loaded may have been partially loaded by
+        an interrupted run.
+
+    rows
+        A dict mapping output file names to the number of rows written.
+
+    loaded
+        A list of the output files of the chunk that have been loaded.
+
+    The manifest also stores the parameters of the ingest (input roots,
+    data ID specifications, ...); resuming with different parameters is
+    an error. The manifest is small, and is rewritten atomically on every
+    save().
+    """
+
+    def __init__(self, path, params):
+        """Read the manifest at path, if there is one.
+
+        @param[in] path: manifest file path
+        @param[in] params: JSON serializable dict of ingest parameters
+
+        @raise RuntimeError if an existing manifest has different parameters
+        """
+        self.path = path
+        self.params = _toStr(json.loads(json.dumps(params)))
+        self.chunkSize = None
+        self.chunks = None
+        self.items = None
+        if os.path.exists(path):
+            m = _load(path)
+            if m['params'] != self.params:
+                raise RuntimeError(str.format(
+                    'Ingest manifest {} was written with different parameters - '
+                    'remove it or use a different output directory', path))
+            self.chunkSize = m['chunkSize']
+            self.chunks = m['chunks']
+            self.items = _load(path + '.items')
+
+    @property
+    def scanned(self):
+        """True if work items have been recorded."""
+        return self.chunks is not None
+
+    def setItems(self, items, chunkSize):
+        """Divide a list of work items into chunks and save the manifest."""
+        _save(self.path + '.items', items)
+        self.items = items
+        self.chunkSize = chunkSize
+        self.chunks = [dict(status='pending', rows={}, loaded=[])
+                       for i in xrange(0, len(items), chunkSize)]
+        self.save()
+
+    def chunkItems(self, i):
+        """Return the work items in chunk i."""
+        return self.items[i*self.chunkSize:(i + 1)*self.chunkSize]
+
+    def withStatus(self, status):
+        """Return the indexes of chunks with the given status."""
+        return [i for i, c in enumerate(self.chunks) if c['status'] == status]
+
+    def beginLoad(self, i):
+        """Mark chunk i as being loaded and save the manifest.
+
+        @return True if a previous load of the chunk was interrupted, in
+                which case the files of the chunk that have not been
+                recorded as loaded may have been partially loaded
+        """
+        interrupted = self.chunks[i]['status'] == 'loading'
+        self.chunks[i]['status'] = 'loading'
+        self.save()
+        return interrupted
+
+    def fileLoaded(self, i, name):
+        """Record that output file name of chunk i has been loaded, and save
+        the manifest."""
+        self.chunks[i]['loaded'].append(name)
+        self.save()
+
+    def endLoad(self, i):
+        """Mark chunk i as loaded and save the manifest."""
+        self.chunks[i]['status'] = 'loaded'
+        self.save()
+
+    def save(self):
+        _save(self.path, dict(params=self.params, chunkSize=self.chunkSize, chunks=self.chunks))
+
+
+def _load(path):
+    with open(path, 'rb') as f:
+        return _toStr(json.load(f))
+
+
+def _save(path, obj):
+    """Atomically replace the contents of path with a JSON dump of obj."""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        json.dump(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
@@ -22,19 +22,94 @@
 
 from __future__ import with_statement
 from __future__ import print_function
-from contextlib import closing
+from contextlib import closing, contextmanager
 import getpass
 import MySQLdb as sql
+from MySQLdb.constants import CLIENT
+from MySQLdb.cursors import SSCursor
 import argparse
 import os
+import socket
 import subprocess
 import sys
+import threading
+import time
 from lsst.daf.persistence import DbAuth
 
 
+def splitStatements(text):
+    """Generator over the SQL statements in the given script text, in the
+    manner of the mysql command line client: statements are terminated by
+    the current delimiter (initially a semicolon), which DELIMITER commands
+    change, e.g. around stored function bodies. Delimiters inside quoted
+    strings, identifiers and comments are ignored. Comments are removed,
+    except for /*! ... */ comments, which the server executes.
+    """
+    delimiter = ';'
+    stmt = []
+    blank = True
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if blank and c in 'dD' and text[i:i + 9].lower() == 'delimiter' and \
+                text[i + 9:i + 10].isspace():
+            # DELIMITER command: the rest of the line holds the new delimiter
+            end = text.find('\n', i)
+            end = n if end == -1 else end
+            words = text[i + 9:end].split()
+            if not words:
+                raise RuntimeError('DELIMITER command without a delimiter')
+            delimiter = words[0]
+            stmt = []
+            i = end + 1
+        elif text.startswith(delimiter, i):
+            s = ''.join(stmt).strip()
+            if s:
+                yield s
+            stmt = []
+            blank = True
+            i += len(delimiter)
+        elif c in '\'"`':
+            # quoted string or identifier
+            j = i + 1
+            while j < n and text[j] != c:
+                j += 2 if text[j] == '\\' and c != '`' else 1
+            stmt.append(text[i:j + 1])
+            blank = False
+            i = j + 1
+        elif c == '#' or (text.startswith('--', i) and (i + 2 == n or text[i + 2].isspace())):
+            end = text.find('\n', i)
+            i = n if end == -1 else end
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            if text.startswith('/*!', i):
+                stmt.append(text[i:end])
+                blank = False
+            i = end
+        else:
+            stmt.append(c)
+            blank = blank and c.isspace()
+            i += 1
+    s = ''.join(stmt).strip()
+    if s:
+        yield s
+
+
 class MysqlExecutor(object):
+    """Runs SQL statements, scripts and queries against a MySQL database.
+
+    Statements and scripts are executed over MySQLdb connections that are
+    kept in a pool and reused, rather than by a mysql client process per
+    call; use connection() to borrow a pooled connection directly. Up to
+    poolSize idle connections are retained, and more are opened when
+    several threads use the executor concurrently. If useClient is True,
+    execStmt, execScript and createDb run the mysql command line client
+    instead, as they did before connection pooling was added.
+    """
 
-    def __init__(self, host, database, user, port=3306, password=None):
+    def __init__(self, host, database, user, port=3306, password=None,
+                 poolSize=4, useClient=False):
         self.host = host
         self.port = port
         self.user = user
@@ -56,10 +131,61 @@ class MysqlExecutor(object):
             self.mysqlCmd += ['-u', self.user]
         if password is not None:
             self.mysqlCmd += ['-p' + self.password]
+        self.poolSize = poolSize
+        self.useClient = useClient
+        self._pool = []
+        self._poolLock = threading.Lock()
+
+    def __del__(self):
+        if hasattr(self, '_pool'):
+            self.close()
+
+    def close(self):
+        """Close all idle pooled connections."""
+        with self._poolLock:
+            pool, self._pool = self._pool, []
+        for conn in pool:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Context manager providing a pooled connection to the database.
+        The connection is returned to the pool when the with block exits
+        normally, and closed if it exits with an exception, since the
+        connection may then be in an unknown state (e.g. with unread
+        results).
+        """
+        with self._poolLock:
+            conn = self._pool.pop() if self._pool else None
+        if conn is None:
+            conn = self.getConn()
+        else:
+            try:
+                # reconnect if the server has closed the connection
+                conn.ping(True)
+            except sql.Error:
+                conn.close()
+                conn = self.getConn()
+        try:
+            yield conn
+        except:
+            conn.close()
+            raise
+        with self._poolLock:
+            if len(self._pool) < self.poolSize:
+                self._pool.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
 
     def createDb(self, database, options=['-vvv']):
         if not isinstance(database, basestring):
             raise TypeError('database name is not a string')
+        if not self.useClient:
+            # the database does not exist yet, so do not use a pooled connection
+            with closing(self.getConn(useDatabase=False)) as conn:
+                self._execute(conn, 'CREATE DATABASE %s;' % database, sys.stdout)
+            return
         cmd = list(self.mysqlCmd)
         cmd += options
         cmd += ['-e', 'CREATE DATABASE %s;' % database]
@@ -68,8 +194,16 @@ class MysqlExecutor(object):
         sys.stderr.flush()
 
     def execStmt(self, stmt, stdout=sys.stdout, options=['-vvv']):
+        """Execute one or more semicolon separated SQL statements, writing
+        their results to stdout. The mysql client options are only used
+        when running the mysql client (see useClient).
+        """
         if not isinstance(stmt, basestring):
             raise TypeError('SQL statement is not a string')
+        if not self.useClient:
+            with self.connection() as conn:
+                self._execute(conn, stmt, stdout)
+            return
         cmd = list(self.mysqlCmd)
         if self.database is not None:
             cmd += ['-D', self.database]
@@ -79,12 +213,31 @@ class MysqlExecutor(object):
         stdout.flush()
         sys.stderr.flush()
 
-    def execScript(self, script, options=['-vvv']):
+    def execScript(self, script, options=['-vvv'], progress=None):
+        """Execute the SQL script in the given file. The statements of the
+        script (see splitStatements) are executed one at a time over a
+        single connection, and only their results are written to stdout. If
+        progress is not None, it is called after each statement with the
+        statement number (starting at 1), the statement text, and the time
+        taken to execute it in seconds. The mysql client options are only
+        used when running the mysql client (see useClient), in which case
+        progress is not reported.
+        """
         if not isinstance(script, basestring):
             raise TypeError('Script file name is not a string')
         if not os.path.isfile(script):
             raise RuntimeError(
                 'Script %s does not exist or is not a file' % script)
+        if not self.useClient:
+            with open(script, 'rb') as f:
+                text = f.read()
+            with self.connection() as conn:
+                for i, stmt in enumerate(splitStatements(text)):
+                    t = time.time()
+                    self._execute(conn, stmt, sys.stdout, echo=False)
+                    if progress is not None:
+                        progress(i + 1, stmt, time.time() - t)
+            return
         with open(script, 'rb') as f:
             cmd = list(self.mysqlCmd)
             if self.database is not None:
@@ -95,18 +248,54 @@ class MysqlExecutor(object):
             sys.stdout.flush()
             sys.stderr.flush()
 
+    def _execute(self, conn, stmts, stdout, echo=True):
+        """Execute semicolon separated SQL statements over conn, writing
+        their results (and the statements, if echo is True) to stdout in
+        the style of the mysql client's verbose batch mode.
+        """
+        if echo:
+            print('--------------\n{}\n--------------\n'.format(stmts.strip()), file=stdout)
+        with closing(conn.cursor()) as cursor:
+            cursor.execute(stmts)
+            while True:
+                if cursor.description is not None:
+                    rows = cursor.fetchall()
+                    if rows:
+                        print('\t'.join(d[0] for d in cursor.description), file=stdout)
+                        for row in rows:
+                            print('\t'.join('NULL' if v is None else str(v) for v in row), file=stdout)
+                    print('{} rows in set\n'.format(len(rows)), file=stdout)
+                elif echo:
+                    print('Query OK, {} rows affected\n'.format(cursor.rowcount), file=stdout)
+                if cursor.nextset() is None:
+                    break
+        conn.commit()
+        stdout.flush()
+
     def runQuery(self, query):
         if not isinstance(query, basestring):
             raise TypeError('Query is not a string')
-        with closing(self.getConn()) as conn:
+        with self.connection() as conn:
             with closing(conn.cursor()) as cursor:
                 print(query)
                 sys.stdout.flush()
                 cursor.execute(query)
                 return cursor.fetchall()
 
+    def iterQuery(self, query):
+        """Generator over the result rows of a query. Rows are streamed
+        from the server rather than buffered in their entirety on the client.
+        """
+        if not isinstance(query, basestring):
+            raise TypeError('Query is not a string')
+        with self.connection() as conn:
+            with closing(conn.cursor(SSCursor)) as cursor:
+                cursor.execute(query)
+                for row in cursor:
+                    yield row
+
     def isView(self, table):
-        with closing(self.getConn()) as conn:
+        with self.connection() as conn:
             with closing(conn.cursor()) as cursor:
                 cursor.execute('SELECT COUNT(*) FROM information_schema.tables '
                                'WHERE table_schema=%s AND table_name=%s AND '
@@ -114,28 +303,72 @@ class MysqlExecutor(object):
                 return cursor.fetchone()[0] == 1
 
     def exists(self, table):
-        with closing(self.getConn()) as conn:
+        with self.connection() as conn:
             with closing(conn.cursor()) as cursor:
                 cursor.execute('SELECT COUNT(*) FROM information_schema.tables '
                                'WHERE table_schema=%s AND table_name=%s',
                                (self.database, table))
                 return cursor.fetchone()[0] == 1
 
-    def getConn(self):
-        kw = dict()
+    def getConn(self, useDatabase=True):
+        """Open a new connection to the server, and to the database unless
+        useDatabase is False. Multiple statements per query and LOAD DATA
+        LOCAL INFILE are enabled.
+        """
+        kw = dict(client_flag=CLIENT.MULTI_STATEMENTS | CLIENT.MULTI_RESULTS,
+                  local_infile=1)
         if self.host is not None:
             kw['host'] = self.host
         if self.port is not None:
             kw['port'] = self.port
         if self.user is not None:
             kw['user'] = self.user
-        if self.database is not None:
+        if self.database is not None and useDatabase:
             kw['db'] = self.database
         if self.password is not None:
             kw['passwd'] = self.password
+        elif os.path.exists(os.path.join(os.environ['HOME'], ".my.cnf")):
+            kw['read_default_file'] = os.path.join(os.environ['HOME'], ".my.cnf")
         return sql.connect(**kw)
 
 
+def availableMemory():
+    """Return the amount of memory available to new processes on this host
+    in bytes, or None if it cannot be determined.
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            info = dict((line.split(':')[0], line.split()[1]) for line in f if ':' in line)
+    except (IOError, IndexError):
+        return None
+    if 'MemAvailable' in info:
+        return long(info['MemAvailable']) * 1024
+    if 'MemFree' in info and 'Cached' in info:
+        # kernels older than 3.14 do not report MemAvailable
+        return (long(info['MemFree']) + long(info['Cached'])) * 1024
+    return None
+
+
+def sortBufferSize(host, threads, sortMemory=None):
+    """Return the myisam_sort_buffer_size for each of threads concurrent
+    index rebuilds. The total sort buffer memory is sortMemory MiB if
+    given, and otherwise half of the available memory when the server runs
+    on this host, or 4 GiB when it does not (or memory cannot be determined).
+    """
+    minSize = 8 << 20
+    if sortMemory is not None:
+        total = sortMemory << 20
+    else:
+        total = None
+        if host in (None, 'localhost', '127.0.0.1', socket.gethostname(), socket.getfqdn()):
+            total = availableMemory()
+            if total is not None:
+                total //= 2
+        if total is None:
+            total = 4 << 30
+    return max(minSize, total // max(1, threads))
+
+
 def addDbOptions(parser):
     if not isinstance(parser, argparse.ArgumentParser):
         raise TypeError('Expecting an argparse.ArgumentParser')
@@ -149,3 +382,10 @@ def addDbOptions(parser):
     parser.add_argument(
         "--port", default=3306, type=int, dest="port",
         help="MySQL database server port (%(default)d).")
+    parser.add_argument(
+        "--mysql-client", default=False, action="store_true", dest="useClient",
+        help="Run SQL statements and scripts with the mysql command line "
+             "client rather than over pooled connections.")
+    parser.add_argument(
+        "--load-threads", default=4, type=int, dest="loadThreads",
+        help="Maximum number of tables loaded concurrently (%(default)d).")
@@ -0,0 +1,169 @@
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+from __future__ import with_statement
+from __future__ import print_function
+from contextlib import closing
+import Queue
+import re
+import sys
+import threading
+import time
+
+__all__ = ['ParallelLoader', 'LoadResult']
+
+_tableRegex = re.compile(r'\bINTO\s+TABLE\s+`?([\w.$]+)`?', re.IGNORECASE)
+_rowRegex = re.compile(r' at row \d+$')
+
+
+class LoadResult(object):
+    """Outcome of a single LOAD DATA statement run by a ParallelLoader.
+
+    Attributes:
+    path
+        The loaded file.
+    table
+        The table loaded into.
+    rows
+        The number of rows loaded, or None if unknown.
+    seconds
+        The time taken by the load.
+    numWarnings
+        The number of warnings raised by the load, or None if unknown.
+    warnings
+        A dict mapping (level, code, message) tuples to occurrence counts,
+        for the warnings reported by SHOW WARNINGS (which returns at most
+        max_error_count of them). Row numbers are removed from messages,
+        so that e.g. truncation of the same column on different rows is
+        counted as one kind of warning.
+    """
+
+    def __init__(self, path, table):
+        self.path = path
+        self.table = table
+        self.rows = None
+        self.seconds = 0.0
+        self.numWarnings = None
+        self.warnings = {}
+
+    def __str__(self):
+        lines = [str.format('Loaded {} rows into {} in {:.3f} sec',
+                            '?' if self.rows is None else self.rows, self.table, self.seconds)]
+        if self.numWarnings:
+            lines[0] += str.format(', {} warnings', self.numWarnings)
+        for (level, code, message), n in sorted(self.warnings.iteritems()):
+            lines.append(str.format('    {} {}: {} ({}x)', level, code, message, n))
+        return '\n'.join(lines)
+
+
+class ParallelLoader(object):
+    """Runs LOAD DATA statements for independent tables concurrently, each
+    over its own pooled connection of a MysqlExecutor.
+
+    Loads are (file path, statement) tuples, as returned by the csvLoads
+    functions of the ingest scripts. The statement may be followed by other
+    statements (typically SHOW WARNINGS); warnings are collected from the
+    results and summarized per table in LoadResult instances rather than
+    printed one by one.
+    """
+
+    def __init__(self, sql, threads=4):
+        """@param[in] sql:      MysqlExecutor used to run LOAD statements
+           @param[in] threads:  maximum number of concurrent loads
+        """
+        self.sql = sql
+        self.threads = max(1, threads)
+
+    def run(self, loads, loaded=None):
+        """Run the given loads, and print a summary of each as it finishes.
+        If loaded is not None, it is called from the calling thread with the
+        LoadResult of each successful load as soon as it finishes.
+
+        @return a list of LoadResult instances, in load order
+        @raise RuntimeError if any load failed, after all loads have finished
+        """
+        tasks = Queue.Queue()
+        for i, (path, stmt) in enumerate(loads):
+            tasks.put((i, path, stmt))
+        done = Queue.Queue()
+        workers = [threading.Thread(target=self._work, args=(tasks, done))
+                   for i in xrange(min(self.threads, len(loads)))]
+        for w in workers:
+            w.daemon = True
+            w.start()
+        results = [None] * len(loads)
+        errors = []
+        for n in xrange(len(loads)):
+            i, result, error = done.get()
+            results[i] = result
+            if error is not None:
+                print(str.format('*** Load from {} failed: {}', result.path, error), file=sys.stderr)
+                errors.append(result.path)
+                continue
+            print(result)
+            sys.stdout.flush()
+            if loaded is not None:
+                loaded(result)
+        for w in workers:
+            w.join()
+        if errors:
+            raise RuntimeError('Failed to load ' + ', '.join(errors))
+        return results
+
+    def _work(self, tasks, done):
+        while True:
+            try:
+                i, path, stmt = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            m = _tableRegex.search(stmt)
+            result = LoadResult(path, m.group(1) if m else '?')
+            t = time.time()
+            try:
+                self._load(stmt, result)
+                error = None
+            except Exception as e:
+                error = e
+            result.seconds = time.time() - t
+            done.put((i, result, error))
+
+    def _load(self, stmt, result):
+        if self.sql.useClient:
+            # the mysql client prints results itself
+            self.sql.execStmt(stmt)
+            return
+        with self.sql.connection() as conn:
+            with closing(conn.cursor()) as cursor:
+                cursor.execute(stmt)
+                result.rows = cursor.rowcount
+                while True:
+                    if cursor.description is not None and len(cursor.description) == 3 and \
+                            cursor.description[0][0] == 'Level':
+                        for level, code, message in cursor.fetchall():
+                            key = (level, code, _rowRegex.sub('', message))
+                            result.warnings[key] = result.warnings.get(key, 0) + 1
+                    elif cursor.description is not None:
+                        cursor.fetchall()
+                    if cursor.nextset() is None:
+                        break
+                cursor.execute('SHOW COUNT(*) WARNINGS')
+                result.numWarnings = cursor.fetchone()[0]
+            conn.commit()
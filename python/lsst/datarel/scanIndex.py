@@ -0,0 +1,209 @@
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import marshal
+import os
+import sqlite3
+import threading
+
+__all__ = ['ScanIndex']
+
+
+# Directories modified less than this many seconds before they were listed
+# are not recorded, since further changes within the same mtime tick would
+# go unnoticed.
+_racyInterval = 2.0
+
+
+class ScanIndex(object):
+    """A persistent record of the results of scanning a repository with an
+    HfsScanner (or DatasetScanner), stored in an SQLite database.
+
+    For every directory listed by a scan, the index stores the directory
+    modification time along with the template matches found in it: the
+    name and dataId of each matching sub-directory, or the name, dataId,
+    size and modification time of each matching file. When the same
+    repository is scanned again with the same template, a directory is
+    only listed again if its modification time has changed; otherwise its
+    matches are read from the index.
+
+    Note that a directory modification time changes when entries are
+    added, removed or renamed, but not when existing files are rewritten
+    in place; the recorded file sizes and times can be checked with
+    files() to detect the latter.
+
+    Records are kept per (root, template) pair, so one index file can serve
+    several repositories and dataset types.
+    """
+
+    def __init__(self, path):
+        """Open (creating if necessary) the index stored in the given
+        SQLite database file.
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.text_factory = str
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS Scan (
+                    scanId INTEGER PRIMARY KEY,
+                    root TEXT NOT NULL,
+                    template TEXT NOT NULL,
+                    UNIQUE (root, template)
+                );
+                CREATE TABLE IF NOT EXISTS Dir (
+                    scanId INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    mtime REAL NOT NULL,
+                    PRIMARY KEY (scanId, path)
+                );
+                CREATE TABLE IF NOT EXISTS Entry (
+                    scanId INTEGER NOT NULL,
+                    dir TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    isFile INTEGER NOT NULL,
+                    dataId BLOB NOT NULL,
+                    size INTEGER,
+                    mtime REAL
+                );
+                CREATE INDEX IF NOT EXISTS Entry_dir ON Entry (scanId, dir);
+                """)
+            self.conn.commit()
+
+    def scan(self, root, template):
+        """Return the _ScanRecord for the given root directory and scanner
+        template key, creating it if necessary.
+        """
+        root = os.path.abspath(root)
+        with self.lock:
+            self.conn.execute("INSERT OR IGNORE INTO Scan (root, template) VALUES (?, ?)",
+                              (root, template))
+            scanId = self.conn.execute("SELECT scanId FROM Scan WHERE root = ? AND template = ?",
+                                       (root, template)).fetchone()[0]
+        return _ScanRecord(self, scanId, root)
+
+    def files(self, root, template):
+        """Generator over (path, dataId, size, mtime) tuples for the files
+        recorded for the given root directory and scanner template key.
+        Paths are relative to root. Each entry only records the dataId
+        entries derived from its own name, so the dataId of a file is
+        assembled from the entries of the directories above it.
+        """
+        root = os.path.abspath(root)
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT e.dir, e.name, e.isFile, e.dataId, e.size, e.mtime
+                   FROM Scan AS s INNER JOIN Entry AS e ON (s.scanId = e.scanId)
+                   WHERE s.root = ? AND s.template = ?
+                   ORDER BY e.dir, e.name""", (root, template)).fetchall()
+        dirIds = dict((os.path.normpath(os.path.join(d, name)), dataId)
+                      for d, name, isFile, dataId, size, mtime in rows if not isFile)
+        for d, name, isFile, dataId, size, mtime in rows:
+            if not isFile:
+                continue
+            merged = {}
+            if d != os.curdir:
+                prefix = ''
+                for component in d.split(os.sep):
+                    prefix = os.path.join(prefix, component)
+                    if prefix in dirIds:
+                        merged.update(marshal.loads(dirIds[prefix]))
+            merged.update(marshal.loads(dataId))
+            yield os.path.normpath(os.path.join(d, name)), merged, size, mtime
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+class _ScanRecord(object):
+    """Index records for a single (root, template) pair. Directory paths
+    passed to get() and put() must be below the root; they are stored
+    relative to it. Methods may be called from multiple threads.
+    """
+
+    def __init__(self, index, scanId, root):
+        self.index = index
+        self.scanId = scanId
+        self.root = root
+
+    def _relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def get(self, path, mtime):
+        """Return the list of (name, dataId, size, mtime) matches recorded
+        for the given directory, or None if the directory is not in the
+        index or has been modified since it was recorded.
+        """
+        rel = self._relpath(path)
+        conn = self.index.conn
+        with self.index.lock:
+            row = conn.execute("SELECT mtime FROM Dir WHERE scanId = ? AND path = ?",
+                               (self.scanId, rel)).fetchone()
+            if row is None or row[0] != mtime:
+                return None
+            rows = conn.execute("SELECT name, dataId, size, mtime FROM Entry "
+                                "WHERE scanId = ? AND dir = ?", (self.scanId, rel)).fetchall()
+        return [(name, marshal.loads(dataId), size, t) for name, dataId, size, t in rows]
+
+    def put(self, path, mtime, listed, isFile, matches):
+        """Record the matches found in a directory with the given
+        modification time, which was listed at time listed. Matches
+        are (name, dataId, size, mtime) tuples; isFile indicates
+        whether they are files or directories. Records for sub-directories
+        that are no longer matched are removed.
+        """
+        if listed - mtime < _racyInterval:
+            return
+        rel = self._relpath(path)
+        conn = self.index.conn
+        with self.index.lock:
+            if not isFile:
+                old = conn.execute("SELECT name FROM Entry WHERE scanId = ? AND dir = ?",
+                                   (self.scanId, rel)).fetchall()
+                names = set(m[0] for m in matches)
+                for name, in old:
+                    if name not in names:
+                        self._removeTree(os.path.normpath(os.path.join(rel, name)))
+            conn.execute("DELETE FROM Entry WHERE scanId = ? AND dir = ?", (self.scanId, rel))
+            conn.executemany(
+                "INSERT INTO Entry (scanId, dir, name, isFile, dataId, size, mtime) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(self.scanId, rel, name, int(isFile), buffer(marshal.dumps(dataId)), size, t)
+                 for name, dataId, size, t in matches])
+            conn.execute("INSERT OR REPLACE INTO Dir (scanId, path, mtime) VALUES (?, ?, ?)",
+                         (self.scanId, rel, mtime))
+
+    def _removeTree(self, rel):
+        """Remove the records for a directory and everything below it."""
+        prefix = rel + os.sep
+        n = len(prefix)
+        for table, column in (('Dir', 'path'), ('Entry', 'dir')):
+            self.index.conn.execute(
+                str.format("DELETE FROM {0} WHERE scanId = ? AND "
+                           "({1} = ? OR substr({1}, 1, ?) = ?)", table, column),
+                (self.scanId, rel, n, prefix))
@@ -0,0 +1,137 @@
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import numpy
+
+__all__ = ['tanPixelToSky', 'exposureSkyCorners']
+
+_wcsKeys = ('CRPIX1', 'CRPIX2', 'CRVAL1', 'CRVAL2', 'CD1_1', 'CD1_2', 'CD2_1', 'CD2_2')
+
+
+def tanPixelToSky(x, y, crpix1, crpix2, crval1, crval2, cd11, cd12, cd21, cd22):
+    """Vectorized pixel to sky transform for a pure gnomonic (TAN) WCS with
+    a CD matrix, no distortion terms and the default LONPOLE of 180 degrees.
+
+    All arguments may be numpy arrays (or scalars) that broadcast against
+    each other. Pixel coordinates x, y are 0-based, as in afw, whereas
+    CRPIX1, CRPIX2 are the 1-based FITS header values. CRVAL and CD values
+    are in degrees. Returns a pair of arrays containing the right ascension
+    (in [0, 360)) and declination of the input pixels, in degrees.
+    """
+    dx = numpy.asarray(x, dtype=numpy.float64) - (numpy.asarray(crpix1) - 1.0)
+    dy = numpy.asarray(y, dtype=numpy.float64) - (numpy.asarray(crpix2) - 1.0)
+    # intermediate world coordinates, in radians
+    xi = numpy.radians(cd11 * dx + cd12 * dy)
+    eta = numpy.radians(cd21 * dx + cd22 * dy)
+    ra0 = numpy.radians(crval1)
+    dec0 = numpy.radians(crval2)
+    sinDec0 = numpy.sin(dec0)
+    cosDec0 = numpy.cos(dec0)
+    # inverse gnomonic projection
+    denom = cosDec0 - eta * sinDec0
+    ra = ra0 + numpy.arctan2(xi, denom)
+    dec = numpy.arctan2(sinDec0 + eta * cosDec0, numpy.hypot(xi, denom))
+    return numpy.degrees(ra) % 360.0, numpy.degrees(dec)
+
+
+def _isSimpleTan(md):
+    """Return True if the FITS header md describes a WCS that
+    tanPixelToSky() handles exactly, with sky coordinates that are ICRS
+    (or equivalently for afw, FK5 J2000). The reference system is read
+    from RADESYS, or if that is missing, from its deprecated name
+    RADECSYS, which CFHT headers use.
+    """
+    if not all(md.exists(k) for k in _wcsKeys + ('CTYPE1', 'CTYPE2')):
+        return False
+    if md.get('CTYPE1').strip() != 'RA---TAN' or md.get('CTYPE2').strip() != 'DEC--TAN':
+        return False
+    if md.exists('LONPOLE') and md.get('LONPOLE') != 180.0:
+        return False
+    if md.exists('RADESYS'):
+        radesys = md.get('RADESYS').strip()
+    elif md.exists('RADECSYS'):
+        radesys = md.get('RADECSYS').strip()
+    else:
+        return False
+    if radesys == 'FK5':
+        return md.exists('EQUINOX') and md.get('EQUINOX') == 2000.0
+    return radesys == 'ICRS'
+
+
+def _afwSkyCorners(md, x, y):
+    """Scalar fallback: compute ICRS coordinates for the given pixels with
+    an afw Wcs built from md.
+    """
+    import lsst.afw.image as afwImage
+    wcs = afwImage.makeWcs(md.deepCopy())
+    result = numpy.empty((len(x), 2))
+    for i in xrange(len(x)):
+        c = wcs.pixelToSky(x[i], y[i]).toIcrs()
+        result[i] = (c.getRa().asDegrees(), c.getDec().asDegrees())
+    return result
+
+
+def exposureSkyCorners(mds, origins=None):
+    """Compute ICRS sky coordinates of the center and corners of a batch of
+    exposures, given their FITS headers.
+
+    @param[in] mds: sequence of n PropertySets holding FITS headers with
+                    NAXIS1, NAXIS2 and WCS keywords
+    @param[in] origins: optional sequence of n (x0, y0) exposure origins, in
+                        the pixel coordinate system of the WCS; (0, 0) by
+                        default
+
+    @return a numpy array of shape (n, 5, 2), where element [i, j] holds the
+            right ascension and declination (in degrees) of the center
+            (j = 0) and of the corners (j = 1, 2, 3, 4) of exposure i. With
+            w and h denoting exposure dimensions, the corners are the pixel
+            edges at (x0 - 0.5, y0 - 0.5), (x0 - 0.5, y0 + h - 0.5),
+            (x0 + w - 0.5, y0 + h - 0.5) and (x0 + w - 0.5, y0 - 0.5).
+
+    Exposures with a pure TAN WCS are handled with numpy in a single pass,
+    whatever their origin; all others go through afw one point at a time.
+    """
+    n = len(mds)
+    if origins is None:
+        origins = [(0, 0)] * n
+    origins = numpy.asarray(origins, dtype=numpy.float64).reshape(n, 2)
+    w = numpy.array([md.get('NAXIS1') for md in mds], dtype=numpy.float64)
+    h = numpy.array([md.get('NAXIS2') for md in mds], dtype=numpy.float64)
+    x0 = origins[:, 0:1]
+    y0 = origins[:, 1:2]
+    # pixel positions of center and corners, shape (n, 5)
+    u = numpy.column_stack([0.5*w, numpy.zeros(n), numpy.zeros(n), w, w]) - 0.5 + x0
+    v = numpy.column_stack([0.5*h, numpy.zeros(n), h, h, numpy.zeros(n)]) - 0.5 + y0
+    result = numpy.empty((n, 5, 2))
+    # the origin only offsets the pixel positions, which are in the pixel
+    # coordinate system of the WCS, so it needs no special handling
+    fast = numpy.array([_isSimpleTan(md) for md in mds], dtype=bool)
+    if fast.any():
+        # WCS parameters of the fast exposures, as columns of shape (m, 1)
+        params = numpy.array([[mds[i].get(k) for k in _wcsKeys] for i in numpy.flatnonzero(fast)],
+                             dtype=numpy.float64)
+        cols = [params[:, j:j+1] for j in xrange(len(_wcsKeys))]
+        ra, dec = tanPixelToSky(u[fast], v[fast], *cols)
+        result[fast, :, 0] = ra
+        result[fast, :, 1] = dec
+    for i in numpy.flatnonzero(~fast):
+        result[i] = _afwSkyCorners(mds[i], u[i], v[i])
+    return result
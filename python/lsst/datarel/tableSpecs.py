@@ -0,0 +1,253 @@
+#
+# LSST Data Management System
+# Copyright 2012 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Declarative descriptions of the tables loaded by the ingest scripts.
+
+Each TableSpec lists the columns of the files written for a table, in file
+order, along with their types and any SET expressions evaluated by MySQL
+at load time. Both the table writers (and hence the per-column CSV
+formatters) and the LOAD DATA statements of the ingest scripts are
+generated from these specs, so they cannot get out of step.
+"""
+from __future__ import with_statement
+import os
+import textwrap
+
+import lsst.daf.base as dafBase
+
+from .csvFileWriter import openTableWriter
+
+__all__ = ['TableSpec', 'rawAmpExposure', 'rawAmpExposureMetadata',
+           'rawAmpToScienceCcdExposure', 'rawAmpExposureToHtm11',
+           'scienceCcdExposure', 'scienceCcdExposureMetadata', 'scienceCcdExposureToHtm10']
+
+
+class TableSpec(object):
+    """Describes the file columns of a table loaded with LOAD DATA INFILE.
+
+    Columns are (name, type) pairs, where types are those understood by
+    CsvFileWriter and ColumnFileWriter (int, long, float, str or
+    lsst.daf.base.DateTime), or None for columns whose values may be of
+    varying type, e.g. because they are copied from FITS headers.
+    setExprs is a list of (column name, SQL expression) pairs for columns
+    computed by MySQL from the file columns. If csv is False, files are
+    tab separated without quoting (as written by HtmIndexWriter), rather
+    than CSV. ignoreLines is the number of header lines in each file, and
+    replace indicates whether loaded rows replace existing rows with the
+    same unique key.
+    """
+
+    def __init__(self, table, columns, setExprs=(), csv=True, ignoreLines=0, replace=False):
+        self.table = table
+        self.columns = list(columns)
+        self.setExprs = list(setExprs)
+        self.csv = csv
+        self.ignoreLines = ignoreLines
+        self.replace = replace
+
+    @property
+    def names(self):
+        return [name for name, typ in self.columns]
+
+    @property
+    def types(self):
+        return [typ for name, typ in self.columns]
+
+    def openWriter(self, path, **kwargs):
+        """Return a table writer (see openTableWriter) for the file at path.
+        """
+        return openTableWriter(path, self.names, columns=self.types, **kwargs)
+
+    def loadStatement(self, path):
+        """Return the LOAD DATA LOCAL INFILE statement for the file at path,
+        followed by SHOW WARNINGS.
+        """
+        lines = [str.format("LOAD DATA LOCAL INFILE '{}' {}INTO TABLE {}",
+                            path, 'REPLACE ' if self.replace else '', self.table)]
+        if self.csv:
+            lines.append("FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"'")
+        if self.ignoreLines > 0:
+            lines.append(str.format('IGNORE {} LINES', self.ignoreLines))
+        lines.append('(')
+        lines.extend(textwrap.wrap(', '.join(self.names), 80,
+                                   initial_indent='    ', subsequent_indent='    ',
+                                   break_on_hyphens=False))
+        if self.setExprs:
+            lines.append(') SET ' + (',\n      '.join(
+                str.format('{} = {}', name, expr) for name, expr in self.setExprs)) + ';')
+        else:
+            lines.append(');')
+        lines.append('SHOW WARNINGS;\n')
+        return '\n'.join(lines)
+
+    def readIds(self, path):
+        """Return the sorted distinct values of the first (ID) column of
+        the uncompressed file at path.
+        """
+        separator = ',' if self.csv else '\t'
+        ids = set()
+        with open(path, 'rb') as f:
+            for i, line in enumerate(f):
+                if i >= self.ignoreLines and line.strip():
+                    ids.add(long(line.split(separator, 1)[0].strip('"')))
+        return sorted(ids)
+
+    def deleteStatements(self, ids, batchSize=1000):
+        """Return DELETE statements removing the rows with the given values
+        of the first (ID) column, at most batchSize values per statement.
+        """
+        ids = list(ids)
+        return [str.format('DELETE FROM {} WHERE {} IN ({});', self.table, self.names[0],
+                           ', '.join(str(v) for v in ids[j:j + batchSize]))
+                for j in xrange(0, len(ids), batchSize)]
+
+    def load(self, path):
+        """Return an (absolute file path, LOAD statement) tuple for the file
+        at path.
+        """
+        path = os.path.abspath(path)
+        return path, self.loadStatement(path)
+
+
+def _polyExpr(*corners):
+    """Return the SQL expression for the binary polygon with the given
+    corner (ra column, dec column) pairs.
+    """
+    return 'scisql_s2CPolyToBin(' + ', '.join(ra + ', ' + dec for ra, dec in corners) + ')'
+
+
+def _cornerColumns(corners):
+    columns = []
+    for ra, dec in corners:
+        columns += [(ra, float), (dec, float)]
+    return columns
+
+
+_corners = [('corner1Ra', 'corner1Decl'), ('corner2Ra', 'corner2Decl'),
+            ('corner3Ra', 'corner3Decl'), ('corner4Ra', 'corner4Decl')]
+
+_cfhtCorners = [('llcRa', 'llcDecl'), ('ulcRa', 'ulcDecl'),
+                ('urcRa', 'urcDecl'), ('lrcRa', 'lrcDecl')]
+
+# Position and WCS columns common to the exposure tables. WCS values are
+# copied from FITS headers.
+_wcsColumns = [
+    ('ra', float), ('decl', float),
+    ('equinox', None), ('raDeSys', None),
+    ('ctype1', None), ('ctype2', None),
+    ('crpix1', None), ('crpix2', None),
+    ('crval1', None), ('crval2', None),
+    ('cd1_1', None), ('cd1_2', None), ('cd2_1', None), ('cd2_2', None),
+]
+
+
+def rawAmpExposure(camera):
+    """Return the spec of Raw_Amp_Exposure for the 'lsstsim' or 'cfht'
+    camera, as written by ingestRaw_ImSim.py and ingestRaw_CFHT.py.
+    """
+    if camera == 'lsstsim':
+        ids = [('rawAmpExposureId', long), ('visit', None), ('snap', int),
+               ('raft', int), ('raftName', str), ('ccd', int), ('ccdName', str),
+               ('amp', int), ('ampName', str), ('filterId', int), ('filterName', str)]
+        corners = _corners
+        times = [('taiMjd', float), ('obsStart', dafBase.DateTime), ('expMidpt', float)]
+        setExprs = [('htmId20', 'scisql_s2HtmId(ra, decl, 20)')]
+    elif camera == 'cfht':
+        ids = [('rawAmpExposureId', long), ('visit', None), ('snap', int), ('raft', int),
+               ('ccd', None), ('amp', int), ('filterId', int)]
+        corners = _cfhtCorners
+        # expMidpt is written as a UTC time string
+        times = [('taiMjd', float), ('obsStart', dafBase.DateTime), ('expMidpt', str)]
+        setExprs = []
+    else:
+        raise RuntimeError('No Raw_Amp_Exposure spec for camera {}'.format(camera))
+    columns = (ids + _wcsColumns + _cornerColumns(corners) + times +
+               [('expTime', None), ('airmass', None), ('darkTime', None), ('zd', None)])
+    return TableSpec('Raw_Amp_Exposure', columns,
+                     setExprs + [('poly', _polyExpr(*corners))], replace=True)
+
+
+rawAmpExposureMetadata = TableSpec('Raw_Amp_Exposure_Metadata', [
+    ('rawAmpExposureId', long),
+    ('metadataKey', str),
+    ('exposureType', int),
+    ('intValue', int),
+    ('doubleValue', float),
+    ('stringValue', str),
+], replace=True)
+
+rawAmpToScienceCcdExposure = TableSpec('Raw_Amp_To_Science_Ccd_Exposure', [
+    ('rawAmpExposureId', long),
+    ('scienceCcdExposureId', long),
+    ('snap', int),
+    ('amp', int),
+], replace=True)
+
+rawAmpExposureToHtm11 = TableSpec('Raw_Amp_Exposure_To_Htm11', [
+    ('rawAmpExposureId', long),
+    ('htmId11', long),
+], csv=False, replace=True)
+
+
+def scienceCcdExposure(camera):
+    """Return the spec of Science_Ccd_Exposure for the 'lsstsim', 'cfht' or
+    'sdss' camera, as written by ingestProcessed.py.
+    """
+    # ID columns are camera specific
+    if camera == 'lsstsim':
+        ids = [('visit', None), ('raft', None), ('raftName', None),
+               ('ccd', None), ('ccdName', None), ('filterId', int), ('filterName', str)]
+    elif camera == 'cfht':
+        ids = [('visit', None), ('ccd', None), ('ccdName', None),
+               ('filterId', int), ('filterName', str)]
+    elif camera == 'sdss':
+        ids = [('run', None), ('camcol', None), ('filterId', int), ('field', None),
+               ('filterName', None)]
+    else:
+        raise RuntimeError('No Science_Ccd_Exposure spec for camera {}'.format(camera))
+    columns = [('scienceCcdExposureId', long)] + ids + _wcsColumns + _cornerColumns(_corners) + [
+        ('taiMjd', float), ('obsStart', dafBase.DateTime), ('expMidpt', None), ('expTime', None),
+        ('nCombine', int), ('binX', int), ('binY', int),
+    ]
+    # SDSS calexps do not go through CCD assembly/ISR
+    if camera in ('lsstsim', 'cfht'):
+        columns += [('readNoise', None), ('saturationLimit', None), ('gainEff', None)]
+    columns += [('fluxMag0', None), ('fluxMag0Sigma', None), ('fwhm', float), ('path', str)]
+    return TableSpec('Science_Ccd_Exposure', columns, [
+        ('htmId20', 'scisql_s2HtmId(ra, decl, 20)'),
+        ('poly', _polyExpr(*_corners)),
+    ])
+
+
+# Science_Ccd_Exposure_Metadata holds key,value pairs from FITS headers
+scienceCcdExposureMetadata = TableSpec('Science_Ccd_Exposure_Metadata', [
+    ('scienceCcdExposureId', long),
+    ('metadataKey', str),
+    ('exposureType', int),
+    ('intValue', int),
+    ('doubleValue', float),
+    ('stringValue', str),
+], ignoreLines=1)
+
+scienceCcdExposureToHtm10 = TableSpec('Science_Ccd_Exposure_To_Htm10', [
+    ('scienceCcdExposureId', long),
+    ('htmId10', long),
+], csv=False)
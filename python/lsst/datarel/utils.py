@@ -21,9 +21,17 @@ from __future__ import print_function
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
 
+import array
+import bisect
+import collections
+import os
 import sys
 
+import lsst.daf.base as dafBase
+import lsst.afw.detection as afwDetection
+import lsst.afw.fits as afwFits
 import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
 
 
 def getDataset(butler, dataset, dataId, strict, warn):
@@ -50,7 +58,129 @@ def getDataset(butler, dataset, dataId, strict, warn):
     return ds
 
 
-def getPsf(butler, dataset, dataId, strict, warn):
+class ExposureReader(object):
+    """Reads the header and PSF of an exposure FITS file, opening and
+    positioning within the file only once. Use as a context manager:
+
+        with ExposureReader(filename) as reader:
+            md = reader.readMetadata()
+            psf = getPsf(butler, 'calexp', dataId, strict, warn, reader=reader)
+    """
+
+    def __init__(self, filename):
+        """@param[in] filename: path of the exposure FITS file"""
+        self.filename = filename
+        self.fits = afwFits.Fits(filename, "r", afwFits.Fits.AUTO_CLOSE | afwFits.Fits.AUTO_CHECK)
+        self._metadata = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.fits is not None:
+            self.fits.closeFile()
+            self.fits = None
+
+    def readMetadata(self):
+        """Return the exposure header, as afwImage.readMetadata(filename)
+        would. The header is read on first use.
+        """
+        if self._metadata is None:
+            # HDU 0 selects the first non-empty HDU
+            self.fits.setHdu(0)
+            md = dafBase.PropertyList()
+            self.fits.readMetadata(md, False)
+            self._metadata = md
+        return self._metadata
+
+    def readSubExposure(self, bbox):
+        """Read the given subregion (in LOCAL coordinates) of the exposure."""
+        self.fits.setHdu(0)
+        return afwImage.ExposureF(self.fits, bbox, afwImage.LOCAL)
+
+    def readPsf(self):
+        """Read just the PSF of the exposure, skipping the image, mask and
+        variance HDUs entirely. The primary header records the HDU of the
+        archive holding ancillary objects (AR_HDU) and the archive ID of the
+        PSF (PSF_ID). Returns None if the file does not have an archive, or
+        if the PSF is not the first archive object; use readSubExposure()
+        to get the PSF in that case.
+        """
+        self.fits.setHdu(1)
+        primary = dafBase.PropertyList()
+        self.fits.readMetadata(primary, False)
+        if not primary.exists('AR_HDU') or not primary.exists('PSF_ID'):
+            return None
+        if primary.get('PSF_ID') != 1:
+            # Psf.readFits() returns the first object in an archive
+            return None
+        self.fits.setHdu(primary.get('AR_HDU'))
+        return afwDetection.Psf.readFits(self.fits)
+
+
+class LruCache(object):
+    """A dict-like cache holding at most maxSize entries, which evicts the
+    least recently used entry when full.
+    """
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            return default
+        self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        self.entries.pop(key, None)
+        if len(self.entries) >= self.maxSize:
+            self.entries.popitem(last=False)
+        self.entries[key] = value
+
+
+# PSFs returned by getPsf(), keyed by (dataset, dataId items, file mtime)
+_psfCache = LruCache(256)
+
+
+def _getFilename(butler, dataset, dataId):
+    """Return the path of a dataset file, or None if it cannot be determined."""
+    try:
+        filename = butler.get(dataset + "_filename", dataId=dataId)[0]
+    except:
+        return None
+    return filename if os.path.exists(filename) else None
+
+
+def _readPsf(butler, dataset, dataId, reader, filename, psfOnly):
+    if psfOnly and filename is not None:
+        if reader is not None:
+            psf = reader.readPsf()
+        else:
+            with ExposureReader(filename) as r:
+                psf = r.readPsf()
+        if psf is not None:
+            return psf
+    # fall back to reading a 1x1 subregion of the exposure
+    tinyBBox = afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(1, 1))
+    if reader is not None:
+        tinyExposure = reader.readSubExposure(tinyBBox)
+    else:
+        tinyExposure = butler.get(dataset + "_sub", dataId=dataId, bbox=tinyBBox,
+                                  imageOrigin="LOCAL", immediate=True)
+    return tinyExposure.getPsf()
+
+
+def getPsf(butler, dataset, dataId, strict, warn, reader=None, psfOnly=True):
     """Get the PSF from a repository without reading (very much of) the exposure
 
     @param[in] butler: data butler
@@ -58,15 +188,32 @@ def getPsf(butler, dataset, dataId, strict, warn):
     @param[in] dataId: data ID dict of exposure containing desired PSF
     @param[in] strict: if True then raise RuntimeError if psf not found
     @param[in] warn: if True and strict False then print a warning to stderr if psf not found
+    @param[in] reader: optional ExposureReader for the exposure file; if given,
+                       the PSF is read through it rather than the butler, so
+                       the file is not opened again
+    @param[in] psfOnly: if True, read only the PSF archive HDU when the file
+                        has one (see ExposureReader.readPsf), rather than a
+                        1x1 subregion of the exposure
+
+    PSFs are cached, keyed by dataset, data ID and file modification time, so
+    repeated calls for the same exposure do not read it again. The returned
+    PSF may therefore be shared, and must not be modified.
 
     @raise RuntimeError if exposure not found (regardless of strict)
     @raise RuntimeError if exposure has no PSF and strict true
     """
-    # there is not yet a way to read just the PSF, so read a 1x1 subregion of the exposure
-    tinyBBox = afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(1, 1))
-    tinyExposure = butler.get(dataset + "_sub", dataId=dataId, bbox=tinyBBox,
-                              imageOrigin="LOCAL", immediate=True)
-    psf = tinyExposure.getPsf()
+    if reader is not None:
+        filename = reader.filename
+    else:
+        filename = _getFilename(butler, dataset, dataId)
+    key = None
+    if filename is not None:
+        key = (dataset, tuple(sorted(dataId.items())), os.stat(filename).st_mtime)
+    psf = _psfCache.get(key) if key is not None else None
+    if psf is None:
+        psf = _readPsf(butler, dataset, dataId, reader, filename, psfOnly)
+        if psf is not None and key is not None:
+            _psfCache.put(key, psf)
     if psf is None:
         msg = '%s : %s exposure had no PSF' % (dataId, dataset)
         psf = None
@@ -75,3 +222,25 @@ def getPsf(butler, dataset, dataId, strict, warn):
         elif warn:
             print('*** Skipping ' + msg, file=sys.stderr)
     return psf
+
+
+class SortedIdSet(object):
+    """An immutable set of integer IDs, stored as a sorted array of
+    machine integers. This uses 8 bytes per ID on 64 bit platforms,
+    versus roughly 10x that for a python set of longs.
+    """
+
+    def __init__(self, ids=()):
+        """Build the set from an iterable over integer IDs. No copy is
+        made if the IDs are already in ascending order.
+        """
+        self.ids = array.array('l', ids)
+        if any(self.ids[i] > self.ids[i + 1] for i in xrange(len(self.ids) - 1)):
+            self.ids = array.array('l', sorted(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        i = bisect.bisect_left(self.ids, id)
+        return i != len(self.ids) and self.ids[i] == id
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests
+
+from lsst.datarel.blockGzip import BlockGzipFile
+from lsst.datarel.csvFileWriter import CsvFileWriter
+
+
+def readGzip(path):
+    f = gzip.open(path, "rb")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+class BlockGzipFileTest(unittest.TestCase):
+    """
+    Tests for multithreaded, multi-member gzip output.
+    """
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        rng = random.Random(1)
+        # compressible text, written in pieces that straddle block boundaries
+        self.pieces = ["%d,%r,\"%s\"\n" % (i, rng.random(), "x" * rng.randint(0, 50))
+                       for i in xrange(20000)]
+        self.data = "".join(self.pieces)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testRoundTrip(self):
+        """Test that multi-member output decompresses to the written data,
+        and that the decompressed data matches single member gzip output."""
+        gzPath = os.path.join(self.tmpDir, "single.gz")
+        f = gzip.open(gzPath, "wb", 6)
+        f.write(self.data)
+        f.close()
+        for threads in (1, 4):
+            path = os.path.join(self.tmpDir, "block%d.gz" % threads)
+            f = BlockGzipFile(path, "wb", 6, threads, blockSize=4096)
+            for piece in self.pieces:
+                f.write(piece)
+            f.close()
+            self.assertTrue(f.members > 1)
+            self.assertEqual(readGzip(path), self.data)
+            self.assertEqual(readGzip(path), readGzip(gzPath))
+
+    def testAppendAndEmpty(self):
+        """Test that appending adds members, and that empty files are valid."""
+        path = os.path.join(self.tmpDir, "t.gz")
+        f = BlockGzipFile(path, "wb", 9, 2)
+        f.close()
+        self.assertEqual(readGzip(path), "")
+        for mode in ("wb", "ab"):
+            f = BlockGzipFile(path, mode, 9, 2, blockSize=1000)
+            f.write(self.data[:5000])
+            f.flush()
+            f.write(self.data[5000:10000])
+            f.close()
+        self.assertEqual(readGzip(path), self.data[:10000] * 2)
+        self.assertRaises(ValueError, BlockGzipFile, path, "r")
+
+    def testCsvFileWriter(self):
+        """Test that CSV output is identical with and without compression threads."""
+        rows = [(i, "name%d" % i, i * 0.25) for i in xrange(5000)]
+        results = []
+        for threads in (1, 3):
+            path = os.path.join(self.tmpDir, "t%d.csv" % threads)
+            writer = CsvFileWriter(path, compress=True, columns=[long, str, float],
+                                   compressLevel=1, compressThreads=threads)
+            for row in rows:
+                writer.write(*row)
+            writer.close()
+            results.append(readGzip(path + ".gz"))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(results[0].splitlines()), len(rows))
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import lsst.utils.tests
+import lsst.daf.base as dafBase
+
+from lsst.datarel.columnFileWriter import ColumnFileWriter, columnDirectory, readColumns, \
+    mergeColumnDirectories
+
+dateTime = dafBase.DateTime("2010-01-02T03:04:05.000000000Z")
+
+
+class ColumnFileWriterTest(unittest.TestCase):
+    """
+    Tests for writing and reading NumPy column files.
+    """
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def write(self, name, names, columns, rows, bufferRows=2):
+        path = os.path.join(self.tmpDir, name)
+        writer = ColumnFileWriter(path, names, columns=columns, bufferRows=bufferRows)
+        for row in rows:
+            writer.write(*row)
+        writer.close()
+        self.assertEqual(writer.numRows, len(rows))
+        return path
+
+    def assertColumnEqual(self, column, values):
+        self.assertEqual(len(column), len(values))
+        mask = numpy.ma.getmaskarray(column)
+        self.assertEqual(mask.tolist(), [v is None for v in values])
+        self.assertEqual([x for x, v in zip(numpy.ma.getdata(column).tolist(), values)
+                          if v is not None], [v for v in values if v is not None])
+
+    def testRoundTrip(self):
+        """Test that typed columns, including NULLs, read back as written."""
+        names = ["id", "name", "value", "time"]
+        rows = [(1L, "a", 0.5, dateTime), (2L, None, None, None), (3L, " c ", 1.5e300, dateTime)]
+        path = self.write("t.csv", names, [long, str, float, dafBase.DateTime], rows)
+        self.assertTrue(os.path.isdir(columnDirectory(path)))
+        columns = readColumns(path)
+        self.assertEqual(sorted(columns), sorted(names))
+        self.assertEqual(columns["id"].dtype, numpy.int64)
+        self.assertFalse(isinstance(columns["id"], numpy.ma.MaskedArray))
+        self.assertColumnEqual(columns["id"], [1, 2, 3])
+        self.assertColumnEqual(columns["name"], ["a", None, "c"])
+        self.assertColumnEqual(columns["value"], [0.5, None, 1.5e300])
+        self.assertEqual(columns["time"].dtype, numpy.dtype("datetime64[ns]"))
+        nsecs = dateTime.nsecs(dafBase.DateTime.UTC)
+        self.assertEqual(numpy.ma.getdata(columns["time"]).astype(numpy.int64).tolist()[0::2],
+                         [nsecs, nsecs])
+        self.assertEqual(readColumns(path, ["value"]).keys(), ["value"])
+
+    def testMixedTypes(self):
+        """Test that untyped columns are promoted within and across blocks,
+        and that incompatible values are rejected."""
+        rows = [(1024, None), (None, None), (1024.5, "x"), (7, "yy"), (2**40, "zzz")]
+        path = self.write("t.csv", ["value", "name"], None, rows)
+        columns = readColumns(path)
+        self.assertEqual(columns["value"].dtype, numpy.float64)
+        self.assertColumnEqual(columns["value"], [1024.0, None, 1024.5, 7.0, float(2**40)])
+        self.assertColumnEqual(columns["name"], [None, None, "x", "yy", "zzz"])
+        # integers only, in a block of their own
+        path = self.write("u.csv", ["value"], None, [(1,), (2**40,), (None,)], bufferRows=1)
+        self.assertEqual(readColumns(path)["value"].dtype, numpy.int64)
+        self.assertColumnEqual(readColumns(path)["value"], [1, 2**40, None])
+        writer = ColumnFileWriter(os.path.join(self.tmpDir, "v.csv"), ["value"], bufferRows=2)
+        writer.write(1)
+        self.assertRaises(TypeError, writer.write, "one")
+        # discard the rejected block, so that closing the writer succeeds
+        del writer.rows[:]
+        writer.close()
+        path = self.write("w.csv", ["value"], None, [(1,), ("one",)], bufferRows=1)
+        self.assertRaises(TypeError, readColumns, path)
+
+    def testMerge(self):
+        """Test that merged column directories hold the blocks of their
+        sources in order, and that the sources are removed."""
+        sources = []
+        expected = []
+        for i in xrange(3):
+            rows = [(long(i * 10 + j), None if j == 1 else j * 0.5) for j in xrange(3)]
+            sources.append(self.write("t_{}.csv".format(i), ["id", "value"], [long, float], rows))
+            expected += rows
+        sources.insert(1, os.path.join(self.tmpDir, "missing.csv"))
+        dest = os.path.join(self.tmpDir, "t.csv")
+        self.write("t.csv", ["id", "value"], [long, float], [(99L, 9.0)])
+        mergeColumnDirectories(dest, sources)
+        columns = readColumns(dest)
+        self.assertColumnEqual(columns["id"], [r[0] for r in expected])
+        self.assertColumnEqual(columns["value"], [r[1] for r in expected])
+        for src in sources:
+            self.assertFalse(os.path.exists(columnDirectory(src)))
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
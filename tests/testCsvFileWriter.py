@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests
+import lsst.daf.base as dafBase
+
+from lsst.datarel.csvFileWriter import CsvFileWriter, _columnFormatters, _quote
+
+dateTime = dafBase.DateTime("2010-01-02T03:04:05.000000000Z")
+
+# Values of each column type, including NULLs and strings that need escaping
+typedValues = {
+    int: [0, -5, 2**31 - 1, None],
+    long: [0L, -(2L**62), 2L**62, None],
+    float: [0.0, -1.5, 0.1, 1.0e-300, 6.02214e23, None],
+    str: ["abc", "", "  padded  ", 'a"b', '"quoted"', "a,b", None],
+    dafBase.DateTime: [dateTime, None],
+}
+
+
+class CsvFileWriterTest(unittest.TestCase):
+    """
+    Tests for CSV formatting of typed and untyped columns.
+    """
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testFormatters(self):
+        """Test that typed formatters produce the same output as _quote."""
+        for typ, values in typedValues.iteritems():
+            for v in values:
+                self.assertEqual(_columnFormatters[typ](v), _quote(v))
+        self.assertEqual(_quote(None), r"\N")
+        self.assertEqual(_quote('a"b'), r'"a\"b"')
+        self.assertEqual(_quote("  padded  "), '"padded"')
+        self.assertEqual(_quote(dateTime), '"2010-01-02 03:04:05"')
+
+    def testRowFormat(self):
+        """Test that compiled row formatters match per-value quoting, for
+        typed columns and for untyped columns mixed with typed ones."""
+        columns = [int, long, float, str, dafBase.DateTime, None, None]
+        rows = [
+            (1, 2L, 3.5, "x", dateTime, 4.25, "y"),
+            (None, None, None, None, None, None, None),
+            (-1, 2L**40, 0.1, 'say "hi"', dateTime, 7, dateTime),
+        ]
+        typed = CsvFileWriter._compileRowFormat(columns)
+        untyped = CsvFileWriter._compileRowFormat(None)
+        for row in rows:
+            expected = ",".join(_quote(v) for v in row)
+            self.assertEqual(typed(*row), expected)
+            self.assertEqual(untyped(*row), expected)
+        self.assertRaises(ValueError, CsvFileWriter._compileRowFormat, [])
+        self.assertRaises(TypeError, CsvFileWriter._compileRowFormat, [int, complex])
+
+    def testWriter(self):
+        """Test buffered output of a header and typed rows."""
+        path = os.path.join(self.tmpDir, "t.csv")
+        writer = CsvFileWriter(path, compress=False, columns=[long, str, float], bufferRows=2)
+        writer.writeHeader("id", "name", "value")
+        rows = [(i, "n%d" % i, i * 0.5) for i in xrange(5)] + [(5L, None, None)]
+        for row in rows:
+            writer.write(*row)
+        writer.close()
+        self.assertEqual(writer.numRows, len(rows))
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines, ['"id","name","value"'] +
+                         [",".join(_quote(v) for v in row) for row in rows])
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
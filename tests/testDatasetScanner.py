@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import bisect
+import os
+import random
+import re
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests
+
+from lsst.datarel.datasetScanner import HfsScanner, IntervalSet, parseDataIdRules, \
+    _RuleMatcher, _segmentTable, _materialize, _mungeFunctions, _unmungeFunctions
+
+
+def parseRuleSets(ruleList, camera):
+    """Parse dataId rules into sets of values, as parseDataIdRules did
+    before integer values were stored as interval sets.
+    """
+    kvs = {}
+    for rule in ruleList:
+        key, _, pattern = rule.partition("=")
+        if len(pattern) == 0:
+            continue
+        values = kvs.setdefault(key, set())
+        isInt = isinstance(parseDataIdRules([rule], camera)[key], set) is False
+        for p in pattern.split("^"):
+            m = re.search(r"^(\d+)\.\.(\d+)$", p)
+            if isInt and m:
+                values.update(xrange(int(m.group(1)), int(m.group(2)) + 1))
+            elif isInt:
+                values.add(int(p))
+            else:
+                values.add(p)
+    return kvs
+
+
+def filterRules(rules, dataId):
+    """Return the rules satisfied by dataId, using the list based filtering
+    previously done by HfsScanner.walk.
+    """
+    for k in dataId:
+        rules = [r for r in rules if k not in r or dataId[k] in r[k]]
+    return rules
+
+
+def referenceWalk(scanner, root, ruleSets):
+    """Return the sorted (path, dataId) results of walking root without
+    rules, filtered with filterRules.
+    """
+    return sorted((p, d) for p, d in scanner.walk(root) if filterRules(ruleSets, d))
+
+
+def touch(path):
+    d = os.path.dirname(path)
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    open(path, "w").close()
+
+
+class CandidateNameTest(unittest.TestCase):
+    """
+    Tests for finding entries by probing or prefix matching names generated
+    from dataId rules.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for visit in xrange(1, 7):
+            for filter in "gr":
+                for ccd in xrange(3):
+                    touch(os.path.join(self.root, "v%d-f%s" % (visit, filter), "x%d.fits" % ccd))
+        # a zero padded visit number, and entries not matching the template
+        touch(os.path.join(self.root, "v0003-fr", "x0.fits"))
+        touch(os.path.join(self.root, "junk", "x0.fits"))
+        touch(os.path.join(self.root, "v4-fr", "junk.fits"))
+        self.scanner = HfsScanner("v%(visit)d-f%(filter)s/x%(ccd)d.fits")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def walk(self, specs):
+        rules = [parseDataIdRules(spec, "cfht") for spec in specs]
+        return sorted(self.scanner.walk(self.root, rules))
+
+    def reference(self, specs, padded=False):
+        """Return the results of referenceWalk for the given specs. Unless
+        padded is True, the zero padded entry that is not found when visit
+        is constrained is omitted."""
+        return [(p, d) for p, d in referenceWalk(
+                self.scanner, self.root, [parseRuleSets(spec, "cfht") for spec in specs])
+                if padded or not p.startswith("v0003")]
+
+    def namesMatched(self, specs):
+        """Return the top level entry names matched against the template."""
+        names = []
+        matchName = self.scanner._matchName
+
+        def recordingMatchName(pc, name, parts=None):
+            if pc is self.scanner._pathComponents[0]:
+                names.append(name)
+            return matchName(pc, name, parts)
+        self.scanner._matchName = recordingMatchName
+        try:
+            self.walk(specs)
+        finally:
+            del self.scanner._matchName
+        return sorted(names)
+
+    def testPartiallyConstrained(self):
+        """Test that when only the leading key of a component is constrained,
+        only entries with the corresponding name prefixes are matched."""
+        for specs in ([["visit=2..3"]],
+                      [["visit=2"], ["visit=5", "ccd=1"]],
+                      [["visit=1..6", "ccd=0^2"]]):
+            rules = [parseDataIdRules(spec, "cfht") for spec in specs]
+            matcher = _RuleMatcher(rules)
+            prefixes = self.scanner._candidatePrefixes(self.scanner._pathComponents[0],
+                                                       matcher.all, matcher)
+            visits = set()
+            for r in rules:
+                visits.update(r["visit"])
+            self.assertEqual(sorted(prefixes), sorted("v%d-f" % v for v in visits))
+            self.assertEqual(self.namesMatched(specs),
+                             sorted("v%d-f%s" % (v, f) for v in visits for f in "gr"))
+            self.assertEqual(self.walk(specs), self.reference(specs))
+
+    def testUnconstrainedLeadingKey(self):
+        """Test that the literal prefix is used when the leading key is
+        unconstrained, and that no prefixes are used without rules."""
+        matcher = _RuleMatcher([parseDataIdRules(["filter=r"], "cfht")])
+        pc = self.scanner._pathComponents[0]
+        self.assertEqual(self.scanner._candidatePrefixes(pc, matcher.all, matcher), ("v",))
+        self.assertEqual(self.scanner._candidatePrefixes(pc, None, None), None)
+        specs = [["filter=r", "ccd=0"]]
+        self.assertEqual(self.walk(specs), self.reference(specs, padded=True))
+
+    def testFullyConstrained(self):
+        """Test that probed names give the same results as a listing."""
+        for specs in ([["visit=2..3", "filter=g^r", "ccd=1"]],
+                      [["visit=1", "filter=g"], ["visit=4", "filter=r", "ccd=0..1"]]):
+            self.assertEqual(self.walk(specs), self.reference(specs))
+        self.assertEqual(self.namesMatched([["visit=2..3", "filter=g^r"]]),
+                         ["v2-fg", "v2-fr", "v3-fg", "v3-fr"])
+
+    def testZeroPadded(self):
+        """Test that names not formatted the way the template formats them
+        are only found when the key they hold is not constrained."""
+        found = [p for p, d in self.walk([["filter=r", "ccd=0"]])]
+        self.assertIn(os.path.join("v0003-fr", "x0.fits"), found)
+        for specs in ([["visit=3", "filter=r", "ccd=0"]], [["visit=3", "ccd=0"]]):
+            found = [p for p, d in self.walk(specs)]
+            self.assertEqual(found, [os.path.join("v3-fr", "x0.fits")] if len(specs[0]) == 3 else
+                             [os.path.join("v3-fg", "x0.fits"), os.path.join("v3-fr", "x0.fits")])
+
+
+class IntervalSetTest(unittest.TestCase):
+    """
+    Tests for interval set storage of integer dataId rule values.
+    """
+
+    def testIntervalSet(self):
+        """Test that overlapping and adjacent intervals are merged, and that
+        membership, length and iteration agree with a set of integers."""
+        intervals = [(5, 9), (1, 2), (3, 3), (8, 12), (20, 20), (30, 25), (15, 17)]
+        s = IntervalSet(intervals)
+        expected = set()
+        for a, b in intervals:
+            expected.update(xrange(a, b + 1))
+        self.assertEqual(s.intervals, [(1, 3), (5, 12), (15, 17), (20, 20)])
+        self.assertEqual(len(s), len(expected))
+        self.assertEqual(list(s), sorted(expected))
+        for v in xrange(-2, 35):
+            self.assertEqual(v in s, v in expected, v)
+        self.assertEqual(len(IntervalSet()), 0)
+        self.assertFalse(0 in IntervalSet())
+        self.assertFalse(1 in IntervalSet([(2, 1)]))
+        u = s.union(IntervalSet([(4, 4), (13, 14), (40, 2**40)]))
+        self.assertEqual(u.intervals, [(1, 17), (20, 20), (40, 2**40)])
+        self.assertTrue(2**40 in u)
+        self.assertFalse(2**40 + 1 in u)
+        self.assertEqual(u, IntervalSet(u.intervals))
+        self.assertNotEqual(u, s)
+
+    def testParse(self):
+        """Test that parsed rules allow the same values as set based
+        parsing, for closed ranges, single values, reversed (empty) ranges,
+        repeated keys and string keys."""
+        specs = [
+            ["visit=1..3^7^5..6", "filter=g^r"],
+            ["visit=10..8^9", "ccd=0..35"],
+            ["visit=4", "visit=2..6^100", "filter=r", "filter=i"],
+            ["ccd=", "ccdName=00^01"],
+            [],
+        ]
+        for spec in specs:
+            rules = parseDataIdRules(spec, "cfht")
+            expected = parseRuleSets(spec, "cfht")
+            self.assertEqual(sorted(rules), sorted(expected))
+            for k, v in rules.iteritems():
+                if k in ("visit", "ccd"):
+                    self.assertIsInstance(v, IntervalSet)
+                    self.assertEqual(set(v), expected[k])
+                else:
+                    self.assertEqual(v, expected[k])
+        self.assertEqual(parseDataIdRules(["visit=0..999999999"], "cfht")["visit"].intervals,
+                         [(0, 999999999)])
+        self.assertRaises(RuntimeError, parseDataIdRules, ["bogus=1"], "cfht")
+        self.assertRaises(RuntimeError, parseDataIdRules, ["visit=1"], "hsc")
+
+    def testSegmentTable(self):
+        """Test that segment masks give the rules allowing each integer,
+        including integers before the first and after the last segment."""
+        values = [
+            (0, IntervalSet([(1, 10)])),
+            (1, IntervalSet([(5, 20), (25, 25)])),
+            (2, IntervalSet([(8, 8)])),
+            (3, IntervalSet([(21, 24)])),
+        ]
+        starts, masks = _segmentTable(values)
+        self.assertEqual(starts, sorted(starts))
+        self.assertEqual(len(starts), len(masks))
+        self.assertEqual(masks[-1], 0)
+        for x in xrange(-1, 30):
+            j = bisect.bisect_right(starts, x)
+            mask = masks[j - 1] if j > 0 else 0
+            self.assertEqual(mask, sum(1 << i for i, v in values if x in v), x)
+
+
+class RuleMatcherTest(unittest.TestCase):
+    """
+    Tests for matching dataIds against compiled dataId rules.
+    """
+
+    specs = [
+        ["visit=1..10", "filter=g^r"],
+        ["visit=5..20^25", "ccd=0..3"],
+        ["visit=8", "filter=r^i^z", "ccd=2^7..9"],
+        ["filter=u", "ccd=4..6^5..12"],
+        ["ccd=30..40"],
+    ]
+
+    def setUp(self):
+        self.rules = [parseDataIdRules(spec, "cfht") for spec in self.specs]
+        self.ruleSets = [parseRuleSets(spec, "cfht") for spec in self.specs]
+        self.matcher = _RuleMatcher(self.rules)
+        self.rng = random.Random(7)
+
+    def randomDataId(self):
+        dataId = {}
+        if self.rng.random() < 0.8:
+            dataId["visit"] = self.rng.randint(0, 30)
+        if self.rng.random() < 0.8:
+            dataId["filter"] = self.rng.choice("ugrizy")
+        if self.rng.random() < 0.8:
+            dataId["ccd"] = self.rng.randint(0, 45)
+        if self.rng.random() < 0.3:
+            dataId["ccdName"] = "name"
+        return dataId
+
+    def expectedMask(self, dataId):
+        matched = filterRules(self.ruleSets, dataId)
+        return sum(1 << i for i, r in enumerate(self.ruleSets) if r in matched)
+
+    def testMatch(self):
+        """Test that matching agrees with list based filtering, including
+        for keys in no rule and for values beyond the last range."""
+        matcher = self.matcher
+        self.assertEqual(matcher.all, 2**len(self.specs) - 1)
+        for i in xrange(2000):
+            dataId = self.randomDataId()
+            mask = matcher.match(matcher.all, dataId)
+            self.assertEqual(mask, self.expectedMask(dataId), dataId)
+            self.assertEqual(matcher.rules(mask),
+                             [r for j, r in enumerate(self.rules) if mask >> j & 1])
+        for visit in (0, 1, 10, 11, 20, 21, 25, 26, 1000):
+            self.assertEqual(matcher.match(matcher.all, {"visit": visit}),
+                             self.expectedMask({"visit": visit}))
+
+    def testIncrementalMatch(self):
+        """Test that narrowing a mask one entry at a time gives the same
+        result as matching the whole dataId."""
+        matcher = self.matcher
+        for i in xrange(500):
+            dataId = self.randomDataId()
+            mask = matcher.all
+            for k, v in sorted(dataId.items()):
+                mask = matcher.match(mask, {k: v})
+            self.assertEqual(mask, matcher.match(matcher.all, dataId))
+            self.assertEqual(matcher.match(0, dataId), 0)
+
+    def walkTree(self):
+        root = tempfile.mkdtemp()
+        for visit in xrange(0, 30, 3):
+            for filter in "ugriz":
+                for ccd in (0, 2, 5, 8, 35):
+                    touch(os.path.join(root, "v%d-f%s" % (visit, filter), "x%d.fits" % ccd))
+        return root
+
+    def testWalk(self):
+        """Test that walks with rules agree with filtered unrestricted walks,
+        serially and with several threads."""
+        root = self.walkTree()
+        try:
+            scanner = HfsScanner("v%(visit)d-f%(filter)s/x%(ccd)d.fits")
+            expected = referenceWalk(scanner, root, self.ruleSets)
+            self.assertTrue(expected)
+            self.assertEqual(sorted(scanner.walk(root, self.rules)), expected)
+            self.assertEqual(sorted(scanner.walk(root, self.rules, threads=4)), expected)
+            # walks with a rule that matches nothing
+            rules = [parseDataIdRules(["filter=y"], "cfht")]
+            self.assertEqual(list(scanner.walk(root, rules)), [])
+        finally:
+            shutil.rmtree(root)
+
+
+class MungedKeyTest(unittest.TestCase):
+    """
+    Tests for walks with camera specific dataId mungers.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for visit in (1, 2, 3):
+            for raft in ("01", "11", "22", "43"):
+                for sensor in ("00", "01", "11", "22"):
+                    touch(os.path.join(self.root, "v%d-fr" % visit, "R" + raft, "S%s.fits" % sensor))
+        self.scanner = HfsScanner("v%(visit)d-f%(filter)s/R%(raft)s/S%(sensor)s.fits")
+        for k in self.scanner._formatKeys.itervalues():
+            k.munge = _mungeFunctions["lsstsim"]
+            k.unmunge = _unmungeFunctions["lsstsim"]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testWalk(self):
+        """Test that rules on munged comma separated keys select the same
+        paths as filtering an unrestricted walk, and that the dataIds hold
+        the munged values."""
+        for specs in ([["raft=1,1^2,2"]],
+                      [["visit=2", "raft=1,1", "sensor=0,1^2,2"], ["visit=1..3", "raft=4,3"]],
+                      [["sensor=1,1"], ["raft=0,1", "sensor=0,0"]],
+                      [["filter=r", "raftId=12"]]):
+            rules = [parseDataIdRules(spec, "lsstsim") for spec in specs]
+            expected = referenceWalk(self.scanner, self.root,
+                                     [parseRuleSets(spec, "lsstsim") for spec in specs])
+            self.assertTrue(expected, specs)
+            self.assertEqual(sorted(self.scanner.walk(self.root, rules)), expected)
+            self.assertEqual(sorted(self.scanner.walk(self.root, rules, threads=3)), expected)
+        path, dataId = [(p, d) for p, d in self.scanner.walk(self.root)
+                        if p == os.path.join("v2-fr", "R43", "S01.fits")][0]
+        self.assertEqual(dataId, dict(visit=2, filter="r", raft="4,3", raftId=23,
+                                      sensor="0,1", sensorNum=1))
+
+    def testMaterialize(self):
+        """Test that per component dataId entries are merged into a new
+        dict, later components taking precedence."""
+        a = dict(visit=1)
+        self.assertEqual(_materialize((a,)), a)
+        self.assertIsNot(_materialize((a,)), a)
+        parts = (a, dict(raft="1,1", visit=2), dict(sensor="0,0"))
+        self.assertEqual(_materialize(parts), dict(visit=2, raft="1,1", sensor="0,0"))
+        self.assertEqual(a, dict(visit=1))
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+import lsst.utils.tests
+
+from lsst.datarel.fifoLoader import FifoLoader
+
+
+class FakeExecutor(object):
+    """Stand-in for MysqlExecutor whose LOAD statements read the file they
+    name, failing after reading a given number of bytes from some files.
+    """
+
+    def __init__(self, failures={}):
+        self.failures = failures
+        self.loaded = {}
+
+    def execStmt(self, stmt):
+        path = re.match(r"LOAD DATA LOCAL INFILE '([^']*)'", stmt).group(1)
+        with open(path, "rb") as f:
+            if path in self.failures:
+                f.read(self.failures[path])
+                raise RuntimeError("Load from {} failed".format(path))
+            self.loaded[path] = f.read()
+
+
+class FifoLoaderTest(unittest.TestCase):
+    """
+    Tests for loading files through FIFOs.
+    """
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.tmpDir, "t{}.csv".format(i)) for i in xrange(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def startLoads(self, sql):
+        loader = FifoLoader(sql)
+        for i, path in enumerate(self.paths):
+            loader.load(path, "LOAD DATA LOCAL INFILE '{}' INTO TABLE Table{};".format(path, i))
+        return loader
+
+    def write(self, data):
+        """Write data[i] to the i-th FIFO in a separate thread, and wait for
+        the writes to finish."""
+        def run():
+            for path, d in zip(self.paths, data):
+                with open(path, "wb") as f:
+                    for j in xrange(0, len(d), 4096):
+                        f.write(d[j:j + 4096])
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+        t.join(30.0)
+        self.assertFalse(t.is_alive(), "writer blocked")
+
+    def join(self, func):
+        """Call func in a separate thread, returning its result or raising
+        its exception, and fail if it does not return promptly."""
+        result = []
+        def run():
+            try:
+                result.append((True, func()))
+            except Exception as e:
+                result.append((False, e))
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+        t.join(30.0)
+        self.assertFalse(t.is_alive(), "loader did not finish")
+        ok, value = result[0]
+        if not ok:
+            raise value
+        return value
+
+    def assertRemoved(self):
+        for path in self.paths:
+            self.assertFalse(os.path.lexists(path))
+
+    def testLoad(self):
+        """Test that written data is loaded, and that FIFOs are removed."""
+        data = ["a,1\n" * 100000, "", "b,2\n"]
+        sql = FakeExecutor()
+        loader = self.startLoads(sql)
+        self.write(data)
+        self.join(loader.wait)
+        self.assertEqual(sql.loaded, dict(zip(self.paths, data)))
+        self.assertRemoved()
+
+    def testFailingLoad(self):
+        """Test that writers do not block when loads fail part way through or
+        before reading anything, and that wait() reports the failures."""
+        data = ["a,1\n" * 100000, "b,2\n" * 100000, "c,3\n"]
+        sql = FakeExecutor({self.paths[0]: 0, self.paths[1]: 1000})
+        loader = self.startLoads(sql)
+        self.write(data)
+        with self.assertRaises(RuntimeError) as cm:
+            self.join(loader.wait)
+        self.assertIn(self.paths[0], str(cm.exception))
+        self.assertIn(self.paths[1], str(cm.exception))
+        self.assertEqual(sql.loaded, {self.paths[2]: data[2]})
+        self.assertRemoved()
+
+    def testNoWriter(self):
+        """Test that wait() wakes up loads that have no writer."""
+        for failures in ({}, {self.paths[1]: 0}):
+            sql = FakeExecutor(failures)
+            loader = self.startLoads(sql)
+            self.write(["x\n"])
+            if failures:
+                self.assertRaises(RuntimeError, self.join, loader.wait)
+                self.assertEqual(sql.loaded, {self.paths[0]: "x\n", self.paths[2]: ""})
+            else:
+                self.join(loader.wait)
+                self.assertEqual(sql.loaded, dict(zip(self.paths, ["x\n", "", ""])))
+            self.assertRemoved()
+
+    def testAbort(self):
+        """Test that abort() stops loads, without raising load errors, and
+        reports the tables being loaded."""
+        sql = FakeExecutor({self.paths[1]: 10})
+        loader = self.startLoads(sql)
+        self.write(["a,1\n" * 10, "b,2\n" * 10])
+        self.assertEqual(self.join(loader.abort), ["Table0", "Table1", "Table2"])
+        self.assertEqual(sql.loaded, {self.paths[0]: "a,1\n" * 10, self.paths[2]: ""})
+        self.assertRemoved()
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
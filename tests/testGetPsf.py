@@ -26,7 +26,9 @@ import unittest
 
 import lsst.utils.tests
 
-from lsst.datarel.utils import getPsf
+from lsst.datarel.utils import ExposureReader, getPsf
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
 import lsst.daf.persistence as dafPersist
 
 
@@ -46,6 +48,39 @@ class GetPsfTest(unittest.TestCase):
         psf = getPsf(butler, "calexp", dataId, strict=False, warn=False)
         self.assertEqual(psf, None)
 
+    def assertPsfsEqual(self, psf, expected):
+        if expected is None:
+            self.assertEqual(psf, None)
+        else:
+            self.assertNotEqual(psf, None)
+            self.assertEqual(psf.computeImage().getArray().tolist(),
+                             expected.computeImage().getArray().tolist())
+
+    def testExposureReader(self):
+        """Test that reading the header and PSF of a calexp through one
+        ExposureReader, in either order, gives the same results as reading
+        them separately."""
+        dataId = dict(visit=85408556, filter="r", raft="2,3", sensor="1,1")
+        butler = dafPersist.Butler("tests/data")
+        filename = butler.get("calexp_filename", dataId=dataId)[0]
+        expectedMd = afwImage.readMetadata(filename).toString()
+        expectedPsf = butler.get("calexp", dataId=dataId, immediate=True).getPsf()
+        with ExposureReader(filename) as reader:
+            self.assertEqual(reader.readMetadata().toString(), expectedMd)
+            psf = getPsf(butler, "calexp", dataId, strict=False, warn=False,
+                         reader=reader, psfOnly=True)
+            self.assertPsfsEqual(psf, expectedPsf)
+            self.assertEqual(reader.readMetadata().toString(), expectedMd)
+        # PSF first, from a fresh reader, so that the header is read after
+        # the file has been positioned at a later HDU
+        with ExposureReader(filename) as reader:
+            self.assertPsfsEqual(reader.readPsf() or reader.readSubExposure(
+                afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(1, 1))).getPsf(),
+                expectedPsf)
+            self.assertEqual(reader.readMetadata().toString(), expectedMd)
+            self.assertEqual(reader.readMetadata().toString(), expectedMd)
+        self.assertEqual(reader.fits, None)
+
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
     pass
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import numpy
+
+import lsst.utils.tests
+
+from lsst.datarel.htm import htmIds, convexPolygons, polygonHtmIds, HtmIndexWriter
+
+# Fixture polygons, in scisql_index input format: an ID followed by the
+# ra, dec of 4 vertices
+polygonFile = os.path.join(os.path.dirname(__file__), "data", "htmPolygons.tsv")
+
+# Expected (polygon ID, HTM ID) rows for the fixture polygons at subdivision
+# level 10 and 11, in scisql_index output format
+indexFiles = dict((level, os.path.join(os.path.dirname(__file__), "data",
+                                      "htmPolygons_l{}.tsv".format(level)))
+                  for level in (10, 11))
+
+
+def readPolygons():
+    rows = numpy.loadtxt(polygonFile)
+    return rows[:, 0].astype(numpy.int64), rows[:, 1::2], rows[:, 2::2]
+
+
+def readIndex(path):
+    """Return the set of (polygon ID, HTM ID) pairs in an index file."""
+    rows = numpy.loadtxt(path, dtype=numpy.int64, ndmin=2)
+    return set(map(tuple, rows.tolist()))
+
+
+def writeIndex(level):
+    """Return the set of (polygon ID, HTM ID) pairs written by HtmIndexWriter
+    for the fixture polygons.
+    """
+    ids, ra, dec = readPolygons()
+    tmpDir = tempfile.mkdtemp()
+    try:
+        outFile = os.path.join(tmpDir, "htm.tsv")
+        writer = HtmIndexWriter(outFile, level, bufferRows=7)
+        for i in xrange(len(ids)):
+            writer.write(ids[i], ra[i], dec[i])
+        writer.close()
+        return readIndex(outFile)
+    finally:
+        shutil.rmtree(tmpDir)
+
+
+def scisqlIndex(level):
+    """Return the set of (polygon ID, HTM ID) pairs computed by scisql_index
+    for the fixture polygons.
+    """
+    tmpDir = tempfile.mkdtemp()
+    try:
+        outFile = os.path.join(tmpDir, "htm.tsv")
+        subprocess.check_call([os.path.join(os.environ["SCISQL_DIR"], "bin", "scisql_index"),
+                               "-l", str(level), outFile, polygonFile])
+        return readIndex(outFile)
+    finally:
+        shutil.rmtree(tmpDir)
+
+
+class HtmTest(unittest.TestCase):
+    """
+    Tests for HTM indexing of points and polygons.
+    """
+
+    def testRoots(self):
+        """Test that points in each octant map to the expected root triangle."""
+        ra = [45, 135, 225, 315, 315, 225, 135, 45]
+        dec = [-45, -45, -45, -45, 45, 45, 45, 45]
+        self.assertEqual(htmIds(ra, dec, 0).tolist(), range(8, 16))
+
+    def testHierarchy(self):
+        """Test that point IDs at successive levels are parent/child IDs."""
+        rng = numpy.random.RandomState(1)
+        ra = rng.uniform(0.0, 360.0, 1000)
+        dec = numpy.degrees(numpy.arcsin(rng.uniform(-1.0, 1.0, 1000)))
+        ids = htmIds(ra, dec, 12)
+        for level in (0, 5, 11):
+            self.assertTrue(((ids >> (2 * (12 - level))) == htmIds(ra, dec, level)).all())
+
+    def testPolygonCoverage(self):
+        """Test that polygon HTM IDs include the triangles of points inside
+        each polygon, and that they do not depend on vertex order."""
+        ids, ra, dec = readPolygons()
+        for level in (10, 11):
+            indexes, htm = polygonHtmIds(ra, dec, level)
+            covered = set(zip(indexes.tolist(), htm.tolist()))
+            # convex combinations of vertex unit vectors lie inside polygons
+            rng = numpy.random.RandomState(2)
+            verts = numpy.dstack([numpy.cos(numpy.radians(ra)) * numpy.cos(numpy.radians(dec)),
+                                  numpy.sin(numpy.radians(ra)) * numpy.cos(numpy.radians(dec)),
+                                  numpy.sin(numpy.radians(dec))])
+            weights = rng.dirichlet([0.5] * 4, size=(len(ids), 200))
+            p = numpy.einsum("nkv,nvi->nki", weights, verts)
+            pRa = numpy.degrees(numpy.arctan2(p[..., 1], p[..., 0]))
+            pDec = numpy.degrees(numpy.arctan2(p[..., 2], numpy.hypot(p[..., 0], p[..., 1])))
+            pIds = htmIds(pRa, pDec, level).reshape(pRa.shape)
+            for i in xrange(len(ids)):
+                for h in pIds[i]:
+                    self.assertIn((i, h), covered)
+            reverse = polygonHtmIds(ra[:, ::-1], dec[:, ::-1], level)
+            self.assertEqual(indexes.tolist(), reverse[0].tolist())
+            self.assertEqual(htm.tolist(), reverse[1].tolist())
+
+    def testIndexFiles(self):
+        """Test that HtmIndexWriter output matches the expected index files."""
+        for level in (10, 11):
+            expected = readIndex(indexFiles[level])
+            self.assertTrue(expected)
+            self.assertEqual(writeIndex(level), expected)
+
+    @unittest.skipIf("SCISQL_DIR" not in os.environ, "scisql is not set up")
+    def testScisql(self):
+        """Test that HtmIndexWriter output matches scisql_index output."""
+        for level in (10, 11):
+            self.assertEqual(writeIndex(level), scisqlIndex(level))
+
+    def testInvalidPolygon(self):
+        """Test that self-intersecting and degenerate polygons are rejected."""
+        ra = [[0.0, 1.0, 1.0, 0.0], [0.0, 1.0, 1.0, 0.0], [0.0, 1.0, 2.0, 3.0]]
+        dec = [[0.0, 0.0, 1.0, 1.0], [0.0, 1.0, 0.0, 1.0], [0.0, 0.0, 0.0, 0.0]]
+        self.assertEqual(convexPolygons(ra, dec).tolist(), [True, False, False])
+        self.assertEqual(convexPolygons(numpy.zeros((0, 4)), numpy.zeros((0, 4))).tolist(), [])
+        self.assertRaises(RuntimeError, polygonHtmIds, ra[1:2], dec[1:2], 5)
+        self.assertRaises(RuntimeError, polygonHtmIds, ra, dec, 5)
+
+    def testWriterSkipsInvalidPolygons(self):
+        """Test that HtmIndexWriter skips invalid polygons, writing the same
+        rows for the others as when they are written alone."""
+        ids, ra, dec = readPolygons()
+        badRa = numpy.array([0.0, 1.0, 1.0, 0.0])
+        badDec = numpy.array([0.0, 1.0, 0.0, 1.0])
+        tmpDir = tempfile.mkdtemp()
+        try:
+            outputs = []
+            for withBad in (False, True):
+                outFile = os.path.join(tmpDir, "htm{}.tsv".format(int(withBad)))
+                writer = HtmIndexWriter(outFile, 10, bufferRows=3)
+                numBad = 0
+                for i in xrange(len(ids)):
+                    if withBad and i % 4 == 0:
+                        writer.write(-i, badRa, badDec)
+                        numBad += 1
+                    writer.write(ids[i], ra[i], dec[i])
+                if withBad:
+                    # a buffer holding only invalid polygons
+                    for i in xrange(3):
+                        writer.write(-1000 - i, badRa, badDec)
+                        numBad += 1
+                writer.close()
+                with open(outFile) as f:
+                    outputs.append(f.read())
+                self.assertEqual(writer.numRows, len(ids) + numBad)
+                self.assertEqual(writer.numSkipped, numBad)
+        finally:
+            shutil.rmtree(tmpDir)
+        self.assertTrue(outputs[0])
+        self.assertEqual(outputs[1], outputs[0])
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import lsst.utils.tests
+
+from lsst.datarel.columnFileWriter import readColumns
+from lsst.datarel.datasetScanner import HfsScanner
+import lsst.datarel.tableSpecs as tableSpecs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "bin", "ingest"))
+import ingestProcessed
+
+outputNames = ["Science_Ccd_Exposure.csv", "Science_Ccd_Exposure_Metadata.csv",
+               "Science_Ccd_Exposure_To_Htm10.tsv"]
+
+
+def fakeToCsv(self, butler, root, path, dataId, loadedIds=None):
+    """Write rows derived from the exposure path instead of reading a calexp,
+    after a random delay, so that exposures finish in a scheduling
+    dependent order."""
+    exposureId = dataId["visit"] * 100 + dataId["ccd"]
+    if loadedIds is not None and exposureId in loadedIds:
+        return
+    time.sleep(random.uniform(0.0, 0.002))
+    record = []
+    for typ in tableSpecs.scienceCcdExposure(self.camera).types:
+        if typ in (int, long):
+            record.append(exposureId)
+        elif typ is float:
+            record.append(exposureId * 0.25)
+        elif typ is str:
+            record.append(path)
+        else:
+            record.append(None if typ is not None else os.path.basename(root))
+    self.expFile.write(*record)
+    self.mdFile.write(exposureId, "ROOT", 1, None, None, os.path.basename(root))
+    self.mdFile.write(exposureId, "CCD", 1, dataId["ccd"], None, None)
+    ra, dec = 10.0 + dataId["visit"], 0.5 * dataId["ccd"]
+    self.htmFile.write(exposureId, [ra, ra + 0.2, ra + 0.2, ra], [dec, dec, dec + 0.2, dec + 0.2])
+
+
+class IngestProcessedTest(unittest.TestCase):
+    """
+    Tests for the output of serial and parallel CSV generation.
+    """
+
+    template = "v%(visit)d/c%(ccd)d.fits"
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.roots = []
+        for r, numVisits in enumerate((7, 4, 0)):
+            root = os.path.join(self.tmpDir, "root{}".format(r))
+            os.makedirs(root)
+            for visit in xrange(numVisits):
+                os.makedirs(os.path.join(root, "v{}".format(visit)))
+                for ccd in xrange(9):
+                    open(os.path.join(root, "v{}".format(visit), "c{}.fits".format(ccd)), "w").close()
+            self.roots.append(root)
+        self.saved = (ingestProcessed.makeScanner, ingestProcessed.CsvGenerator.toCsv,
+                      ingestProcessed.CsvGenerator.getButler, ingestProcessed._batchSize)
+        ingestProcessed.makeScanner = lambda namespace, root: HfsScanner(self.template)
+        ingestProcessed.CsvGenerator.toCsv = fakeToCsv
+        ingestProcessed.CsvGenerator.getButler = lambda self, root: None
+        ingestProcessed._batchSize = 5
+
+    def tearDown(self):
+        (ingestProcessed.makeScanner, ingestProcessed.CsvGenerator.toCsv,
+         ingestProcessed.CsvGenerator.getButler, ingestProcessed._batchSize) = self.saved
+        shutil.rmtree(self.tmpDir)
+
+    def generate(self, jobs, scanThreads, format="csv"):
+        """Generate output with the given number of jobs, returning the
+        contents of the output files."""
+        outroot = tempfile.mkdtemp(dir=self.tmpDir)
+        ns = argparse.Namespace(camera="cfht", inroot=self.roots, outroot=outroot, rules=None,
+                                scanThreads=scanThreads, scanIndex=None, scanRoots=2,
+                                jobs=jobs, strict=False)
+        csvOptions = dict(compress=False, compressLevel=1, compressThreads=1, format=format)
+        if jobs == 1:
+            ingestProcessed.CsvGenerator(ns, csvOptions).csvAll()
+        else:
+            ingestProcessed.csvAllParallel(ns, csvOptions)
+        self.assertEqual(sorted(os.listdir(outroot)),
+                         sorted([n for n in outputNames if format != "columns" or n.endswith(".tsv")] +
+                                [n.replace(".csv", ".columns") for n in outputNames
+                                 if format != "csv" and n.endswith(".csv")]))
+        output = {}
+        for name in outputNames:
+            path = os.path.join(outroot, name)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    output[name] = f.read()
+            if format != "csv" and name.endswith(".csv"):
+                output[name + " columns"] = dict((k, v.tolist()) for k, v in
+                                                 readColumns(path).iteritems())
+        return output
+
+    def testDeterministicOutput(self):
+        """Test that --jobs 1 and --jobs N give byte identical output, and
+        that parallel runs agree with each other."""
+        for scanThreads in (1, 3):
+            serial = self.generate(1, scanThreads)
+            self.assertEqual(serial["Science_Ccd_Exposure.csv"].count("\n"), 99)
+            self.assertEqual(serial["Science_Ccd_Exposure_Metadata.csv"].count("\n"), 199)
+            for jobs in (2, 4, 4):
+                self.assertEqual(self.generate(jobs, scanThreads), serial)
+
+    def testDeterministicColumns(self):
+        """Test that column output is the same for serial and parallel runs."""
+        self.assertEqual(self.generate(3, 2, "both"), self.generate(1, 2, "both"))
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests
+
+from lsst.datarel.manifest import ChunkManifest
+import lsst.datarel.tableSpecs as tableSpecs
+
+params = dict(camera="lsstsim", inroot=[u"/a", "/b"], id=["visit=1..3"], chunkSize=2)
+items = [["/a", "p%d.fits" % i, {"visit": i, "raft": u"1,1"}] for i in xrange(5)]
+
+
+class ChunkManifestTest(unittest.TestCase):
+    """
+    Tests for saving, reloading and resuming chunked ingest manifests.
+    """
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpDir, "manifest.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testRoundTrip(self):
+        """Test that a reloaded manifest has the saved chunks and items."""
+        m = ChunkManifest(self.path, params)
+        self.assertFalse(m.scanned)
+        m.setItems(items, 2)
+        self.assertEqual(len(m.chunks), 3)
+        self.assertEqual(m.chunkItems(2), items[4:])
+        m.chunks[1]["status"] = "written"
+        m.chunks[1]["rows"] = {"Science_Ccd_Exposure.csv": 2}
+        m.save()
+        m2 = ChunkManifest(self.path, params)
+        self.assertTrue(m2.scanned)
+        self.assertEqual(m2.chunkSize, 2)
+        self.assertEqual(m2.chunks, m.chunks)
+        self.assertEqual(m2.items, items)
+        self.assertEqual(m2.withStatus("pending"), [0, 2])
+        self.assertEqual(m2.withStatus("written"), [1])
+        # unicode strings from JSON are converted back to str
+        self.assertTrue(all(type(s) is str for s in m2.params["inroot"]))
+        self.assertTrue(type(m2.chunkItems(0)[0][2]["raft"]) is str)
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+        self.assertRaises(RuntimeError, ChunkManifest, self.path, dict(params, chunkSize=3))
+
+    def testResume(self):
+        """Test that an interrupted chunk load is detected on resumption, and
+        that files recorded as loaded are kept."""
+        m = ChunkManifest(self.path, params)
+        m.setItems(items, 2)
+        m.chunks[0]["status"] = "written"
+        m.save()
+        self.assertFalse(m.beginLoad(0))
+        m.fileLoaded(0, "Science_Ccd_Exposure_To_Htm10.tsv")
+        # simulate an interruption by reading the manifest again
+        m = ChunkManifest(self.path, params)
+        self.assertEqual(m.withStatus("loading"), [0])
+        self.assertEqual(m.chunks[0]["loaded"], ["Science_Ccd_Exposure_To_Htm10.tsv"])
+        self.assertTrue(m.beginLoad(0))
+        m.fileLoaded(0, "Science_Ccd_Exposure.csv")
+        m.endLoad(0)
+        m = ChunkManifest(self.path, params)
+        self.assertEqual(m.withStatus("loaded"), [0])
+        self.assertEqual(m.withStatus("loading"), [])
+        self.assertEqual(sorted(m.chunks[0]["loaded"]),
+                         ["Science_Ccd_Exposure.csv", "Science_Ccd_Exposure_To_Htm10.tsv"])
+
+    def testDeleteChunkRows(self):
+        """Test that the exposure IDs of partially loaded chunk files are
+        read back and turned into DELETE statements."""
+        spec = tableSpecs.scienceCcdExposureMetadata
+        path = os.path.join(self.tmpDir, "md.csv")
+        writer = spec.openWriter(path, compress=False)
+        writer.writeHeader(*spec.names)
+        for i in (5, 3, 5, 9):
+            writer.write(i, "KEY", 1, None, 1.5, None)
+        writer.close()
+        self.assertEqual(spec.readIds(path), [3, 5, 9])
+        self.assertEqual(spec.deleteStatements([3, 5, 9], batchSize=2), [
+            "DELETE FROM Science_Ccd_Exposure_Metadata WHERE scienceCcdExposureId IN (3, 5);",
+            "DELETE FROM Science_Ccd_Exposure_Metadata WHERE scienceCcdExposureId IN (9);",
+        ])
+        htmPath = os.path.join(self.tmpDir, "htm.tsv")
+        with open(htmPath, "w") as f:
+            f.write("7\t123\n7\t124\n2\t99\n")
+        self.assertEqual(tableSpecs.scienceCcdExposureToHtm10.readIds(htmPath), [2, 7])
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
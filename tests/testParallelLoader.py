@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from contextlib import contextmanager
+import re
+import threading
+import time
+import unittest
+
+import lsst.utils.tests
+
+from lsst.datarel.parallelLoader import ParallelLoader
+import lsst.datarel.tableSpecs as tableSpecs
+
+_warningsDescription = (("Level",), ("Code",), ("Message",))
+
+
+class FakeCursor(object):
+    """Returns canned result sets for LOAD statements, keyed by file path."""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.description = None
+        self.rowcount = -1
+        self.sets = []
+        self.rows = None
+        self.row = None
+
+    def execute(self, stmt):
+        if stmt == "SHOW COUNT(*) WARNINGS":
+            self.description = (("@@session.warning_count",),)
+            self.row = (self.numWarnings,)
+            return
+        path = re.search(r"INFILE '([^']*)'", stmt).group(1)
+        rows, warnings, delay, error = self.executor.loads[path]
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        self.rowcount = rows
+        self.numWarnings = len(warnings)
+        self.description = None
+        # the LOAD itself, then SHOW WARNINGS, then an unrelated result set
+        self.sets = [(_warningsDescription, list(warnings)),
+                     ((("x",),), [(1,), (2,)])]
+
+    def fetchall(self):
+        rows, self.rows = self.rows, None
+        return rows
+
+    def fetchone(self):
+        return self.row
+
+    def nextset(self):
+        if not self.sets:
+            return None
+        self.description, self.rows = self.sets.pop(0)
+        return True
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, executor):
+        self.executor = executor
+
+    def cursor(self):
+        return FakeCursor(self.executor)
+
+    def commit(self):
+        with self.executor.lock:
+            self.executor.commits += 1
+
+
+class FakeExecutor(object):
+    """Stands in for a MysqlExecutor using pooled connections."""
+
+    useClient = False
+
+    def __init__(self, loads):
+        self.loads = loads
+        self.lock = threading.Lock()
+        self.commits = 0
+
+    @contextmanager
+    def connection(self):
+        yield FakeConnection(self)
+
+
+def warning(message, code=1265):
+    return ("Warning", code, message)
+
+
+class ParallelLoaderTest(unittest.TestCase):
+    """
+    Tests for concurrent LOAD DATA statements and warning summaries.
+    """
+
+    def setUp(self):
+        spec = tableSpecs.scienceCcdExposureMetadata
+        self.paths = ["/tmp/load{}.csv".format(i) for i in xrange(5)]
+        self.stmts = [spec.load(p) for p in self.paths]
+        truncated = "Data truncated for column 'stringValue' at row {}"
+        self.canned = {
+            # earlier loads finish later, so that results arrive out of order
+            self.paths[0]: (10, [warning(truncated.format(1)), warning(truncated.format(7)),
+                                 warning("Out of range value for column 'intValue' at row 3", 1264)],
+                            0.2, None),
+            self.paths[1]: (20, [], 0.15, None),
+            self.paths[2]: (30, [warning(truncated.format(12345))], 0.1, None),
+            self.paths[3]: (0, [("Note", 1000, "at row 5 of nothing")], 0.05, None),
+            self.paths[4]: (50, [], 0.0, None),
+        }
+
+    def testRun(self):
+        """Test that results are returned in load order, and that warnings
+        are grouped with row numbers stripped from their messages."""
+        sql = FakeExecutor(self.canned)
+        finished = []
+        results = ParallelLoader(sql, 5).run(self.stmts, lambda r: finished.append(r.path))
+        self.assertEqual([r.path for r in results], self.paths)
+        self.assertEqual(sorted(finished), sorted(self.paths))
+        self.assertNotEqual(finished, self.paths)
+        self.assertEqual(sql.commits, len(self.paths))
+        self.assertEqual([r.rows for r in results], [10, 20, 30, 0, 50])
+        self.assertEqual([r.numWarnings for r in results], [3, 0, 1, 1, 0])
+        self.assertEqual(set(r.table for r in results), set(["Science_Ccd_Exposure_Metadata"]))
+        self.assertEqual(results[0].warnings, {
+            ("Warning", 1265, "Data truncated for column 'stringValue'"): 2,
+            ("Warning", 1264, "Out of range value for column 'intValue'"): 1,
+        })
+        self.assertEqual(results[2].warnings,
+                         {("Warning", 1265, "Data truncated for column 'stringValue'"): 1})
+        # only trailing row numbers are removed
+        self.assertEqual(results[3].warnings, {("Note", 1000, "at row 5 of nothing"): 1})
+        self.assertIn("(2x)", str(results[0]))
+        self.assertIn("3 warnings", str(results[0]))
+
+    def testFailure(self):
+        """Test that a failing load does not stop the others, and that the
+        error lists the path of the failed load."""
+        rows, warnings, delay, error = self.canned[self.paths[1]]
+        self.canned[self.paths[1]] = (rows, warnings, delay, RuntimeError("The table is full"))
+        sql = FakeExecutor(self.canned)
+        finished = []
+        for threads in (1, 3):
+            del finished[:]
+            try:
+                ParallelLoader(sql, threads).run(self.stmts, lambda r: finished.append(r.path))
+            except RuntimeError as e:
+                self.assertEqual(str(e), "Failed to load " + self.paths[1])
+            else:
+                self.fail("Expected a RuntimeError")
+            self.assertEqual(sorted(finished), sorted(self.paths[:1] + self.paths[2:]))
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import lsst.utils.tests
+
+import lsst.datarel.datasetScanner as datasetScanner
+from lsst.datarel.datasetScanner import HfsScanner
+from lsst.datarel.scanIndex import ScanIndex
+
+
+class ScanIndexTest(unittest.TestCase):
+    """
+    Tests for persisting scanner results in a ScanIndex.
+    """
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpDir, "repo")
+        self.indexPath = os.path.join(self.tmpDir, "index.sqlite3")
+        for visit in (1, 2, 3):
+            for ccd in (0, 1):
+                self.touch(os.path.join("v%d" % visit, "c%d.fits" % ccd))
+        self.touch(os.path.join("v2", "junk.txt"))
+        self.age(100)
+        self.scanner = HfsScanner("v%(visit)d/c%(ccd)d.fits")
+        self.listed = []
+        self.listDir = datasetScanner._listDir
+
+        def recordingListDir(path):
+            self.listed.append(os.path.relpath(path, self.root))
+            return self.listDir(path)
+        datasetScanner._listDir = recordingListDir
+
+    def tearDown(self):
+        datasetScanner._listDir = self.listDir
+        shutil.rmtree(self.tmpDir)
+
+    def touch(self, rel):
+        path = os.path.join(self.root, rel)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(rel)
+
+    def age(self, seconds, rel=None):
+        """Set the modification times of everything below root (or of the
+        given entry) to seconds ago, so that index records are not racy."""
+        t = time.time() - seconds
+        if rel is not None:
+            os.utime(os.path.join(self.root, rel), (t, t))
+            return
+        for d, dirs, files in os.walk(self.root):
+            for name in dirs + files:
+                os.utime(os.path.join(d, name), (t, t))
+        os.utime(self.root, (t, t))
+
+    def walk(self, **kwargs):
+        index = ScanIndex(self.indexPath)
+        try:
+            del self.listed[:]
+            return sorted(self.scanner.walk(self.root, index=index, **kwargs))
+        finally:
+            index.close()
+
+    def testRoundTrip(self):
+        """Test that results read back from a reopened index match a plain
+        walk, without listing unmodified directories."""
+        expected = sorted(self.scanner.walk(self.root))
+        self.assertEqual(len(expected), 6)
+        self.assertEqual(self.walk(), expected)
+        self.assertEqual(sorted(self.listed), [".", "v1", "v2", "v3"])
+        self.assertEqual(self.walk(), expected)
+        self.assertEqual(self.listed, [])
+        self.assertEqual(self.walk(threads=3), expected)
+        self.assertEqual(self.listed, [])
+        index = ScanIndex(self.indexPath)
+        try:
+            files = list(index.files(self.root, self.scanner.indexKey()))
+            self.assertEqual([(p, d) for p, d, size, t in files], expected)
+            for p, d, size, t in files:
+                self.assertEqual(size, os.stat(os.path.join(self.root, p)).st_size)
+            # records are kept per template
+            self.assertEqual(list(index.files(self.root, "other")), [])
+        finally:
+            index.close()
+
+    def testModified(self):
+        """Test that modified directories are listed again, and that the
+        records of removed directories are dropped."""
+        self.walk()
+        self.touch(os.path.join("v1", "c2.fits"))
+        self.age(50, "v1")
+        shutil.rmtree(os.path.join(self.root, "v3"))
+        self.age(50, ".")
+        expected = sorted(self.scanner.walk(self.root))
+        self.assertEqual(self.walk(), expected)
+        self.assertEqual(sorted(self.listed), [".", "v1"])
+        index = ScanIndex(self.indexPath)
+        try:
+            files = [p for p, d, size, t in index.files(self.root, self.scanner.indexKey())]
+        finally:
+            index.close()
+        self.assertEqual(files, [p for p, d in expected])
+        self.assertFalse(any(p.startswith("v3") for p in files))
+
+    def testRacy(self):
+        """Test that directories modified just before being listed are not
+        recorded."""
+        self.touch(os.path.join("v2", "c5.fits"))
+        self.walk()
+        self.walk()
+        self.assertEqual(sorted(self.listed), ["v2"])
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
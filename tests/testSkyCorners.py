@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import unittest
+
+import numpy
+
+import lsst.utils.tests
+
+import lsst.datarel.skyCorners as skyCorners
+from lsst.datarel.skyCorners import exposureSkyCorners, tanPixelToSky
+
+
+class Header(object):
+    """Minimal stand-in for a PropertySet holding a FITS header."""
+
+    def __init__(self, **kw):
+        self.kw = kw
+
+    def exists(self, k):
+        return k in self.kw
+
+    def get(self, k):
+        return self.kw[k]
+
+
+def makeHeader(crpix1, crpix2, crval1, crval2, theta):
+    scale = 0.2 / 3600.0
+    return Header(NAXIS1=513, NAXIS2=2001, CTYPE1='RA---TAN', CTYPE2='DEC--TAN',
+                  RADESYS='ICRS', EQUINOX=2000.0, CRPIX1=crpix1, CRPIX2=crpix2,
+                  CRVAL1=crval1, CRVAL2=crval2,
+                  CD1_1=-scale * numpy.cos(theta), CD1_2=scale * numpy.sin(theta),
+                  CD2_1=scale * numpy.sin(theta), CD2_2=scale * numpy.cos(theta))
+
+
+class SkyCornersTest(unittest.TestCase):
+    """
+    Tests for vectorized exposure center and corner sky positions.
+    """
+
+    def setUp(self):
+        self.afwSkyCorners = skyCorners._afwSkyCorners
+
+        def fail(*args):
+            raise AssertionError("afw fallback used for a TAN WCS")
+        skyCorners._afwSkyCorners = fail
+
+    def tearDown(self):
+        skyCorners._afwSkyCorners = self.afwSkyCorners
+
+    def testReferencePixel(self):
+        """Test that the reference pixel maps to the reference sky position."""
+        ra, dec = tanPixelToSky(99.0, -11.0, 100.0, -10.0, 359.5, 45.0, 1e-4, 0.0, 0.0, 1e-4)
+        self.assertAlmostEqual(ra, 359.5, 12)
+        self.assertAlmostEqual(dec, 45.0, 12)
+        ra, dec = tanPixelToSky(1e4, 0.0, 1.0, 1.0, 359.9, 0.0, 1e-4, 0.0, 0.0, 1e-4)
+        self.assertTrue(0.0 <= ra < 360.0)
+
+    def testOrigins(self):
+        """Test that exposures with non-zero origins take the vectorized
+        path, and that an origin shifts pixel positions in the same way as
+        the opposite shift of the reference pixel."""
+        params = [(-100.0, 2500.0, 10.0, -30.0, 0.3), (1.0, 1.0, 200.0, 89.0, 2.0),
+                  (700.0, -40.0, 0.01, 5.0, 4.0)]
+        origins = [(1024, 2048), (0, 0), (-5, 3)]
+        mds = [makeHeader(*p) for p in params]
+        shifted = [makeHeader(p[0] - x0, p[1] - y0, *p[2:]) for p, (x0, y0) in zip(params, origins)]
+        got = exposureSkyCorners(mds, origins)
+        self.assertEqual(got.shape, (3, 5, 2))
+        numpy.testing.assert_allclose(got, exposureSkyCorners(shifted), rtol=0, atol=1e-10)
+        for i, (md, (x0, y0)) in enumerate(zip(mds, origins)):
+            w, h = md.get('NAXIS1'), md.get('NAXIS2')
+            x = numpy.array([x0 + 0.5*w, x0, x0, x0 + w, x0 + w]) - 0.5
+            y = numpy.array([y0 + 0.5*h, y0, y0 + h, y0 + h, y0]) - 0.5
+            ra, dec = tanPixelToSky(x, y, *[md.get(k) for k in skyCorners._wcsKeys])
+            numpy.testing.assert_allclose(got[i, :, 0], ra, rtol=0, atol=1e-10)
+            numpy.testing.assert_allclose(got[i, :, 1], dec, rtol=0, atol=1e-10)
+            # one exposure at a time, as ingestProcessed.py calls it
+            numpy.testing.assert_allclose(exposureSkyCorners([md], [(x0, y0)])[0], got[i],
+                                          rtol=0, atol=1e-10)
+
+
+    def testCfhtHeaders(self):
+        """Test that headers giving the reference system in RADECSYS, as CFHT
+        headers do, take the vectorized path, and that other reference
+        systems do not."""
+        md = makeHeader(1000.0, 2000.0, 215.0, 53.0, 0.1)
+        cfht = Header(**md.kw)
+        del cfht.kw['RADESYS']
+        cfht.kw['RADECSYS'] = 'FK5     '
+        self.assertTrue(skyCorners._isSimpleTan(cfht))
+        numpy.testing.assert_allclose(exposureSkyCorners([cfht]), exposureSkyCorners([md]),
+                                      rtol=0, atol=1e-10)
+        # RADESYS takes precedence over RADECSYS
+        cfht.kw['RADESYS'] = 'GALACTIC'
+        self.assertFalse(skyCorners._isSimpleTan(cfht))
+        del cfht.kw['RADESYS']
+        cfht.kw['EQUINOX'] = 1950.0
+        self.assertFalse(skyCorners._isSimpleTan(cfht))
+        del cfht.kw['RADECSYS']
+        self.assertFalse(skyCorners._isSimpleTan(cfht))
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
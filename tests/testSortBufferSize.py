@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import socket
+import unittest
+
+import lsst.utils.tests
+
+import lsst.datarel.mysqlExecutor as mysqlExecutor
+from lsst.datarel.mysqlExecutor import sortBufferSize
+
+
+class SortBufferSizeTest(unittest.TestCase):
+    """
+    Tests for dividing MyISAM sort buffer memory among index rebuilds.
+    """
+
+    def setUp(self):
+        self.availableMemory = mysqlExecutor.availableMemory
+        mysqlExecutor.availableMemory = lambda: 16 << 30
+
+    def tearDown(self):
+        mysqlExecutor.availableMemory = self.availableMemory
+
+    def testSortMemory(self):
+        """Test that an explicit total is divided among threads, whatever
+        the host."""
+        for host in (None, "db.example.org"):
+            self.assertEqual(sortBufferSize(host, 1, 1024), 1 << 30)
+            self.assertEqual(sortBufferSize(host, 4, 1024), 256 << 20)
+            self.assertEqual(sortBufferSize(host, 3, 1000), (1000 << 20) // 3)
+            # at least 8 MiB per thread
+            self.assertEqual(sortBufferSize(host, 16, 64), 8 << 20)
+            self.assertEqual(sortBufferSize(host, 0, 64), 64 << 20)
+
+    def testLocal(self):
+        """Test that half of the available memory is used for a local server."""
+        for host in (None, "localhost", "127.0.0.1", socket.gethostname()):
+            self.assertEqual(sortBufferSize(host, 1), 8 << 30)
+            self.assertEqual(sortBufferSize(host, 4), 2 << 30)
+        mysqlExecutor.availableMemory = lambda: None
+        self.assertEqual(sortBufferSize("localhost", 2), 2 << 30)
+
+    def testRemote(self):
+        """Test that 4 GiB is used for a remote server."""
+        self.assertEqual(sortBufferSize("db.example.org", 1), 4 << 30)
+        self.assertEqual(sortBufferSize("db.example.org", 2), 2 << 30)
+
+    def testAvailableMemory(self):
+        """Test that available memory is reported, if it can be determined."""
+        memory = self.availableMemory()
+        self.assertTrue(memory is None or memory > 0)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
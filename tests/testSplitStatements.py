@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests
+
+from lsst.datarel.mysqlExecutor import MysqlExecutor, splitStatements
+
+storedFunctionScript = """
+DROP FUNCTION IF EXISTS f;
+DELIMITER //
+CREATE FUNCTION f(x INT) RETURNS INT DETERMINISTIC
+BEGIN
+    DECLARE y INT;
+    SET y = x + 1;
+    RETURN y;
+END//
+delimiter ;
+SELECT f(1)"""
+
+
+class SplitStatementsTest(unittest.TestCase):
+    """
+    Tests for splitting SQL scripts into statements.
+    """
+
+    def testQuotesAndComments(self):
+        """Test that delimiters in strings, identifiers and comments are ignored."""
+        script = """
+            -- a comment; not a statement
+            CREATE TABLE `a;b` (x INT); # another; comment
+            INSERT INTO t VALUES ('it''s;', "a\\";b"); /* block; comment */
+            /*!40101 SET NAMES utf8 */;
+            SELECT 1--1;
+            """
+        self.assertEqual(list(splitStatements(script)), [
+            "CREATE TABLE `a;b` (x INT)",
+            "INSERT INTO t VALUES ('it''s;', \"a\\\";b\")",
+            "/*!40101 SET NAMES utf8 */",
+            "SELECT 1--1",
+        ])
+
+    def testDelimiter(self):
+        """Test that DELIMITER commands change the statement terminator."""
+        stmts = list(splitStatements(storedFunctionScript))
+        self.assertEqual(len(stmts), 3)
+        self.assertEqual(stmts[0], "DROP FUNCTION IF EXISTS f")
+        self.assertTrue(stmts[1].startswith("CREATE FUNCTION f"))
+        self.assertTrue(stmts[1].endswith("END"))
+        self.assertIn("SET y = x + 1;", stmts[1])
+        self.assertEqual(stmts[2], "SELECT f(1)")
+
+
+class RecordingCursor(object):
+    """Records executed statements, rejecting scripts, DELIMITER commands
+    and unterminated stored function bodies as a server would."""
+
+    description = None
+    rowcount = 0
+
+    def __init__(self, executed):
+        self.executed = executed
+
+    def close(self):
+        pass
+
+    def execute(self, stmt):
+        if stmt.lstrip().lower().startswith("delimiter") or stmt.rstrip().endswith("//") or \
+                (stmt.count(";") > 0 and not stmt.startswith("CREATE FUNCTION")):
+            raise RuntimeError("You have an error in your SQL syntax")
+        self.executed.append(stmt)
+
+    def nextset(self):
+        return None
+
+
+class RecordingConnection(object):
+
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self):
+        return RecordingCursor(self.executed)
+
+    def commit(self):
+        pass
+
+    def ping(self, reconnect):
+        pass
+
+    def close(self):
+        pass
+
+
+class ExecScriptTest(unittest.TestCase):
+    """
+    Tests for running SQL scripts over pooled connections.
+    """
+
+    def testStoredFunctions(self):
+        """Test that scripts defining stored functions are run one statement
+        at a time, without DELIMITER commands."""
+        tmpDir = tempfile.mkdtemp()
+        try:
+            script = os.path.join(tmpDir, "setup_storedFunctions.sql")
+            with open(script, "w") as f:
+                f.write(storedFunctionScript)
+            conn = RecordingConnection()
+            sql = MysqlExecutor(None, "test", None, None, password="")
+            sql.getConn = lambda useDatabase=True: conn
+            progress = []
+            sql.execScript(script, progress=lambda i, stmt, t: progress.append((i, stmt)))
+        finally:
+            shutil.rmtree(tmpDir)
+        expected = list(splitStatements(storedFunctionScript))
+        self.assertEqual(conn.executed, expected)
+        self.assertEqual(progress, list(enumerate(expected, 1)))
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
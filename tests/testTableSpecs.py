@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2014 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import re
+import unittest
+
+import lsst.utils.tests
+
+import lsst.datarel.tableSpecs as tableSpecs
+
+
+def normalize(stmt):
+    """Collapse whitespace, so that statements differing only in layout
+    compare equal."""
+    stmt = re.sub(r"\s+", " ", stmt)
+    return re.sub(r"\s*([(),;])\s*", r"\1", stmt).strip()
+
+
+# The LOAD statements written by hand in the ingest scripts before they
+# were generated from table specs.
+
+def oldProcessedLoads(camera, expPath, mdPath, htmPath):
+    loadStmt = str.format("""
+        LOAD DATA LOCAL INFILE '{}'
+        INTO TABLE Science_Ccd_Exposure
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' (
+            scienceCcdExposureId,
+            """, expPath)
+    if camera == 'lsstsim':
+        loadStmt += 'visit, raft, raftName, ccd, ccdName, filterId, filterName,'
+    elif camera == 'cfht':
+        loadStmt += 'visit, ccd, ccdName, filterId, filterName,'
+    elif camera == 'sdss':
+        loadStmt += 'run, camcol, filterId, field, filterName,'
+    loadStmt += """
+            ra, decl,
+            equinox, raDeSys,
+            ctype1, ctype2,
+            crpix1, crpix2,
+            crval1, crval2,
+            cd1_1, cd1_2, cd2_1, cd2_2,
+            corner1Ra, corner1Decl,
+            corner2Ra, corner2Decl,
+            corner3Ra, corner3Decl,
+            corner4Ra, corner4Decl,
+            taiMjd, obsStart, expMidpt, expTime,
+            nCombine, binX, binY,"""
+    if camera in ('lsstsim', 'cfht'):
+        loadStmt += """
+            readNoise, saturationLimit, gainEff,"""
+    loadStmt += """
+            fluxMag0, fluxMag0Sigma, fwhm, path
+        ) SET htmId20 = scisql_s2HtmId(ra, decl, 20),
+              poly = scisql_s2CPolyToBin(corner1Ra, corner1Decl,
+                                         corner2Ra, corner2Decl,
+                                         corner3Ra, corner3Decl,
+                                         corner4Ra, corner4Decl);
+        SHOW WARNINGS;"""
+    mdLoadStmt = str.format("""
+        LOAD DATA LOCAL INFILE '{}'
+        INTO TABLE Science_Ccd_Exposure_Metadata
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+        IGNORE 1 LINES (
+            scienceCcdExposureId,
+            metadataKey,
+            exposureType,
+            intValue,
+            doubleValue,
+            stringValue);
+        SHOW WARNINGS;
+        """, mdPath)
+    htmLoadStmt = str.format("""
+        LOAD DATA LOCAL INFILE '{}'
+        INTO TABLE Science_Ccd_Exposure_To_Htm10 (
+            scienceCcdExposureId,
+            htmId10);
+        SHOW WARNINGS;
+        """, htmPath)
+    return loadStmt, mdLoadStmt, htmLoadStmt
+
+
+def oldRawLoads(camera, expPath, mdPath, rToSPath, htmPath):
+    if camera == 'lsstsim':
+        loadStmt = """\
+        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_Exposure
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' (
+            rawAmpExposureId, visit, snap, raft, raftName,
+            ccd, ccdName, amp, ampName, filterId, filterName,
+            ra, decl,
+            equinox, raDeSys,
+            ctype1, ctype2,
+            crpix1, crpix2,
+            crval1, crval2,
+            cd1_1, cd1_2, cd2_1, cd2_2,
+            corner1Ra, corner1Decl,
+            corner2Ra, corner2Decl,
+            corner3Ra, corner3Decl,
+            corner4Ra, corner4Decl,
+            taiMjd, obsStart, expMidpt, expTime,
+            airmass, darkTime, zd
+        ) SET htmId20 = scisql_s2HtmId(ra, decl, 20),
+              poly = scisql_s2CPolyToBin(corner1Ra, corner1Decl,
+                                         corner2Ra, corner2Decl,
+                                         corner3Ra, corner3Decl,
+                                         corner4Ra, corner4Decl);
+        SHOW WARNINGS;
+        """
+    else:
+        loadStmt = """\
+        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_Exposure
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' (
+            rawAmpExposureId, visit, snap, raft, ccd, amp, filterId,
+            ra, decl,
+            equinox, raDeSys,
+            ctype1, ctype2,
+            crpix1, crpix2,
+            crval1, crval2,
+            cd1_1, cd1_2, cd2_1, cd2_2,
+            llcRa, llcDecl,
+            ulcRa, ulcDecl,
+            urcRa, urcDecl,
+            lrcRa, lrcDecl,
+            taiMjd, obsStart, expMidpt, expTime,
+            airmass, darkTime, zd
+        ) SET poly = scisql_s2CPolyToBin(llcRa, llcDecl,
+                                         ulcRa, ulcDecl,
+                                         urcRa, urcDecl,
+                                         lrcRa, lrcDecl);
+        SHOW WARNINGS;
+        """
+    mdLoadStmt = """\
+        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_Exposure_Metadata
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' (
+            rawAmpExposureId,
+            metadataKey,
+            exposureType,
+            intValue,
+            doubleValue,
+            stringValue);
+        SHOW WARNINGS;
+        """
+    rToSLoadStmt = """\
+        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_To_Science_Ccd_Exposure
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' (
+            rawAmpExposureId,
+            scienceCcdExposureId,
+            snap,
+            amp);
+        SHOW WARNINGS;
+        """
+    htmLoadStmt = """\
+        LOAD DATA LOCAL INFILE '%s' REPLACE INTO TABLE Raw_Amp_Exposure_To_Htm11 (
+            rawAmpExposureId,
+            htmId11);
+        SHOW WARNINGS;
+        """
+    return (loadStmt % expPath, mdLoadStmt % mdPath, rToSLoadStmt % rToSPath,
+            htmLoadStmt % htmPath)
+
+
+class TableSpecsTest(unittest.TestCase):
+    """
+    Tests for LOAD statements generated from table specs.
+    """
+
+    def assertStatementsEqual(self, specs, oldStmts):
+        paths = ["/data/{}.{}".format(spec.table, "csv" if spec.csv else "tsv") for spec in specs]
+        for spec, path, old in zip(specs, paths, oldStmts(*paths)):
+            stmt = spec.loadStatement(path)
+            self.assertEqual(normalize(stmt), normalize(old), spec.table)
+            # clauses the tables differ in
+            self.assertEqual("IGNORE 1 LINES" in stmt,
+                             spec.table == "Science_Ccd_Exposure_Metadata", spec.table)
+            self.assertEqual("REPLACE" in stmt, spec.table.startswith("Raw_"), spec.table)
+            self.assertEqual("FIELDS TERMINATED BY" in stmt, path.endswith(".csv"), spec.table)
+            self.assertTrue(stmt.endswith("SHOW WARNINGS;\n"))
+
+    def testProcessed(self):
+        """Test the statements of ingestProcessed.py for each camera."""
+        for camera in ("lsstsim", "cfht", "sdss"):
+            specs = [tableSpecs.scienceCcdExposure(camera), tableSpecs.scienceCcdExposureMetadata,
+                     tableSpecs.scienceCcdExposureToHtm10]
+            self.assertStatementsEqual(
+                specs, lambda exp, md, htm: oldProcessedLoads(camera, exp, md, htm))
+        self.assertRaises(RuntimeError, tableSpecs.scienceCcdExposure, "hsc")
+
+    def testRaw(self):
+        """Test the statements of ingestRaw_ImSim.py and ingestRaw_CFHT.py."""
+        for camera in ("lsstsim", "cfht"):
+            specs = [tableSpecs.rawAmpExposure(camera), tableSpecs.rawAmpExposureMetadata,
+                     tableSpecs.rawAmpToScienceCcdExposure, tableSpecs.rawAmpExposureToHtm11]
+            self.assertStatementsEqual(
+                specs, lambda *paths: oldRawLoads(camera, *paths))
+        self.assertRaises(RuntimeError, tableSpecs.rawAmpExposure, "sdss")
+
+    def testColumns(self):
+        """Test that every column has a name and a writer type."""
+        for spec in (tableSpecs.rawAmpExposure("lsstsim"), tableSpecs.rawAmpExposure("cfht"),
+                     tableSpecs.scienceCcdExposure("lsstsim"), tableSpecs.scienceCcdExposure("sdss"),
+                     tableSpecs.scienceCcdExposureMetadata):
+            self.assertEqual(len(spec.names), len(set(spec.names)))
+            self.assertEqual(len(spec.types), len(spec.names))
+            self.assertFalse(set(name for name, expr in spec.setExprs) & set(spec.names))
+        self.assertEqual(tableSpecs.scienceCcdExposureMetadata.types, [long, str, int, int, float, str])
+        self.assertEqual(tableSpecs.rawAmpToScienceCcdExposure.types, [long, long, int, int])
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()